@@ -0,0 +1,17 @@
+from django.contrib.auth.backends import ModelBackend
+
+from .cache import user_cache
+
+
+class CachedModelBackend(ModelBackend):
+    """リクエストごとのユーザーの読み込み (get_user) を user_cache から行う ModelBackend
+
+    パスワードの変更や無効化は User の保存で user_cache から消えるため、次のリクエストで
+    セッションのハッシュの検証 (django.contrib.auth.get_user) に失敗してログアウトされる
+    """
+
+    def get_user(self, user_id):
+        user = user_cache.get(user_id)
+        if user is None or not self.user_can_authenticate(user):
+            return None
+        return user
@@ -0,0 +1,5 @@
+from mysite.object_cache import ObjectCache
+
+from .models import User
+
+user_cache = ObjectCache(User, alternate_key="username", is_visible=lambda user: user.deleted_at is None)
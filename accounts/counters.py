@@ -0,0 +1,38 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .cache import user_cache
+from .models import Friendship, User
+
+
+def record_follow_delta(follower_id, following_id, delta):
+    User.objects.filter(pk=follower_id).update(following_count=Greatest(F("following_count") + delta, 0))
+    User.objects.filter(pk=following_id).update(follower_count=Greatest(F("follower_count") + delta, 0))
+    user_cache.invalidate(follower_id)
+    user_cache.invalidate(following_id)
+
+
+def _actual_count(field):
+    counts = (
+        Friendship.objects.filter(**{field: OuterRef("pk")})
+        .order_by()
+        .values(field)
+        .annotate(n=Count("pk"))
+        .values("n")
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def annotate_actual_follow_counts(queryset):
+    return queryset.annotate(
+        actual_follower_count=_actual_count("following"), actual_following_count=_actual_count("follower")
+    )
+
+
+def recount_follow_counts(user_ids):
+    updated = User.objects.filter(pk__in=user_ids).update(
+        follower_count=_actual_count("following"), following_count=_actual_count("follower")
+    )
+    for user_id in user_ids:
+        user_cache.invalidate(user_id)
+    return updated
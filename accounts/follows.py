@@ -0,0 +1,105 @@
+from django.db import connections, router, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+
+from tweets.timeline import backfill, backfill_authors, purge
+
+from .counters import record_follow_delta, recount_follow_counts
+from .models import Friendship, User
+from .suggestions import record_graph_change
+
+FOLLOW_IMPORT_CHUNK_SIZE = 1000
+
+
+def _execute(connection, sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def _quoted(connection, *names):
+    table = connection.ops.quote_name(Friendship._meta.db_table)
+    return table, [connection.ops.quote_name(Friendship._meta.get_field(name).column) for name in names]
+
+
+def _insert_friendship(follower_id, following_id):
+    """一意制約に当たったら何もしない1文の INSERT で Friendship を作り、作った行数 (0 か 1) を返す"""
+    connection = connections[router.db_for_write(Friendship)]
+    fields = [Friendship._meta.get_field(name) for name in ("follower", "following", "created_at")]
+    table, columns = _quoted(connection, "follower", "following", "created_at")
+    insert = connection.ops.insert_statement(on_conflict=OnConflict.IGNORE)
+    suffix = connection.ops.on_conflict_suffix_sql(fields, OnConflict.IGNORE, None, None)
+    sql = f"{insert} {table} ({', '.join(columns)}) VALUES (%s, %s, %s) {suffix}".strip()
+    created_at = fields[2].get_db_prep_value(timezone.now(), connection)
+    return _execute(connection, sql, [follower_id, following_id, created_at])
+
+
+def _delete_friendship(follower_id, following_id):
+    # QuerySet.delete() はシグナルのために行を SELECT してから消すため、DELETE 文を直接使う
+    connection = connections[router.db_for_write(Friendship)]
+    table, (follower, following) = _quoted(connection, "follower", "following")
+    sql = f"DELETE FROM {table} WHERE {follower} = %s AND {following} = %s"
+    return _execute(connection, sql, [follower_id, following_id])
+
+
+def _record_change(follower, following, delta):
+    # Friendship のシグナル (accounts.signals) を通らないため、キャッシュの削除と変更の記録もここで行う
+    record_follow_delta(follower.pk, following.pk, delta)
+    record_graph_change(follower.pk)
+
+
+def follow(follower, following):
+    """新しくフォローしたかどうかを返す。すでにフォローしていれば何もしない"""
+    with transaction.atomic():
+        created = _insert_friendship(follower.pk, following.pk) == 1
+        if created:
+            _record_change(follower, following, 1)
+    if created:
+        backfill(follower, following)
+    return created
+
+
+def unfollow(follower, following):
+    with transaction.atomic():
+        deleted = _delete_friendship(follower.pk, following.pk) == 1
+        if deleted:
+            _record_change(follower, following, -1)
+    if deleted:
+        purge(follower, following)
+    return deleted
+
+
+def import_follows(follower, usernames, chunk_size=FOLLOW_IMPORT_CHUNK_SIZE):
+    """usernames のユーザーをまとめてフォローし、(見つかったユーザー数, 新しくフォローした数) を返す
+
+    チャンクごとに bulk_create(ignore_conflicts=True) で作り、フォロー数・フォロワー数は最後に
+    関係したユーザーの分だけ数え直す
+    """
+    usernames = list(dict.fromkeys(usernames))
+    before = Friendship.objects.filter(follower=follower).count()
+    following_ids = []
+    for start in range(0, len(usernames), chunk_size):
+        chunk = usernames[start : start + chunk_size]
+        ids = list(
+            User.objects.filter(username__in=chunk, deleted_at__isnull=True)
+            .exclude(pk=follower.pk)
+            .values_list("pk", flat=True)
+        )
+        with transaction.atomic():
+            Friendship.objects.bulk_create(
+                [Friendship(follower=follower, following_id=following_id) for following_id in ids],
+                ignore_conflicts=True,
+            )
+        following_ids += ids
+    if not following_ids:
+        return 0, 0
+
+    with transaction.atomic():
+        for start in range(0, len(following_ids), chunk_size):
+            recount_follow_counts(following_ids[start : start + chunk_size])
+        recount_follow_counts([follower.pk])
+        record_graph_change(follower.pk)
+    follower.refresh_from_db(fields=["following_count"])
+    for start in range(0, len(following_ids), chunk_size):
+        backfill_authors(follower, following_ids[start : start + chunk_size])
+    return len(following_ids), follower.following_count - before
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from accounts.suggestions import refresh_suggestions
+
+
+class Command(BaseCommand):
+    help = "フォロー関係から「おすすめユーザー」を計算し直します (既定では前回からフォローが変わったユーザーの分だけ)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top-k", type=int, default=10, help="ユーザーごとに保存するおすすめの数")
+        parser.add_argument("--full", action="store_true", help="全ユーザーの分を計算し直す")
+
+    def handle(self, *args, **options):
+        users, stored = refresh_suggestions(options["top_k"], full=options["full"])
+        self.stdout.write(self.style.SUCCESS(f"{users} 人のおすすめを計算し、{stored} 件を保存しました"))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.follows import FOLLOW_IMPORT_CHUNK_SIZE, import_follows
+from accounts.models import User
+
+
+class Command(BaseCommand):
+    help = "ファイル (1行に1ユーザー名) のユーザーを、指定したユーザーとしてまとめてフォローします"
+
+    def add_arguments(self, parser):
+        parser.add_argument("username", help="フォローするユーザー")
+        parser.add_argument("path", help="フォロー先のユーザー名を1行に1つずつ書いたファイル")
+        parser.add_argument("--chunk-size", type=int, default=FOLLOW_IMPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        follower = User.objects.filter(username=options["username"]).first()
+        if follower is None:
+            raise CommandError(f"ユーザー {options['username']} が見つかりません")
+        with open(options["path"], encoding="utf-8") as f:
+            usernames = [line.strip() for line in f if line.strip()]
+        found, followed = import_follows(follower, usernames, options["chunk_size"])
+        self.stdout.write(
+            self.style.SUCCESS(f"{len(usernames)} 人中 {found} 人が見つかり、{followed} 人を新しくフォローしました")
+        )
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+from accounts.counters import annotate_actual_follow_counts, recount_follow_counts
+from accounts.models import User
+
+
+class Command(BaseCommand):
+    help = "フォロー数・フォロワー数をチャンクごとに数え直し、ずれを報告します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true", help="ずれを報告するだけで更新しない")
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        checked = drifted = 0
+        last_pk = 0
+        while True:
+            users = list(
+                annotate_actual_follow_counts(User.objects.filter(pk__gt=last_pk).order_by("pk")).values(
+                    "pk",
+                    "username",
+                    "follower_count",
+                    "following_count",
+                    "actual_follower_count",
+                    "actual_following_count",
+                )[:chunk_size]
+            )
+            if not users:
+                break
+            last_pk = users[-1]["pk"]
+            checked += len(users)
+
+            drifted_ids = []
+            for user in users:
+                if (user["follower_count"], user["following_count"]) != (
+                    user["actual_follower_count"],
+                    user["actual_following_count"],
+                ):
+                    drifted_ids.append(user["pk"])
+                    self.stdout.write(
+                        f"{user['username']}: フォロワー {user['follower_count']} -> {user['actual_follower_count']}, "
+                        f"フォロー {user['following_count']} -> {user['actual_following_count']}"
+                    )
+            drifted += len(drifted_ids)
+            if drifted_ids and not options["dry_run"]:
+                recount_follow_counts(drifted_ids)
+
+        self.stdout.write(self.style.SUCCESS(f"{checked} 人中 {drifted} 人のカウントにずれがありました"))
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-17 15:54
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_follow_counts(apps, schema_editor):
+    User = apps.get_model("accounts", "User")
+    Friendship = apps.get_model("accounts", "Friendship")
+
+    def count_of(field):
+        counts = (
+            Friendship.objects.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(n=Count("pk"))
+            .values("n")
+        )
+        return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+    User.objects.update(follower_count=count_of("following"), following_count=count_of("follower"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0005_alter_friendship_following"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="follower_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="following_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_follow_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.30 on 2026-10-17 15:55
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicate_friendships(apps, schema_editor):
+    User = apps.get_model("accounts", "User")
+    Friendship = apps.get_model("accounts", "Friendship")
+
+    duplicates = (
+        Friendship.objects.values("following", "follower")
+        .annotate(keep=Min("pk"), n=Count("pk"))
+        .filter(n__gt=1)
+        .order_by()
+    )
+    affected = set()
+    for row in list(duplicates):
+        Friendship.objects.filter(following=row["following"], follower=row["follower"]).exclude(
+            pk=row["keep"]
+        ).delete()
+        affected.update((row["following"], row["follower"]))
+
+    def count_of(field):
+        counts = (
+            Friendship.objects.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(n=Count("pk"))
+            .values("n")
+        )
+        return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+    User.objects.filter(pk__in=affected).update(
+        follower_count=count_of("following"), following_count=count_of("follower")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0006_user_follow_counts"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_friendships, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="friendship",
+            index=models.Index(fields=["follower", "created_at"], name="follow_follower_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="friendship",
+            index=models.Index(fields=["following", "created_at"], name="follow_following_created_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="friendship",
+            constraint=models.UniqueConstraint(fields=("following", "follower"), name="follow_unique"),
+        ),
+    ]
@@ -5,6 +5,16 @@ from django.db import models
 
 class User(AbstractUser):
     email = models.EmailField()
+    follower_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    # 退会するとすぐに隠し (is_active も外す)、ツイートやフォローは purge_deleted が後から少しずつ消す
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta(AbstractUser.Meta):
+        swappable = "AUTH_USER_MODEL"
+        indexes = [
+            models.Index(fields=["id"], name="user_deleted_idx", condition=models.Q(deleted_at__isnull=False)),
+        ]
 
 
 class Friendship(models.Model):
@@ -12,8 +22,33 @@ class Friendship(models.Model):
     follower = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="followers")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["following", "follower"], name="follow_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["follower", "created_at"], name="follow_follower_created_idx"),
+            models.Index(fields=["following", "created_at"], name="follow_following_created_idx"),
+        ]
+
+
+class FollowSuggestion(models.Model):
+    """バッチ (compute_suggestions) で計算した「おすすめユーザー」。フォロー中のユーザーがフォローしている人数が多い順"""
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="follow_suggestions")
+    suggested = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+")
+    mutual_count = models.PositiveIntegerField()
 
-class Meta:
-    constraints = [
-        models.UniqueConstraint(fields=["following", "follower"], name="follow_unique"),
-    ]
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["user", "suggested"], name="unique_follow_suggestion")]
+        indexes = [models.Index(fields=["user", "-mutual_count"], name="suggestion_user_mutual_idx")]
+
+
+class FollowGraphChange(models.Model):
+    """フォロー・アンフォローしたユーザーの記録。次の compute_suggestions でこのユーザーとフォロワーを計算し直す"""
+
+    # ユーザーの削除で Friendship が消えるときにも記録するため、外部キー制約は付けない (消えたユーザーは計算時に無視する)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
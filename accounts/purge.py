@@ -0,0 +1,93 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from mysite.chunked_delete import delete_in_chunks, delete_rows, raw_delete
+from tweets import stamps
+from tweets.cache import tweet_cache
+from tweets.likers import invalidate_likers_head
+from tweets.models import Like, TimelineEntry, Tweet
+from tweets.purge import PURGE_CHUNK_SIZE, hide_tweets, purge_deleted_tweets
+
+from .cache import user_cache
+from .models import FollowGraphChange, FollowSuggestion, Friendship, User
+
+
+def soft_delete_user(user):
+    """退会したユーザーをすぐに隠し、ログインできなくする
+
+    ツイートとフォロー関係は読むときに退会済みのユーザーのものを除くため、ここでは書き換えない (件数によらず
+    ユーザーの行だけを更新する)。ツイートを隠す・フォロー関係を消してフォロー数を直すのは purge_user が後から行う
+    """
+    with transaction.atomic():
+        user.deleted_at = timezone.now()
+        user.is_active = False
+        # user_cache はシグナル (accounts.signals) で消える。セッションは CachedModelBackend が無効なユーザーとして扱う
+        user.save(update_fields=["deleted_at", "is_active"])
+    stamps.bump("deleted_users")
+
+
+def _delete_likes(rows):
+    # いいねしていたツイートのいいね数を1ずつ減らす (1人は1つのツイートに1回しかいいねできない)
+    raw_delete(Like, [pk for pk, _ in rows])
+    tweet_ids = [tweet_id for _, tweet_id in rows]
+    Tweet.all_objects.filter(pk__in=tweet_ids).update(like_count=Greatest(F("like_count") - 1, 0))
+    for tweet_id in tweet_ids:
+        tweet_cache.invalidate(tweet_id)
+        invalidate_likers_head(tweet_id)
+
+
+def _delete_friendships(count_field, record_changes):
+    """Friendship を消し、相手側のユーザーの count_field を1ずつ減らす"""
+
+    def delete(rows):
+        raw_delete(Friendship, [pk for pk, _ in rows])
+        user_ids = [user_id for _, user_id in rows]
+        User.objects.filter(pk__in=user_ids).update(**{count_field: Greatest(F(count_field) - 1, 0)})
+        for user_id in user_ids:
+            user_cache.invalidate(user_id)
+        if record_changes:
+            FollowGraphChange.objects.bulk_create([FollowGraphChange(user_id=user_id) for user_id in user_ids])
+
+    return delete
+
+
+def _delete_user_friendships(user_id, chunk_size):
+    delete_in_chunks(
+        Friendship.objects.filter(follower_id=user_id),
+        ("pk", "following_id"),
+        chunk_size,
+        _delete_friendships("follower_count", record_changes=False),
+    )
+    # フォロワーの「おすすめユーザー」から外すため、フォロワーのフォローの変更として記録する
+    delete_in_chunks(
+        Friendship.objects.filter(following_id=user_id),
+        ("pk", "follower_id"),
+        chunk_size,
+        _delete_friendships("following_count", record_changes=True),
+    )
+
+
+def purge_user(user_id, chunk_size=PURGE_CHUNK_SIZE):
+    """退会したユーザーに関係する行を、カウントを合わせながらチャンクごとに消し、最後にユーザーを消す"""
+    # ツイートを隠して検索・トレンドから外し、フォロー関係を消してフォロー数を直す
+    hide_tweets(user_id, chunk_size)
+    _delete_user_friendships(user_id, chunk_size)
+    delete_in_chunks(Like.objects.filter(likeuser_id=user_id), ("pk", "liketweet_id"), chunk_size, _delete_likes)
+    delete_in_chunks(TimelineEntry.objects.filter(owner_id=user_id), ("pk",), chunk_size, delete_rows(TimelineEntry))
+    for field in ("user_id", "suggested_id"):
+        delete_in_chunks(
+            FollowSuggestion.objects.filter(**{field: user_id}), ("pk",), chunk_size, delete_rows(FollowSuggestion)
+        )
+    purge_deleted_tweets(Tweet.all_objects.filter(user_id=user_id), chunk_size)
+    # 残っているのは管理画面のログなどの少ない行だけのため、通常の削除で消す
+    with transaction.atomic():
+        User.objects.filter(pk=user_id).delete()
+
+
+def purge_deleted_users(chunk_size=PURGE_CHUNK_SIZE):
+    user_ids = list(User.objects.filter(deleted_at__isnull=False).values_list("pk", flat=True))
+    for user_id in user_ids:
+        purge_user(user_id, chunk_size)
+    return len(user_ids)
@@ -0,0 +1,24 @@
+from django.db.models import Q
+
+from .models import Friendship
+
+
+def annotate_relationships(viewer, users):
+    """閲覧ユーザーが各ユーザーをフォローしているか (followed_by_viewer)、各ユーザーが閲覧ユーザーを
+    フォローしているか (follows_viewer) を、表示するユーザーの分だけ1回のクエリで付ける
+    """
+    user_ids = [user.pk for user in users]
+    following, followers = set(), set()
+    if user_ids:
+        rows = Friendship.objects.filter(
+            Q(follower=viewer, following_id__in=user_ids) | Q(following=viewer, follower_id__in=user_ids)
+        ).values_list("follower_id", "following_id")
+        for follower_id, following_id in rows:
+            if follower_id == viewer.pk:
+                following.add(following_id)
+            if following_id == viewer.pk:
+                followers.add(follower_id)
+    for user in users:
+        user.followed_by_viewer = user.pk in following
+        user.follows_viewer = user.pk in followers
+    return users
@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import user_cache
+from .models import Friendship, User
+from .suggestions import record_graph_change
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user(sender, instance, **kwargs):
+    user_cache.invalidate(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Friendship)
+def invalidate_friendship_users(sender, instance, **kwargs):
+    # フォロー数・フォロワー数が変わるため両方のユーザーを消す
+    user_cache.invalidate(instance.follower_id)
+    user_cache.invalidate(instance.following_id)
+
+
+@receiver([post_save, post_delete], sender=Friendship)
+def record_friendship_change(sender, instance, **kwargs):
+    if kwargs.get("created", True):
+        record_graph_change(instance.follower_id)
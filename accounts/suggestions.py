@@ -0,0 +1,126 @@
+import heapq
+from array import array
+
+from django.db import transaction
+from django.db.models import Max
+
+from .models import FollowGraphChange, FollowSuggestion, Friendship, User
+
+SUGGESTION_BATCH_SIZE = 1000
+# ホーム・プロフィールに表示するおすすめの数
+SUGGESTION_PANEL_SIZE = 5
+
+
+class FollowGraph:
+    """フォロー関係を CSR 形式 (offsets と targets の整数配列) で持つ。ユーザーは 0 始まりの連番で表す"""
+
+    def __init__(self, user_ids, edges):
+        self.user_ids = array("q", user_ids)
+        self.index = {user_id: i for i, user_id in enumerate(self.user_ids)}
+        n = len(self.user_ids)
+
+        offsets = array("l", [0]) * (n + 1)
+        sources = array("l")
+        destinations = array("l")
+        for follower_id, following_id in edges:
+            source, destination = self.index.get(follower_id), self.index.get(following_id)
+            if source is None or destination is None:
+                continue
+            sources.append(source)
+            destinations.append(destination)
+            offsets[source + 1] += 1
+        for i in range(n):
+            offsets[i + 1] += offsets[i]
+        self.offsets = offsets
+
+        # フォローする側ごとに、フォロー先を連続した区間に並べる
+        self.targets = array("l", [0]) * len(destinations)
+        position = offsets[:n]
+        for source, destination in zip(sources, destinations):
+            self.targets[position[source]] = destination
+            position[source] += 1
+
+    @classmethod
+    def load(cls):
+        user_ids = (
+            User.objects.filter(deleted_at__isnull=True)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+            .iterator(chunk_size=10000)
+        )
+        edges = Friendship.objects.values_list("follower_id", "following_id").iterator(chunk_size=10000)
+        return cls(list(user_ids), edges)
+
+    def following(self, i):
+        return self.targets[self.offsets[i] : self.offsets[i + 1]]
+
+    def followers_of(self, indices):
+        # 逆向きの辺は持たないため、全体を一度なめて探す (差分更新で対象を広げるときにだけ使う)
+        indices = set(indices)
+        return {i for i in range(len(self.user_ids)) for j in self.following(i) if j in indices}
+
+    def suggest(self, i, top_k):
+        """i がフォローしているユーザーがフォローしている人を、その人数 (共通のフォロー数) の多い順に top_k 人"""
+        following = self.following(i)
+        excluded = set(following)
+        excluded.add(i)
+        scores = {}
+        for j in following:
+            for candidate in self.following(j):
+                if candidate not in excluded:
+                    scores[candidate] = scores.get(candidate, 0) + 1
+        # 同数なら先に登録したユーザーを優先する
+        return heapq.nsmallest(top_k, scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+def _store(graph, indices, top_k):
+    stored = 0
+    indices = sorted(indices)
+    for start in range(0, len(indices), SUGGESTION_BATCH_SIZE):
+        chunk = indices[start : start + SUGGESTION_BATCH_SIZE]
+        suggestions = [
+            FollowSuggestion(
+                user_id=graph.user_ids[i], suggested_id=graph.user_ids[candidate], mutual_count=mutual_count
+            )
+            for i in chunk
+            for candidate, mutual_count in graph.suggest(i, top_k)
+        ]
+        with transaction.atomic():
+            FollowSuggestion.objects.filter(user_id__in=[graph.user_ids[i] for i in chunk]).delete()
+            FollowSuggestion.objects.bulk_create(suggestions)
+        stored += len(suggestions)
+    return stored
+
+
+def refresh_suggestions(top_k, full=False):
+    """おすすめを計算し直し、(計算したユーザー数, 保存したおすすめの数) を返す
+
+    full でなければ、前回から FollowGraphChange に記録されたユーザーとそのフォロワーだけを計算し直す
+    """
+    # 計算中に記録された変更は次回に回す
+    last_change = FollowGraphChange.objects.aggregate(last=Max("pk"))["last"] or 0
+    graph = FollowGraph.load()
+    if full:
+        indices = range(len(graph.user_ids))
+    else:
+        changed_ids = FollowGraphChange.objects.filter(pk__lte=last_change).values_list("user_id", flat=True)
+        changed = {graph.index[user_id] for user_id in changed_ids if user_id in graph.index}
+        # フォローの変更は、本人と、本人をフォローしている人 (2歩先が変わる) のおすすめに影響する
+        indices = changed | graph.followers_of(changed) if changed else set()
+    stored = _store(graph, indices, top_k)
+    FollowGraphChange.objects.filter(pk__lte=last_change).delete()
+    return len(indices), stored
+
+
+def record_graph_change(user_id):
+    FollowGraphChange.objects.create(user_id=user_id)
+
+
+def suggestions_for(user, limit):
+    # バッチの後にフォローしたユーザーは除く
+    return list(
+        FollowSuggestion.objects.filter(user=user, suggested__deleted_at__isnull=True)
+        .exclude(suggested__in=Friendship.objects.filter(follower=user).values("following"))
+        .select_related("suggested")
+        .order_by("-mutual_count", "suggested_id")[:limit]
+    )
@@ -1,10 +1,29 @@
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth import SESSION_KEY, get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-
-from accounts.models import Friendship
-from tweets.models import Tweet
+from django.utils import timezone
+
+from accounts.cache import user_cache
+from accounts.follows import follow, import_follows, unfollow
+from accounts.models import FollowGraphChange, FollowSuggestion, Friendship
+from accounts.suggestions import FollowGraph, refresh_suggestions
+from accounts.views import FollowingListView
+from mysite.testing import QueryBudgetMixin, QueryPlanAssertionsMixin
+from tweets import trending
+from tweets.models import Like, TimelineEntry, Tweet
+from tweets.pagination import filter_before
+from tweets.timeline import fan_out
 
 User = get_user_model()
 
@@ -259,6 +278,118 @@ class TestLogoutView(TestCase):
         self.assertNotIn(SESSION_KEY, self.client.session)
 
 
+class TestCachedAuthentication(TestCase):
+    def setUp(self):
+        # 他のテストがキャッシュに残したいいねの先頭などを読まないようにする
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        self.tweet = Tweet.objects.create(user=self.user, content="testtweet")
+        self.url = reverse("tweets:detail", kwargs={"pk": self.tweet.pk})
+
+    def test_session_and_user_from_cache(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        tables = " ".join(query["sql"] for query in queries.captured_queries)
+        self.assertNotIn("django_session", tables)
+        self.assertNotIn('FROM "accounts_user"', tables)
+
+    def test_password_change_logs_out(self):
+        self.client.get(self.url)
+        self.user.set_password("newpassword")
+        self.user.save()
+        response = self.client.get(self.url)
+        self.assertRedirects(response, f"{reverse(settings.LOGIN_URL)}?next={self.url}")
+
+    def test_logout_revokes_session(self):
+        session_key = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        self.client.post(reverse("accounts:logout"))
+        # ログアウト前の Cookie を送り直しても、キャッシュにも DB にもセッションは残っていない
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session_key
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+
+    def test_inactive_user_logs_out(self):
+        self.client.get(self.url)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+
+class TestAccountDelete(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.friend = User.objects.create_user(username="friend", password="testpassword")
+        self.fan = User.objects.create_user(username="fan", password="testpassword")
+        follow(self.user, self.friend)
+        follow(self.fan, self.user)
+        self.tweet = Tweet.objects.create(user=self.user, content="my tweet")
+        self.liked = Tweet.objects.create(user=self.friend, content="liked")
+        Like.objects.create(likeuser=self.user, liketweet=self.liked)
+        Like.objects.create(likeuser=self.fan, liketweet=self.tweet)
+        Tweet.objects.filter(pk=self.liked.pk).update(like_count=1)
+        self.client.login(username="testuser", password="testpassword")
+
+    def test_soft_delete_hides_immediately(self):
+        response = self.client.post(reverse("accounts:account_delete"))
+        self.assertRedirects(response, reverse(settings.LOGOUT_REDIRECT_URL))
+        self.assertNotIn(SESSION_KEY, self.client.session)
+        self.assertFalse(self.client.login(username="testuser", password="testpassword"))
+
+        self.client.force_login(self.fan)
+        response = self.client.get(reverse("accounts:user_profile", kwargs={"username": "testuser"}))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post(reverse("accounts:follow", kwargs={"username": "testuser"}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_soft_delete_hides_tweets_and_follows(self):
+        fan_out(self.tweet)
+        trending.add_score(self.tweet.pk, 1)
+        self.client.force_login(self.fan)
+        self.assertContains(self.client.get(reverse("tweets:home")), "my tweet")
+        # キャッシュに載ったツイートも、作者が退会すれば見つからなくなる
+        self.assertEqual(self.client.get(reverse("tweets:detail", kwargs={"pk": self.tweet.pk})).status_code, 200)
+        self.client.force_login(self.user)
+        self.client.post(reverse("accounts:account_delete"))
+
+        self.client.force_login(self.fan)
+        self.assertNotContains(self.client.get(reverse("tweets:home")), "my tweet")
+        self.assertEqual(list(self.client.get(reverse("tweets:search"), {"q": "my tweet"}).context["tweets"]), [])
+        self.assertNotContains(self.client.get(reverse("tweets:trending")), "my tweet")
+        self.assertEqual(self.client.get(reverse("tweets:detail", kwargs={"pk": self.tweet.pk})).status_code, 404)
+        self.assertEqual(self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk})).status_code, 404)
+        response = self.client.get(reverse("accounts:following_list", kwargs={"username": "fan"}))
+        self.assertNotContains(response, "testuser")
+        # 退会ではユーザーの行だけを書き換え、ツイート・フォロー関係の行は purge_deleted が後から片付ける
+        self.assertTrue(Tweet.all_objects.filter(pk=self.tweet.pk, deleted_at__isnull=True).exists())
+        self.assertTrue(Friendship.objects.filter(following=self.user).exists())
+
+        call_command("purge_deleted", stdout=StringIO())
+        self.fan.refresh_from_db()
+        self.friend.refresh_from_db()
+        self.assertEqual(self.fan.following_count, 0)
+        self.assertEqual(self.friend.follower_count, 0)
+
+    def test_purge_keeps_counters(self):
+        self.client.post(reverse("accounts:account_delete"))
+        out = StringIO()
+        call_command("purge_deleted", "--chunk-size=1", stdout=out)
+        self.assertIn("1 人のユーザー", out.getvalue())
+
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(Tweet.all_objects.filter(pk=self.tweet.pk).exists())
+        self.assertFalse(Friendship.objects.exists())
+        self.assertFalse(Like.objects.exists())
+        self.assertEqual(Tweet.objects.get(pk=self.liked.pk).like_count, 0)
+        self.friend.refresh_from_db()
+        self.fan.refresh_from_db()
+        self.assertEqual(self.friend.follower_count, 0)
+        self.assertEqual(self.fan.following_count, 0)
+        self.assertTrue(FollowGraphChange.objects.filter(user=self.fan).exists())
+
+
 class TestUserProfileView(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username="testuser", password="testpassword")
@@ -274,6 +405,57 @@ class TestUserProfileView(TestCase):
         self.assertTemplateUsed(response, "accounts/profile.html")
         self.assertQuerysetEqual(response.context["object_list"], Tweet.objects.all())
 
+    def test_success_get_by_cursor(self):
+        tweets = [self.tweet] + [Tweet.objects.create(user=self.user, content=f"tweet{i}") for i in range(24)]
+        response = self.client.get(self.url)
+        page = response.context["page_obj"]
+        self.assertEqual(list(response.context["tweets"]), tweets[:4:-1])
+        self.assertTrue(page.has_next)
+        response = self.client.get(self.url, {"cursor": page.next_cursor})
+        self.assertEqual(list(response.context["tweets"]), tweets[4::-1])
+        self.assertFalse(response.context["page_obj"].has_next)
+
+    def test_follow_button(self):
+        other = User.objects.create_user(username="other", password="testpassword")
+        url = reverse("accounts:user_profile", kwargs={"username": other.username})
+        self.assertContains(self.client.get(url), reverse("accounts:follow", kwargs={"username": other.username}))
+        follow(self.user, other)
+        response = self.client.get(url)
+        self.assertTrue(response.context["is_following"])
+        self.assertContains(response, reverse("accounts:unfollow", kwargs={"username": other.username}))
+
+
+class TestProfileTweetsApiView(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_login(self.user)
+        self.tweets = [Tweet.objects.create(user=self.user, content=f"tweet{i}") for i in range(3)]
+        self.url = reverse("accounts:api_tweets", kwargs={"username": self.user.username})
+
+    def test_success_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [tweet["id"] for tweet in response.json()["tweets"]], [tweet.pk for tweet in self.tweets[::-1]]
+        )
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response.headers["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_success_get_modified_by_new_tweet(self):
+        etag = self.client.get(self.url).headers["ETag"]
+        Tweet.objects.create(user=self.user, content="new")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_success_get_with_since_id(self):
+        response = self.client.get(self.url, {"since_id": self.tweets[0].pk})
+        self.assertEqual([tweet["id"] for tweet in response.json()["tweets"]], [self.tweets[2].pk, self.tweets[1].pk])
+
+    def test_failure_get_with_not_exists_user(self):
+        response = self.client.get(reverse("accounts:api_tweets", kwargs={"username": "nonexistent"}))
+        self.assertEqual(response.status_code, 404)
+
 
 # class TestUserProfileEditView(TestCase):
 #     def test_success_get(self):
@@ -300,6 +482,10 @@ class TestFollowView(TestCase):
             target_status_code=200,
         )
         self.assertTrue(Friendship.objects.filter(follower=self.user, following=self.user2).exists())
+        self.user.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user.following_count, 1)
+        self.assertEqual(self.user2.follower_count, 1)
 
     def test_failure_post_with_not_exist_user(self):
         response = self.client.post(reverse("accounts:follow", kwargs={"username": "nonexistent_user"}))
@@ -311,6 +497,69 @@ class TestFollowView(TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertFalse(Friendship.objects.filter(follower=self.user, following=self.user).exists())
 
+    async def test_success_post_on_asgi(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.post(reverse("accounts:follow", kwargs={"username": self.user2.username}))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(await Friendship.objects.filter(follower=self.user, following=self.user2).aexists())
+        response = await self.async_client.post(reverse("accounts:follow", kwargs={"username": self.user2.username}))
+        self.assertEqual(response.status_code, 400)
+
+
+class TestFollows(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.others = [User.objects.create_user(username=f"other{i}", password="testpassword") for i in range(3)]
+
+    def assertCounts(self, user, following, followers):
+        user.refresh_from_db()
+        self.assertEqual((user.following_count, user.follower_count), (following, followers))
+
+    def test_follow_and_unfollow_are_idempotent(self):
+        other = self.others[0]
+        self.assertTrue(follow(self.user, other))
+        self.assertFalse(follow(self.user, other))
+        self.assertCounts(self.user, 1, 0)
+        self.assertCounts(other, 0, 1)
+        self.assertTrue(FollowGraphChange.objects.filter(user=self.user).exists())
+
+        self.assertTrue(unfollow(self.user, other))
+        self.assertFalse(unfollow(self.user, other))
+        self.assertCounts(self.user, 0, 0)
+        self.assertCounts(other, 0, 0)
+
+    def test_follow_invalidates_cache(self):
+        other = self.others[0]
+        user_cache.get(other.pk)
+        follow(self.user, other)
+        self.assertEqual(user_cache.get(other.pk).follower_count, 1)
+
+    def test_import_follows(self):
+        follow(self.user, self.others[0])
+        tweet = Tweet.objects.create(user=self.others[1], content="imported")
+        usernames = ["other0", "other1", "other2", "other2", "testuser", "missing"]
+        self.assertEqual(import_follows(self.user, usernames, chunk_size=2), (3, 2))
+        self.assertCounts(self.user, 3, 0)
+        for other in self.others:
+            self.assertCounts(other, 0, 1)
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.user, tweet=tweet).exists())
+
+    def test_import_view(self):
+        self.client.force_login(self.user)
+        url = reverse("accounts:follow_import")
+        response = self.client.post(url, {"usernames": ["other0", "other1"]}, content_type="application/json")
+        self.assertEqual(response.json(), {"status": "ok", "found": 2, "followed": 2})
+        response = self.client.post(url, {"names": []}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_import_command(self):
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), "follows.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("other0\nother1\n\nmissing\n")
+        out = StringIO()
+        call_command("import_follows", "testuser", path, stdout=out)
+        self.assertIn("3 人中 2 人が見つかり、2 人を新しくフォローしました", out.getvalue())
+
 
 class TestUnfollowView(TestCase):
     def setUp(self):
@@ -329,12 +578,20 @@ class TestUnfollowView(TestCase):
             target_status_code=200,
         )
         self.assertFalse(Friendship.objects.filter(follower=self.user, following=self.user2).exists())
+        self.user.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user.following_count, 0)
+        self.assertEqual(self.user2.follower_count, 0)
 
     def test_failure_post_with_not_exist_user(self):
         response = self.client.post(reverse("accounts:unfollow", kwargs={"username": "nonexistent_user"}))
         self.assertEqual(response.status_code, 404)
         self.assertTrue(Friendship.objects.filter(follower=self.user, following=self.user2).exists())
 
+    def test_failure_unfollow_self(self):
+        response = self.client.post(reverse("accounts:unfollow", kwargs={"username": self.user.username}))
+        self.assertEqual(response.status_code, 400)
+
     def test_failure_post_with_incorrect_user(self):
         user_to_unfollow = get_user_model().objects.create_user(username="user_to_unfollow", password="testpassword")
         response = self.client.post(reverse("accounts:unfollow", kwargs={"username": user_to_unfollow.username}))
@@ -356,6 +613,36 @@ class TestFollowingListView(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertCountEqual(list(response.context["following_list"]), [self.friendship1, self.friendship2])
 
+    def test_success_get_with_cursor(self):
+        others = [User.objects.create_user(username=f"other{i}", password="testpassword") for i in range(3)]
+        for other in others:
+            Friendship.objects.create(follower=self.user, following=other)
+        # created_at が同じでも id で順序が決まることを確認する
+        Friendship.objects.update(created_at=self.friendship1.created_at)
+        url = reverse("accounts:following_list", kwargs={"username": self.user.username})
+        with mock.patch.object(FollowingListView, "paginate_by", 3):
+            response = self.client.get(url)
+            first_page = [friendship.following for friendship in response.context["following_list"]]
+            self.assertEqual(first_page, others[::-1])
+            response = self.client.get(url, {"cursor": response.context["page_obj"].next_cursor})
+        self.assertEqual(
+            [friendship.following for friendship in response.context["following_list"]], [self.user3, self.user2]
+        )
+        self.assertFalse(response.context["page_obj"].has_next)
+
+    def test_relationship_flags(self):
+        Friendship.objects.create(follower=self.user3, following=self.user)
+        # 他のユーザーのフォローリストを、閲覧ユーザーとの関係付きで表示する
+        Friendship.objects.create(follower=self.user2, following=self.user3)
+        self.client.force_login(self.user2)
+        response = self.client.get(reverse("accounts:following_list", kwargs={"username": self.user.username}))
+        users = {
+            friendship.following.username: friendship.following for friendship in response.context["following_list"]
+        }
+        self.assertEqual((users["tester2"].followed_by_viewer, users["tester2"].follows_viewer), (True, False))
+        self.assertEqual((users["tester"].followed_by_viewer, users["tester"].follows_viewer), (False, False))
+        self.assertContains(response, "フォローを解除")
+
 
 class TestFollowerListView(TestCase):
     def setUp(self):
@@ -370,3 +657,194 @@ class TestFollowerListView(TestCase):
         response = self.client.get(reverse("accounts:follower_list", kwargs={"username": self.user.username}))
         self.assertEqual(response.status_code, 200)
         self.assertCountEqual(list(response.context["follower_list"]), Friendship.objects.all())
+
+    def test_relationship_flags(self):
+        Friendship.objects.create(follower=self.user, following=self.user2)
+        response = self.client.get(reverse("accounts:follower_list", kwargs={"username": self.user.username}))
+        users = {friendship.follower.username: friendship.follower for friendship in response.context["follower_list"]}
+        self.assertEqual((users["tester"].followed_by_viewer, users["tester"].follows_viewer), (True, True))
+        self.assertEqual((users["tester2"].followed_by_viewer, users["tester2"].follows_viewer), (False, True))
+
+
+class TestRecountFollowsCommand(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.user2 = User.objects.create_user(username="tester", password="testpassword")
+        Friendship.objects.create(follower=self.user, following=self.user2)
+
+    def test_success_recount(self):
+        out = StringIO()
+        call_command("recount_follows", "--chunk-size=1", stdout=out)
+        self.assertIn("2 人中 2 人", out.getvalue())
+        self.user.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.assertEqual((self.user.following_count, self.user.follower_count), (1, 0))
+        self.assertEqual((self.user2.following_count, self.user2.follower_count), (0, 1))
+
+    def test_success_dry_run(self):
+        call_command("recount_follows", "--dry-run", stdout=StringIO())
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user2.follower_count, 0)
+
+
+class TestFollowSuggestions(TestCase):
+    def setUp(self):
+        # a -> b, c / b -> d, e / c -> d / d -> a
+        self.a, self.b, self.c, self.d, self.e = (
+            User.objects.create_user(username=name, password="testpassword") for name in "abcde"
+        )
+        for follower, following in [
+            (self.a, self.b),
+            (self.a, self.c),
+            (self.b, self.d),
+            (self.b, self.e),
+            (self.c, self.d),
+            (self.d, self.a),
+        ]:
+            Friendship.objects.create(follower=follower, following=following)
+
+    def suggested(self, user):
+        return list(
+            FollowSuggestion.objects.filter(user=user)
+            .order_by("-mutual_count", "suggested_id")
+            .values_list("suggested__username", "mutual_count")
+        )
+
+    def test_graph_scores_mutual_follows(self):
+        graph = FollowGraph.load()
+        a = graph.index[self.a.pk]
+        suggestions = [(graph.user_ids[i], count) for i, count in graph.suggest(a, 10)]
+        self.assertEqual(suggestions, [(self.d.pk, 2), (self.e.pk, 1)])
+        self.assertEqual(graph.suggest(a, 1), [(graph.index[self.d.pk], 2)])
+
+    def test_full_refresh(self):
+        self.assertEqual(refresh_suggestions(10, full=True), (5, 6))
+        self.assertEqual(self.suggested(self.a), [("d", 2), ("e", 1)])
+        # 自分自身とフォロー済みのユーザーは含めない
+        self.assertEqual(self.suggested(self.b), [("a", 1)])
+        self.assertEqual(self.suggested(self.d), [("b", 1), ("c", 1)])
+        self.assertFalse(FollowGraphChange.objects.exists())
+
+    def test_incremental_refresh(self):
+        refresh_suggestions(10, full=True)
+        Friendship.objects.create(follower=self.c, following=self.e)
+        # c とそのフォロワーの a だけを計算し直す
+        self.assertEqual(refresh_suggestions(10)[0], 2)
+        self.assertEqual(self.suggested(self.a), [("d", 2), ("e", 2)])
+        self.assertEqual(refresh_suggestions(10), (0, 0))
+
+    def test_change_recorded_on_user_delete(self):
+        self.e.delete()
+        refresh_suggestions(10)
+        self.assertEqual(self.suggested(self.a), [("d", 2)])
+
+    def test_command(self):
+        out = StringIO()
+        call_command("compute_suggestions", "--full", "--top-k=1", stdout=out)
+        self.assertIn("5 人のおすすめを計算し、4 件を保存しました", out.getvalue())
+
+    def test_panel_hides_followed_users(self):
+        refresh_suggestions(10, full=True)
+        self.client.force_login(self.a)
+        response = self.client.get(reverse("accounts:user_profile", kwargs={"username": "a"}))
+        self.assertEqual([s.suggested for s in response.context["suggestions"]], [self.d, self.e])
+        self.assertContains(response, "おすすめユーザー")
+        Friendship.objects.create(follower=self.a, following=self.d)
+        response = self.client.get(reverse("tweets:home"))
+        self.assertEqual([s.suggested for s in response.context["suggestions"]], [self.e])
+
+
+class TestFriendshipConstraint(TestCase):
+    def test_failure_duplicate_friendship(self):
+        user = User.objects.create_user(username="testuser", password="testpassword")
+        user2 = User.objects.create_user(username="tester", password="testpassword")
+        Friendship.objects.create(follower=user, following=user2)
+        with self.assertRaises(IntegrityError):
+            Friendship.objects.create(follower=user, following=user2)
+
+
+class TestQueryPlans(QueryPlanAssertionsMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+
+    def test_following_list(self):
+        queryset = Friendship.objects.filter(follower=self.user).order_by("-created_at")[:20]
+        self.assertIn("follow_follower_created_idx", self.assertIndexedPlan(queryset))
+
+    def test_follower_list(self):
+        queryset = Friendship.objects.filter(following=self.user).order_by("-created_at")[:20]
+        self.assertIn("follow_following_created_idx", self.assertIndexedPlan(queryset))
+
+    def test_follower_list_keyset_page(self):
+        queryset = filter_before(Friendship.objects.filter(following=self.user), (timezone.now(), 1))
+        queryset = queryset.order_by("-created_at", "-id")[:51]
+        self.assertIn("follow_following_created_idx", self.assertIndexedPlan(queryset))
+
+    def test_profile_keyset_page(self):
+        queryset = filter_before(Tweet.objects.filter(user=self.user), (timezone.now(), 1))
+        queryset = queryset.select_related("user").order_by("-created_at", "-id")[:21]
+        self.assertIn("tweet_user_created_idx", self.assertIndexedPlan(queryset))
+
+    def test_fanout_on_read_authors(self):
+        queryset = Friendship.objects.filter(follower=self.user, following__follower_count__gt=0)
+        self.assertIndexedPlan(queryset.values_list("following_id", flat=True))
+
+
+class TestUserCache(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+
+    def test_get_by_username(self):
+        self.assertEqual(user_cache.get_by_alternate_key("testuser"), self.user)
+        self.user.username = "renamed"
+        self.user.save()
+        self.assertIsNone(user_cache.get_by_alternate_key("testuser"))
+        self.assertEqual(user_cache.get_by_alternate_key("renamed"), self.user)
+
+    def test_invalidate_on_follow(self):
+        user2 = User.objects.create_user(username="tester", password="testpassword")
+        user_cache.get(user2.pk)
+        self.client.force_login(self.user)
+        self.client.post(reverse("accounts:follow", kwargs={"username": user2.username}))
+        self.assertEqual(user_cache.get(user2.pk).follower_count, 1)
+
+
+class TestViewBudgets(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_login(self.user)
+
+    def test_profile(self):
+        self.assertQueryBudget(
+            "UserProfileView",
+            5,
+            "get",
+            lambda: reverse("accounts:user_profile", kwargs={"username": "testuser"}),
+            warm_budget=3,
+        )
+
+    def test_following_list(self):
+        self.assertQueryBudget(
+            "FollowingListView",
+            4,
+            "get",
+            lambda: reverse("accounts:following_list", kwargs={"username": "testuser"}),
+            warm_budget=2,
+        )
+
+    def test_follower_list(self):
+        self.assertQueryBudget(
+            "FollowerListView",
+            4,
+            "get",
+            lambda: reverse("accounts:follower_list", kwargs={"username": "testuser"}),
+            warm_budget=2,
+        )
+
+    def test_follow(self):
+        # 計測のたびにまだフォローしていないユーザーをフォローする
+        def url_for():
+            following_user = User.objects.create_user(username=f"following{User.objects.count()}")
+            return reverse("accounts:follow", kwargs={"username": following_user.username})
+
+        self.assertQueryBudget("FollowView", 11, "post", url_for)
@@ -10,9 +10,12 @@ urlpatterns = [
     path("signup/", views.SignupView.as_view(), name="signup"),
     path("login/", LoginView.as_view(template_name="accounts/login.html"), name="login"),
     path("logout/", LogoutView.as_view(), name="logout"),
+    path("account/delete/", views.AccountDeleteView.as_view(), name="account_delete"),
+    path("follows/import/", views.FollowImportView.as_view(), name="follow_import"),
     path("<str:username>/", views.UserProfileView.as_view(), name="user_profile"),
     path("<str:username>/follow/", views.FollowView.as_view(), name="follow"),
     path("<str:username>/unfollow/", views.UnFollowView.as_view(), name="unfollow"),
     path("<str:username>/following_list/", views.FollowingListView.as_view(), name="following_list"),
     path("<str:username>/follower_list/", views.FollowerListView.as_view(), name="follower_list"),
+    path("<str:username>/api/tweets/", views.ProfileTweetsApiView.as_view(), name="api_tweets"),
 ]
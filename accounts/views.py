@@ -1,17 +1,31 @@
+import json
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.contrib.auth import authenticate, login
+from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Count
-from django.http import HttpResponseBadRequest, HttpResponseRedirect
-from django.shortcuts import get_object_or_404
+from django.db.models import Max
+from django.http import HttpResponseBadRequest, HttpResponseRedirect, JsonResponse
 from django.urls import reverse_lazy
 from django.views import View
-from django.views.generic import CreateView, ListView
-
-from accounts.models import Friendship, User
-from tweets.models import Like, Tweet
-
+from django.views.generic import CreateView, ListView, TemplateView
+
+from accounts.models import Friendship
+from mysite.async_auth import AsyncLoginRequiredMixin
+from mysite.db_router import ReplicaReadMixin
+from mysite.object_cache import aget_cached_or_404, get_cached_or_404
+from tweets import stamps
+from tweets.api import TweetListApiMixin
+from tweets.models import Tweet
+from tweets.pagination import KeysetPaginationMixin, apaginate_keyset
+from tweets.viewer_state import ViewerState
+
+from .cache import user_cache
+from .follows import follow, import_follows, unfollow
 from .forms import SignupForm
+from .purge import soft_delete_user
+from .relationships import annotate_relationships
+from .suggestions import SUGGESTION_PANEL_SIZE, suggestions_for
 
 
 class SignupView(CreateView):
@@ -28,89 +42,134 @@ class SignupView(CreateView):
         return response
 
 
-class UserProfileView(LoginRequiredMixin, ListView):
+class AccountDeleteView(LoginRequiredMixin, TemplateView):
+    """退会する。アカウントだけを書き換えてすぐに隠し (ツイート・フォロー関係は読むときに除く)、行は purge_deleted が後から消す"""
+
+    template_name = "accounts/delete.html"
+
+    def post(self, request, *args, **kwargs):
+        soft_delete_user(request.user)
+        logout(request)
+        return HttpResponseRedirect(reverse_lazy(settings.LOGOUT_REDIRECT_URL))
+
+
+class UserProfileView(LoginRequiredMixin, ReplicaReadMixin, KeysetPaginationMixin, ListView):
+    """ユーザーのツイートを (created_at, id) のカーソルで paginate_by 件ずつ、(user, created_at) のインデックスで読む"""
+
     template_name = "accounts/profile.html"
     context_object_name = "tweets"
+    paginate_by = 20
 
     def get_queryset(self):
         username = self.kwargs.get("username")
-        self.profile_user = get_object_or_404(User, username=username)
-        queryset = (
-            Tweet.objects.filter(user=self.profile_user)
-            .select_related("user")
-            .annotate(total_likes=Count("like_tweet"))
-        )
-        return queryset
+        self.profile_user = get_cached_or_404(user_cache, username=username)
+        # いいね数は Tweet.like_count に持っているため数え直さない
+        return Tweet.objects.filter(user=self.profile_user).select_related("user")
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["profile_user"] = self.profile_user
-        user_following_friendships = list(
-            Friendship.objects.filter(follower=self.request.user).select_related("following")
+        # フォローのボタンに要るのは、このユーザーをフォローしているかどうかだけ
+        context["is_following"] = (
+            self.profile_user != self.request.user
+            and Friendship.objects.filter(follower=self.request.user, following=self.profile_user).exists()
         )
-        user_following = [friendship.following for friendship in user_following_friendships]
-        following_number = Friendship.objects.filter(follower=self.profile_user).count()
-        follower_number = Friendship.objects.filter(following=self.profile_user).count()
-        user_likes = set(Like.objects.filter(likeuser=self.request.user).values_list("liketweet_id", flat=True))
-        context["user_following"] = user_following
+        following_number = self.profile_user.following_count
+        follower_number = self.profile_user.follower_count
         context["following_number"] = following_number
         context["follower_number"] = follower_number
-        for tweet in context["tweets"]:
-            tweet.liked_by_user = tweet.id in user_likes
+        context["suggestions"] = suggestions_for(self.request.user, SUGGESTION_PANEL_SIZE)
+        ViewerState.for_request(self.request).annotate(context["tweets"])
 
         return context
 
 
-class FollowView(LoginRequiredMixin, View):
-    def post(self, request, username):
-        following_user = get_object_or_404(User, username=username)
-        is_following = Friendship.objects.filter(follower=request.user, following=following_user).exists()
+class FollowView(AsyncLoginRequiredMixin, View):
+    async def post(self, request, username):
+        following_user = await aget_cached_or_404(user_cache, username=username)
         if request.user == following_user:
             return HttpResponseBadRequest("自分自身をフォローすることはできません")
-        elif is_following:
+        # トランザクションは async のコードでは使えないため、書き込みはまとめて一度だけスレッドで行う
+        # 同時に押された場合も一意制約で一方だけが作られる
+        if not await sync_to_async(follow)(request.user, following_user):
             return HttpResponseBadRequest("すでにフォローしています")
-        else:
-            follow_instance = Friendship(follower=request.user, following=following_user)
-            follow_instance.save()
-            return HttpResponseRedirect(reverse_lazy("tweets:home"))
+        return HttpResponseRedirect(reverse_lazy("tweets:home"))
 
 
-class UnFollowView(LoginRequiredMixin, View):
-    def post(self, request, username):
-        unfollowing_user = get_object_or_404(User, username=username)
-        follow_instance = Friendship.objects.filter(follower=request.user, following=unfollowing_user)
+class UnFollowView(AsyncLoginRequiredMixin, View):
+    async def post(self, request, username):
+        unfollowing_user = await aget_cached_or_404(user_cache, username=username)
         if request.user == unfollowing_user:
-            return HttpResponseRedirect("自分自身をアンフォローすることはできません")
-        elif not follow_instance:
+            return HttpResponseBadRequest("自分自身をアンフォローすることはできません")
+        if not await sync_to_async(unfollow)(request.user, unfollowing_user):
             return HttpResponseBadRequest("すでにアンフォロー中です")
-        else:
-            follow_instance.delete()
-            return HttpResponseRedirect(reverse_lazy("tweets:home"))
+        return HttpResponseRedirect(reverse_lazy("tweets:home"))
 
 
-class FollowingListView(LoginRequiredMixin, ListView):
-    template_name = "accounts/following_list.html"
-    context_object_name = "following_list"
+class FollowImportView(LoginRequiredMixin, View):
+    """{"usernames": [...]} のユーザーをまとめてフォローする"""
+
+    max_usernames = 10000
+
+    def post(self, *args, **kwargs):
+        try:
+            usernames = [str(username) for username in json.loads(self.request.body)["usernames"]]
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({"status": "error", "message": "リクエストの形式が正しくありません"}, status=400)
+        if len(usernames) > self.max_usernames:
+            return JsonResponse(
+                {"status": "error", "message": f"一度にフォローできるのは {self.max_usernames} 人までです"}, status=400
+            )
+        found, followed = import_follows(self.request.user, usernames)
+        return JsonResponse({"status": "ok", "found": found, "followed": followed})
+
+
+class FriendshipListMixin(LoginRequiredMixin, ReplicaReadMixin, KeysetPaginationMixin, ListView):
+    """フォロー・フォロワーの一覧を (created_at, id) のカーソルで paginate_by 件ずつ表示する
+
+    related_field はページに表示する側のユーザー、owner_field は一覧の持ち主の側のフィールド名
+    """
+
+    paginate_by = 50
+    owner_field = None
+    related_field = None
 
     def get_queryset(self):
-        self.user = get_object_or_404(User, username=self.kwargs.get("username"))
-        return Friendship.objects.all().filter(follower=self.user).select_related("following").order_by("-created_at")
+        self.user = get_cached_or_404(user_cache, username=self.kwargs.get("username"))
+        # 退会済みのユーザーとの関係は、purge_deleted が消すまでここで除く
+        return Friendship.objects.filter(
+            **{self.owner_field: self.user, f"{self.related_field}__deleted_at__isnull": True}
+        ).select_related(self.related_field)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["user"] = self.user
+        annotate_relationships(
+            self.request.user, [getattr(friendship, self.related_field) for friendship in context["object_list"]]
+        )
         return context
 
 
-class FollowerListView(LoginRequiredMixin, ListView):
+class FollowingListView(FriendshipListMixin):
+    template_name = "accounts/following_list.html"
+    context_object_name = "following_list"
+    owner_field = "follower"
+    related_field = "following"
+
+
+class FollowerListView(FriendshipListMixin):
     template_name = "accounts/follower_list.html"
     context_object_name = "follower_list"
+    owner_field = "following"
+    related_field = "follower"
 
-    def get_queryset(self):
-        self.user = get_object_or_404(User, username=self.kwargs.get("username"))
-        return Friendship.objects.all().filter(following=self.user).select_related("follower").order_by("-created_at")
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context["user"] = self.user
-        return context
+class ProfileTweetsApiView(AsyncLoginRequiredMixin, TweetListApiMixin, View):
+    async def get_validator(self, token, since):
+        self.profile_user = await aget_cached_or_404(user_cache, username=self.kwargs.get("username"))
+        newest = (await Tweet.objects.filter(user=self.profile_user).aaggregate(newest=Max("created_at")))["newest"]
+        return newest, await stamps.aread(("author", self.profile_user.pk)), []
+
+    async def get_page(self, token, since):
+        queryset = Tweet.objects.filter(user=self.profile_user).select_related("user")
+        return await apaginate_keyset(queryset, token, self.page_size, since=since)
@@ -0,0 +1,18 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth.mixins import LoginRequiredMixin
+
+
+async def aget_user(request):
+    # request.user は最初に触れたときにセッションとユーザーを DB から読むため、その一度だけスレッドで評価する
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+class AsyncLoginRequiredMixin(LoginRequiredMixin):
+    """async のハンドラを持つビュー用の LoginRequiredMixin"""
+
+    async def dispatch(self, request, *args, **kwargs):
+        user = await aget_user(request)
+        if not user.is_authenticated:
+            return self.handle_no_permission()
+        return await super(LoginRequiredMixin, self).dispatch(request, *args, **kwargs)
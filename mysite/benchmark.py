@@ -0,0 +1,116 @@
+import asyncio
+import statistics
+from collections import Counter
+from io import BytesIO
+
+from django.conf import settings
+from django.middleware.csrf import CSRF_ALLOWED_CHARS, CSRF_SECRET_LENGTH
+from django.test import Client
+from django.utils.crypto import get_random_string
+
+HOST = "localhost"
+
+
+def auth_headers(user):
+    """user としてログインしたセッションと CSRF トークンのヘッダー。全ワーカーで使い回す"""
+    client = Client()
+    client.force_login(user)
+    csrf_token = get_random_string(CSRF_SECRET_LENGTH, allowed_chars=CSRF_ALLOWED_CHARS)
+    cookies = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}; "
+    cookies += f"{settings.CSRF_COOKIE_NAME}={csrf_token}"
+    return [("Host", HOST), ("Cookie", cookies), ("X-CSRFToken", csrf_token)]
+
+
+async def asgi_request(app, method, path, headers, body=b""):
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers],
+        "client": ("127.0.0.1", 0),
+        "server": (HOST, 80),
+    }
+    received = False
+    status = None
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # クライアントは切断しない (応答を返し終えるとハンドラがこの待機をキャンセルする)
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+def wsgi_request(app, method, path, headers, body=b""):
+    environ = {
+        "REQUEST_METHOD": method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": path,
+        "QUERY_STRING": "",
+        "SERVER_NAME": HOST,
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "REMOTE_ADDR": "127.0.0.1",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.input": BytesIO(body),
+        "wsgi.errors": BytesIO(),
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in headers:
+        key = name.upper().replace("-", "_")
+        environ[key if key == "CONTENT_TYPE" else "HTTP_" + key] = value
+    status = []
+    response = app(environ, lambda code, response_headers, exc_info=None: status.append(int(code.split()[0])))
+    try:
+        for _ in response:
+            pass
+    finally:
+        response.close()
+    return status[0]
+
+
+def percentile(timings, p):
+    return timings[min(int(len(timings) * p), len(timings) - 1)]
+
+
+def summarize(results, elapsed):
+    """[(status, 秒)] から (リクエスト数/秒, p50 ms, p95 ms, p99 ms, 4xx/5xx の数) を返す"""
+    if not results:
+        return 0.0, 0.0, 0.0, 0.0, 0
+    timings = sorted(timing for _, timing in results)
+    statuses = Counter(status for status, _ in results)
+    errors = sum(count for status, count in statuses.items() if status is None or status >= 400)
+    return (
+        len(results) / elapsed,
+        statistics.median(timings) * 1000,
+        percentile(timings, 0.95) * 1000,
+        percentile(timings, 0.99) * 1000,
+        errors,
+    )
+
+
+HEADER = f"{'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}"
+
+
+def format_summary(summary):
+    rate, p50, p95, p99, errors = summary
+    return f"{rate:>9.1f} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f} {errors:>6}"
@@ -0,0 +1,39 @@
+from django.db import connections, router, transaction
+
+
+def raw_delete(model, ids):
+    """DELETE ... WHERE pk IN (...) を1文で実行し、消した行数を返す
+
+    QuerySet.delete() と違い、関連する行を読み込まず、シグナルも送らない (呼び出し側で後始末をする)
+    """
+    if not ids:
+        return 0
+    connection = connections[router.db_for_write(model)]
+    table = connection.ops.quote_name(model._meta.db_table)
+    pk = connection.ops.quote_name(model._meta.pk.column)
+    placeholders = ", ".join(["%s"] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE {pk} IN ({placeholders})", list(ids))
+        return cursor.rowcount
+
+
+def delete_rows(model):
+    """delete_in_chunks に渡す、各行の先頭の値を主キーとして消す関数"""
+    return lambda rows: raw_delete(model, [row[0] for row in rows])
+
+
+def delete_in_chunks(queryset, fields, chunk_size, delete):
+    """queryset の先頭 chunk_size 行の fields を読み、delete(rows) で消す、を行がなくなるまで繰り返す
+
+    1チャンクを1つの短いトランザクションにして、SQLite の書き込みを長く止めないようにする。
+    delete は rows を queryset から外さなければならない。処理した行数を返す
+    """
+    total = 0
+    queryset = queryset.order_by("pk").values_list(*fields)
+    while True:
+        with transaction.atomic():
+            rows = list(queryset[:chunk_size])
+            if not rows:
+                return total
+            delete(rows)
+        total += len(rows)
@@ -0,0 +1,83 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.deprecation import MiddlewareMixin
+
+# このコンテキストの読み込みをレプリカに送ってよいか。ReplicaReadMixin のビューの中でだけ True になる
+_replica_reads = ContextVar("replica_reads", default=False)
+
+STICKY_COOKIE_NAME = "primary_until"
+
+
+def reading_from_replica():
+    return _replica_reads.get() and bool(settings.DATABASE_REPLICAS)
+
+
+@contextmanager
+def replica_reads():
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """書き込みはプライマリ (default) に、replica_reads() の中の読み込みはいずれかのレプリカに送る"""
+
+    def db_for_read(self, model, **hints):
+        if reading_from_replica():
+            return random.choice(settings.DATABASE_REPLICAS)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # レプリカはプライマリの複製なので、どの組み合わせでも同じ行を指す
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReadYourWritesMiddleware(MiddlewareMixin):
+    """書き込みに成功したクライアントの読み込みを REPLICA_STICKINESS_SECONDS 秒の間プライマリに固定する"""
+
+    def process_request(self, request):
+        # 期限は Cookie の有効期限だけに任せず、値でも確かめる
+        try:
+            sticky = float(request.COOKIES.get(STICKY_COOKIE_NAME, 0)) > time.time()
+        except ValueError:
+            sticky = False
+        request.read_from_replica = not sticky
+
+    def process_response(self, request, response):
+        if (
+            settings.DATABASE_REPLICAS
+            and request.method not in ("GET", "HEAD", "OPTIONS", "TRACE")
+            and response.status_code < 400
+        ):
+            stickiness = settings.REPLICA_STICKINESS_SECONDS
+            response.set_cookie(
+                STICKY_COOKIE_NAME, str(time.time() + stickiness), max_age=stickiness, httponly=True, samesite="Lax"
+            )
+        return response
+
+
+class ReplicaReadMixin:
+    """読み込みだけのビューのクエリ (テンプレートの描画中のものを含む) をレプリカに送る"""
+
+    def dispatch(self, request, *args, **kwargs):
+        if not getattr(request, "read_from_replica", False):
+            return super().dispatch(request, *args, **kwargs)
+        with replica_reads():
+            response = super().dispatch(request, *args, **kwargs)
+            # TemplateResponse は遅延して描画されるため、テンプレート内のクエリもここで済ませる
+            if hasattr(response, "render") and not response.is_rendered:
+                response.render()
+        return response
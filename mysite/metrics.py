@@ -0,0 +1,237 @@
+"""ビュー (URL 名) ごとのリクエスト時間・クエリ数・DB 時間・テンプレートの描画時間を記録し、ObjectCache の
+モデルごとのヒット・ミスの数と合わせて /metrics で Prometheus のテキスト形式で返す
+
+値はプロセスごとにメモリに持つ。複数のワーカーで動かす場合は、ワーカーごとに取得して合計する
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.views.generic import View
+
+from .object_cache import cache_stats
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# URL に一致しなかったリクエストのビュー名
+UNRESOLVED = "unresolved"
+# ラベルの組み合わせが増え続けないよう、これ以外のメソッドは OTHER_METHOD にまとめる
+METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+OTHER_METHOD = "other"
+
+# 処理中のリクエストの RequestMetrics。sync_to_async のスレッドにもコンテキストごと引き継がれる
+_current = ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+    __slots__ = ("queries", "db_seconds", "template_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+
+
+class ViewMetrics:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # buckets[i] 以下に入った数 (最後は +Inf)。出力するときに累積する
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.seconds = 0.0
+        self.requests = 0
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.statuses = {}
+
+    def observe(self, seconds, status, request_metrics):
+        self.bucket_counts[bisect_left(self.buckets, seconds)] += 1
+        self.seconds += seconds
+        self.requests += 1
+        self.queries += request_metrics.queries
+        self.db_seconds += request_metrics.db_seconds
+        self.template_seconds += request_metrics.template_seconds
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def observe(self, view, method, seconds, status, request_metrics):
+        with self._lock:
+            metrics = self._views.get((view, method))
+            if metrics is None:
+                metrics = self._views[(view, method)] = ViewMetrics(settings.METRICS_LATENCY_BUCKETS)
+            metrics.observe(seconds, status, request_metrics)
+
+    def get(self, view, method):
+        return self._views.get((view, method))
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+    def render(self):
+        with self._lock:
+            views = sorted(self._views.items())
+            lines = []
+            _histogram(lines, views)
+            _counter(lines, views, "django_db_queries_total", "実行したクエリの数", lambda m: m.queries)
+            _counter(
+                lines, views, "django_db_query_seconds_total", "クエリの実行にかかった時間", lambda m: m.db_seconds
+            )
+            _counter(
+                lines,
+                views,
+                "django_template_render_seconds_total",
+                "テンプレートの描画にかかった時間 (描画中のクエリを含む)",
+                lambda m: m.template_seconds,
+            )
+            lines.append("# HELP django_http_responses_total ステータスコードごとのレスポンスの数")
+            lines.append("# TYPE django_http_responses_total counter")
+            for (view, method), metrics in views:
+                for status, count in sorted(metrics.statuses.items()):
+                    lines.append(f'django_http_responses_total{{{_labels(view, method)},status="{status}"}} {count}')
+        _object_cache_counters(lines)
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(view, method):
+    return f'view="{_escape(view)}",method="{_escape(method)}"'
+
+
+def _histogram(lines, views):
+    name = "django_http_request_duration_seconds"
+    lines.append(f"# HELP {name} リクエストを受けてからレスポンスを返すまでの時間")
+    lines.append(f"# TYPE {name} histogram")
+    for (view, method), metrics in views:
+        labels = _labels(view, method)
+        cumulative = 0
+        for bound, count in zip(metrics.buckets, metrics.bucket_counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {metrics.requests}')
+        lines.append(f"{name}_sum{{{labels}}} {metrics.seconds}")
+        lines.append(f"{name}_count{{{labels}}} {metrics.requests}")
+
+
+def _counter(lines, views, name, help_text, value):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} counter")
+    for (view, method), metrics in views:
+        lines.append(f"{name}{{{_labels(view, method)}}} {value(metrics)}")
+
+
+def _object_cache_counters(lines):
+    stats = sorted(cache_stats().items())
+    for name, field, help_text in (
+        ("object_cache_hits_total", "hits", "ObjectCache (mysite.object_cache) にあった数"),
+        ("object_cache_misses_total", "misses", "ObjectCache になく DB から読んだ数"),
+    ):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for model, counts in stats:
+            lines.append(f'{name}{{model="{_escape(model)}"}} {counts[field]}')
+
+
+registry = Registry()
+
+
+def record_query(execute, sql, params, many, context):
+    """接続の execute_wrapper。リクエストの外 (コマンドなど) では何もしない"""
+    request_metrics = _current.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        request_metrics.queries += 1
+        request_metrics.db_seconds += time.perf_counter() - start
+
+
+def install_query_recorder(sender=None, connection=None, **kwargs):
+    # 接続のオブジェクトはスレッドごとに作られ、再接続しても execute_wrappers は残る
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def record_template_render(seconds):
+    request_metrics = _current.get()
+    if request_metrics is not None:
+        request_metrics.template_seconds += seconds
+
+
+class MetricsMiddleware:
+    """リクエストごとの時間・クエリ・テンプレートの描画時間をビューの URL 名ごとに集計する
+
+    時間を正しく測るため、MIDDLEWARE の先頭に置く
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        # この後に作られる接続はシグナルで、すでにある接続はここで記録を始める
+        connection_created.connect(install_query_recorder)
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection=connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request_metrics = RequestMetrics()
+        token = _current.set(request_metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, time.perf_counter() - start, request_metrics)
+        return response
+
+    async def __acall__(self, request):
+        request_metrics = RequestMetrics()
+        token = _current.set(request_metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, time.perf_counter() - start, request_metrics)
+        return response
+
+    def record(self, request, response, seconds, request_metrics):
+        match = request.resolver_match
+        view = match.view_name if match else UNRESOLVED
+        if view == "metrics":
+            return
+        method = request.method if request.method in METHODS else OTHER_METHOD
+        registry.observe(view, method, seconds, response.status_code, request_metrics)
+
+
+class MetricsView(View):
+    """Authorization: Bearer <METRICS_TOKEN> を求める。METRICS_TOKEN を設定していなければ常に 403 を返す"""
+
+    def get(self, request, *args, **kwargs):
+        authorization = request.headers.get("Authorization", "")
+        if not settings.METRICS_TOKEN or not constant_time_compare(authorization, f"Bearer {settings.METRICS_TOKEN}"):
+            raise PermissionDenied
+        return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
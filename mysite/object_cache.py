@@ -0,0 +1,144 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.http import Http404
+
+_registry = []
+
+
+class ObjectCache:
+    """モデルの行を主キー (と任意の一意なフィールド) で引く read-through キャッシュ
+
+    共有のキャッシュに遅れたレプリカの行を載せないよう、キャッシュにない行は常にプライマリから読む
+    """
+
+    # キャッシュするオブジェクトの形が変わったら上げる
+    version = 1
+
+    def __init__(self, model, alternate_key=None, is_visible=None, parent=None):
+        self.model = model
+        self.alternate_key = alternate_key
+        # get_cached_or_404 で見つからなかったことにする行 (退会済みのユーザーなど) を判定する
+        self.is_visible = is_visible or (lambda obj: True)
+        # (外部キーのフィールド名, 親の ObjectCache)。get_cached_or_404 では親が見えない行も見つからなかったことにする
+        self.parent = parent
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    @property
+    def cache(self):
+        return caches[settings.OBJECT_CACHE_ALIAS]
+
+    def _key(self, field, value):
+        return f"object:{self.model._meta.label_lower}:{field}:{value}"
+
+    def _record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _store(self, obj):
+        self.cache.set(self._key("pk", obj.pk), obj, settings.OBJECT_CACHE_TIMEOUT, version=self.version)
+        if self.alternate_key:
+            value = getattr(obj, self.alternate_key)
+            self.cache.set(
+                self._key(self.alternate_key, value), obj.pk, settings.OBJECT_CACHE_TIMEOUT, version=self.version
+            )
+
+    async def _astore(self, obj):
+        await self.cache.aset(self._key("pk", obj.pk), obj, settings.OBJECT_CACHE_TIMEOUT, version=self.version)
+        if self.alternate_key:
+            value = getattr(obj, self.alternate_key)
+            await self.cache.aset(
+                self._key(self.alternate_key, value), obj.pk, settings.OBJECT_CACHE_TIMEOUT, version=self.version
+            )
+
+    def get(self, pk):
+        obj = self.cache.get(self._key("pk", pk), version=self.version)
+        self._record(obj is not None)
+        if obj is None:
+            obj = self.model.objects.using(DEFAULT_DB_ALIAS).filter(pk=pk).first()
+            if obj is not None:
+                self._store(obj)
+        return obj
+
+    def get_by_alternate_key(self, value):
+        pk = self.cache.get(self._key(self.alternate_key, value), version=self.version)
+        if pk is not None:
+            obj = self.get(pk)
+            # 値が変わった後の古い対応は捨てる
+            if obj is not None and getattr(obj, self.alternate_key) == value:
+                return obj
+        else:
+            self._record(False)
+        obj = self.model.objects.using(DEFAULT_DB_ALIAS).filter(**{self.alternate_key: value}).first()
+        if obj is not None:
+            self._store(obj)
+        return obj
+
+    async def aget(self, pk):
+        obj = await self.cache.aget(self._key("pk", pk), version=self.version)
+        self._record(obj is not None)
+        if obj is None:
+            obj = await self.model.objects.using(DEFAULT_DB_ALIAS).filter(pk=pk).afirst()
+            if obj is not None:
+                await self._astore(obj)
+        return obj
+
+    async def aget_by_alternate_key(self, value):
+        pk = await self.cache.aget(self._key(self.alternate_key, value), version=self.version)
+        if pk is not None:
+            obj = await self.aget(pk)
+            if obj is not None and getattr(obj, self.alternate_key) == value:
+                return obj
+        else:
+            self._record(False)
+        obj = await self.model.objects.using(DEFAULT_DB_ALIAS).filter(**{self.alternate_key: value}).afirst()
+        if obj is not None:
+            await self._astore(obj)
+        return obj
+
+    def invalidate(self, pk):
+        key = self._key("pk", pk)
+        self.cache.delete(key, version=self.version)
+        # コミット前に別のリクエストが古い行を読み直して載せた場合に備え、コミット後にもう一度消す
+        transaction.on_commit(lambda: self.cache.delete(key, version=self.version))
+
+
+def get_cached_or_404(object_cache, pk=None, **lookup):
+    if pk is not None:
+        obj = object_cache.get(pk)
+    else:
+        obj = object_cache.get_by_alternate_key(lookup[object_cache.alternate_key])
+    if obj is None or not object_cache.is_visible(obj):
+        raise Http404(f"{object_cache.model._meta.object_name} が見つかりません")
+    if object_cache.parent:
+        field, parent_cache = object_cache.parent
+        get_cached_or_404(parent_cache, pk=getattr(obj, field))
+    return obj
+
+
+async def aget_cached_or_404(object_cache, pk=None, **lookup):
+    if pk is not None:
+        obj = await object_cache.aget(pk)
+    else:
+        obj = await object_cache.aget_by_alternate_key(lookup[object_cache.alternate_key])
+    if obj is None or not object_cache.is_visible(obj):
+        raise Http404(f"{object_cache.model._meta.object_name} が見つかりません")
+    if object_cache.parent:
+        field, parent_cache = object_cache.parent
+        await aget_cached_or_404(parent_cache, pk=getattr(obj, field))
+    return obj
+
+
+def cache_stats():
+    return {
+        object_cache.model._meta.label_lower: {"hits": object_cache.hits, "misses": object_cache.misses}
+        for object_cache in _registry
+    }
@@ -0,0 +1,134 @@
+"""選んだリクエストを cProfile で計測し、リクエストの情報と一緒に PROFILE_DIR へ gzip で書き出す
+
+書き出したファイルは profile_report でまとめて、時間のかかっている関数を表示する
+"""
+
+import cProfile
+import gzip
+import marshal
+import os
+import random
+import threading
+import time
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.urls import Resolver404, resolve
+from django.utils.crypto import constant_time_compare
+
+PROFILE_HEADER = "X-Profile"
+SUFFIX = ".prof.gz"
+
+# 同時に計測するのはプロセスで1リクエストだけにする (負荷が高いときに計測が重なって遅くなるのを防ぐ)
+_lock = threading.Lock()
+
+
+def sampling_reason(request):
+    """計測するなら理由 ("header" / "url" / "sample") を、しないなら None を返す"""
+    token = settings.PROFILE_TOKEN
+    if token and constant_time_compare(request.headers.get(PROFILE_HEADER, ""), token):
+        return "header"
+    if settings.PROFILE_URL_SAMPLE_RATES:
+        try:
+            match = resolve(request.path_info, getattr(request, "urlconf", None))
+        except Resolver404:
+            match = None
+        rate = settings.PROFILE_URL_SAMPLE_RATES.get(match.view_name) if match else None
+        if rate is not None:
+            return "url" if random.random() < rate else None
+    if settings.PROFILE_SAMPLE_RATE and random.random() < settings.PROFILE_SAMPLE_RATE:
+        return "sample"
+    return None
+
+
+def write_dump(profiler, request, response, reason, seconds):
+    profiler.create_stats()
+    match = request.resolver_match
+    meta = {
+        "view": match.view_name if match else "unresolved",
+        "method": request.method,
+        "path": request.path,
+        "status": response.status_code,
+        "seconds": seconds,
+        "reason": reason,
+        "pid": os.getpid(),
+        "time": time.time(),
+    }
+    directory = Path(settings.PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    # 名前の順が書き出した順になるよう、マイクロ秒の時刻から始める
+    path = directory / f"{time.time_ns() // 1000}-{os.getpid()}-{meta['view'].replace(':', '-')}{SUFFIX}"
+    # 書き出し中のファイルを profile_report が読まないよう、別名で書いてから置き換える
+    partial = path.with_name(path.name + ".tmp")
+    with gzip.open(partial, "wb") as f:
+        marshal.dump({"meta": meta, "stats": profiler.stats}, f)
+    os.replace(partial, path)
+    rotate(directory)
+    return path
+
+
+def rotate(directory):
+    """新しい PROFILE_MAX_FILES 件だけを残す"""
+    dumps = sorted(directory.glob(f"*{SUFFIX}"))
+    for path in dumps[: -settings.PROFILE_MAX_FILES or None]:
+        path.unlink(missing_ok=True)
+
+
+def load_dump(path):
+    """(リクエストの情報, pstats の形式の統計) を返す"""
+    with gzip.open(path, "rb") as f:
+        dump = marshal.load(f)
+    return dump["meta"], dump["stats"]
+
+
+class ProfilingMiddleware:
+    """PROFILE_SAMPLE_RATE の割合のリクエスト、PROFILE_URL_SAMPLE_RATES の URL 名ごとの割合のリクエスト、
+    X-Profile ヘッダーに PROFILE_TOKEN を付けたリクエストを計測する
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        reason = sampling_reason(request)
+        if reason is None or not _lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            profiler = cProfile.Profile()
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            write_dump(profiler, request, response, reason, time.perf_counter() - start)
+        finally:
+            _lock.release()
+        return response
+
+    async def __acall__(self, request):
+        reason = sampling_reason(request)
+        if reason is None or not _lock.acquire(blocking=False):
+            return await self.get_response(request)
+        try:
+            profiler = cProfile.Profile()
+            start = time.perf_counter()
+            # ASGI では同期のビューや sync_to_async はリクエストごとのスレッドで動くため、そのスレッドで計測する
+            # (イベントループのスレッドは他のリクエストも動かしているため計測しない)
+            await sync_to_async(profiler.enable)()
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(profiler.disable)()
+            await sync_to_async(write_dump)(profiler, request, response, reason, time.perf_counter() - start)
+        finally:
+            _lock.release()
+        return response
@@ -0,0 +1,80 @@
+import asyncio
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+_broker = None
+
+
+class Subscription:
+    """トピックごとに最新のメッセージだけを保持する購読。取り出すまでに届いた古いメッセージは上書きされる"""
+
+    def __init__(self, broker, topics):
+        self.broker = broker
+        self.topics = frozenset(topics)
+        self._loop = asyncio.get_running_loop()
+        self._pending = {}
+        self._ready = asyncio.Event()
+
+    def _deliver(self, topic, message):
+        self._pending[topic] = message
+        self._ready.set()
+
+    def deliver(self, topic, message):
+        # publish は同期のビューやスレッドから呼ばれるため、購読側のイベントループに渡して反映する
+        self._loop.call_soon_threadsafe(self._deliver, topic, message)
+
+    async def get(self, timeout=None):
+        """届いているメッセージを {topic: message} でまとめて返す。timeout 秒待っても届かなければ空の dict を返す"""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return {}
+        self._ready.clear()
+        pending, self._pending = self._pending, {}
+        return pending
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InMemoryBroker:
+    """同じプロセス内の購読者にだけ配信するブローカー"""
+
+    def __init__(self):
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, topics):
+        subscription = Subscription(self, topics)
+        with self._lock:
+            for topic in subscription.topics:
+                self._subscriptions.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for topic in subscription.topics:
+                subscriptions = self._subscriptions.get(topic, set())
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    self._subscriptions.pop(topic, None)
+
+    def publish(self, topic, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(topic, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.deliver(topic, message)
+            except RuntimeError:
+                # イベントループが閉じた購読は切断済みとして外す
+                self.unsubscribe(subscription)
+        return len(subscriptions)
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(settings.PUBSUB_BACKEND)()
+    return _broker
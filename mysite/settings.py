@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -48,11 +49,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # リクエスト全体の時間を測るため先頭に置く
+    "mysite.metrics.MetricsMiddleware",
+    "mysite.profiling.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "mysite.db_router.ReadYourWritesMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -61,7 +66,8 @@ ROOT_URLCONF = "mysite.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # 描画時間を /metrics に記録する
+        "BACKEND": "mysite.template_backend.DjangoTemplates",
         "DIRS": [BASE_DIR / "templates"],
         "APP_DIRS": True,
         "OPTIONS": {
@@ -70,6 +76,7 @@ TEMPLATES = [
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
+                "tweets.context_processors.like_stream",
             ],
         },
     },
@@ -83,11 +90,75 @@ WSGI_APPLICATION = "mysite.wsgi.application"
 
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
+        "ENGINE": "mysite.sqlite_backend",
         "NAME": BASE_DIR / "db.sqlite3",
     }
 }
 
+# SQLite を複数のスレッド・プロセスから同時に使うための設定 (mysite.sqlite_backend)
+# 接続ごとに pragmas を設定し、immediate なら transaction.atomic() を BEGIN IMMEDIATE で始める
+# 環境変数 SQLITE_PROFILE=default で SQLite の既定に近い設定に戻せる (journal_mode はファイルに残るため明示する)
+SQLITE_PROFILES = {
+    "default": {
+        "immediate": False,
+        "pragmas": {"journal_mode": "DELETE", "synchronous": "FULL"},
+    },
+    "production": {
+        "immediate": True,
+        "pragmas": {
+            # 書き込み中も読み込みを止めない
+            "journal_mode": "WAL",
+            # WAL では NORMAL でも壊れない (電源断で直前のコミットが失われることはある)
+            "synchronous": "NORMAL",
+            # ロックを取れないときにすぐ失敗せず、この時間 (ミリ秒) まで待つ
+            "busy_timeout": 5000,
+            "mmap_size": 256 * 1024 * 1024,
+            # 負の値は KiB 単位 (64 MiB)
+            "cache_size": -64 * 1024,
+            "temp_store": "MEMORY",
+        },
+    },
+}
+SQLITE_PROFILE = os.environ.get("SQLITE_PROFILE", "production")
+
+# 読み込みだけのビューのクエリを送るリードレプリカのエイリアス (mysite.db_router)
+# 環境変数 DB_REPLICAS にレプリカの数を指定すると、ローカルでは SQLite のファイルをレプリカの代わりに使う
+# (python manage.py sync_replicas でプライマリの内容を書き写す)。テストは DB_REPLICAS を指定せずに実行する
+DATABASE_REPLICAS = [f"replica{i}" for i in range(1, int(os.environ.get("DB_REPLICAS", "0")) + 1)]
+for alias in DATABASE_REPLICAS:
+    DATABASES[alias] = {
+        "ENGINE": "mysite.sqlite_backend",
+        "NAME": BASE_DIR / f"db.{alias}.sqlite3",
+    }
+
+DATABASE_ROUTERS = ["mysite.db_router.PrimaryReplicaRouter"]
+
+# ツイート・いいね・フォローなどの書き込みのあと、この秒数の間はそのクライアントの読み込みをプライマリに送る
+REPLICA_STICKINESS_SECONDS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# 複数プロセスで共有する場合は FileBasedCache や RedisCache
+# ("django.core.cache.backends.redis.RedisCache", "LOCATION": "redis://127.0.0.1:6379") に差し替える
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
+# セッションはキャッシュから読み、キャッシュにないときだけ DB を読む (書き込みは両方に行う)
+# 署名付き Cookie のセッションはログアウトしてもサーバー側で無効にできないため使わない
+SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+
+# User / Tweet の行を読み込むキャッシュ (mysite.object_cache)
+OBJECT_CACHE_ALIAS = "default"
+OBJECT_CACHE_TIMEOUT = 300
+
+
+# ログイン中のユーザーを user_cache から読む
+AUTHENTICATION_BACKENDS = ["accounts.backends.CachedModelBackend"]
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -135,12 +206,54 @@ LOGIN_REDIRECT_URL = "tweets:home"
 LOGOUT_REDIRECT_URL = "accounts:login"
 LOGOUT_URL = "accounts:logout"
 
-SQL_DEBUG = True
+# フォロワー数がこの値を超えるユーザーのツイートはタイムラインに書き込まず、読み込み時に取得する
+TIMELINE_FANOUT_THRESHOLD = 10000
+# フォロー開始時に相手のタイムラインから取り込むツイート数
+TIMELINE_BACKFILL_SIZE = 50
+
+# 0 より大きい場合、いいね数の増減をメモリに溜めてこの秒数ごとにツイート単位でまとめて書き込む
+LIKE_COUNT_FLUSH_INTERVAL = 0
+
+# いいね数のライブ更新 (Server-Sent Events) を使うか。ASGI で動かすときだけ有効にする (WSGI では常に 204 を返す)
+LIKE_STREAM_ENABLED = os.environ.get("LIKE_STREAM_ENABLED", "0") == "1"
+# いいね数のライブ更新を配信するブローカー (mysite.pubsub)。複数プロセスで動かす場合は共有のブローカーに差し替える
+PUBSUB_BACKEND = "mysite.pubsub.InMemoryBroker"
+# ライブ更新で同じツイートのいいね数を送る最短の間隔 (秒)
+LIKE_STREAM_INTERVAL = 1
+
+# トレンドのスコアが半分になるまでの時間 (秒)
+TRENDING_HALF_LIFE = 6 * 60 * 60
+# トレンドの表に残すツイート数。これより順位の低いツイートは入れず、compact_trending で取り除く
+TRENDING_CAPACITY = 1000
+
+# /metrics (mysite.metrics) のリクエスト時間のヒストグラムの区切り (秒)
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# /metrics は Authorization: Bearer <METRICS_TOKEN> のリクエストにだけ応える (設定しなければ常に 403)
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+# bench_metrics で計測する、計測なしに比べた p50 の増加の上限 (割合)
+METRICS_OVERHEAD_BUDGET = 0.05
+
+# mysite.profiling で cProfile を取るリクエストの割合 (0 なら取らない)
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+# URL 名ごとの割合。ここにある URL 名は PROFILE_SAMPLE_RATE の代わりにこの値を使う (例: {"tweets:home": 0.01})
+PROFILE_URL_SAMPLE_RATES = {}
+# 設定すると X-Profile: <PROFILE_TOKEN> を付けたリクエストは必ず計測する
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN")
+# 計測結果を書き出すディレクトリと、残すファイルの数 (古いものから消す)
+PROFILE_DIR = os.environ.get("PROFILE_DIR", BASE_DIR / "profiles")
+PROFILE_MAX_FILES = 200
+
+# debug_toolbar はすべてのリクエストのクエリとテンプレートを記録して重いため、DEBUG のときだけ組み込み、
+# 表示も DEBUG で INTERNAL_IPS からのリクエストに限る
+SQL_DEBUG = os.environ.get("SQL_DEBUG", "1" if DEBUG else "0") == "1"
+INTERNAL_IPS = ["127.0.0.1"]
 
 if SQL_DEBUG:
 
     def show_toolbar(request):
-        return True
+        from django.conf import settings
+
+        return settings.DEBUG and request.META.get("REMOTE_ADDR") in settings.INTERNAL_IPS
 
     INSTALLED_APPS += ("debug_toolbar",)
     MIDDLEWARE += ("debug_toolbar.middleware.DebugToolbarMiddleware",)
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.backends.sqlite3 import base
+
+
+def _profile():
+    return settings.SQLITE_PROFILES[settings.SQLITE_PROFILE]
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """SQLITE_PROFILE に従って PRAGMA とトランザクションの開始方法を切り替える SQLite のバックエンド"""
+
+    def _start_transaction_under_autocommit(self):
+        # BEGIN (DEFERRED) で始めると、読み込みから書き込みへのロックの引き上げで他の書き込みとぶつかったとき
+        # busy_timeout で待たずにすぐ "database is locked" になる。最初に書き込みのロックを取って待てるようにする
+        if _profile().get("immediate"):
+            self.cursor().execute("BEGIN IMMEDIATE")
+        else:
+            super()._start_transaction_under_autocommit()
+
+
+def configure_connection(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name, value in _profile().get("pragmas", {}).items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+connection_created.connect(configure_connection, sender=DatabaseWrapper)
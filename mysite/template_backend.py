@@ -0,0 +1,28 @@
+import time
+
+from django.template import TemplateDoesNotExist
+from django.template.backends import django
+
+from .metrics import record_template_render
+
+
+class Template(django.Template):
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            record_template_render(time.perf_counter() - start)
+
+
+class DjangoTemplates(django.DjangoTemplates):
+    """描画時間を mysite.metrics に記録する DjangoTemplates (include したテンプレートは呼び出し元に含まれる)"""
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            django.reraise(exc, self)
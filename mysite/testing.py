@@ -0,0 +1,123 @@
+import json
+import os
+import re
+import statistics
+import time
+
+from django.core.cache import caches
+from django.db import connection
+from django.test import modify_settings
+from django.test.utils import CaptureQueriesContext
+
+# インデックスを使わない全件走査と、ORDER BY のための一時 B-tree (= マッチした全行のソート) を検出する
+FULL_SCAN_PATTERN = re.compile(r"\bSCAN (\w+)\b(?! USING)|USE TEMP B-TREE FOR ORDER BY")
+
+# debug_toolbar はクエリを余分に発行し、時間も大きく歪めるため、計測では外す
+without_debug_toolbar = modify_settings(MIDDLEWARE={"remove": "debug_toolbar.middleware.DebugToolbarMiddleware"})
+
+# 環境変数 PERF_REPORT にパスを指定すると、ビューごとの描画時間をJSONで書き出す
+_report = None
+
+
+class QueryPlanAssertionsMixin:
+    def assertIndexedPlan(self, queryset):
+        plan = queryset.explain()
+        self.assertIsNone(FULL_SCAN_PATTERN.search(plan), f"インデックスを使わないクエリプランです:\n{plan}")
+        return plan
+
+
+def seed_social_graph(user, n):
+    """user を中心に、n 人のユーザーとそのツイート・いいね・フォローを作る"""
+    from accounts.counters import recount_follow_counts
+    from accounts.models import Friendship, User
+    from tweets.models import Like, TimelineEntry, Tweet
+
+    prefix = f"seed{User.objects.count()}_"
+    users = User.objects.bulk_create(
+        [User(username=f"{prefix}{i}", email=f"{prefix}{i}@example.com", password="!") for i in range(n)]
+    )
+    own_tweets = Tweet.objects.bulk_create([Tweet(user=user, content=f"tweet{i}") for i in range(n)])
+    tweets = Tweet.objects.bulk_create([Tweet(user=other, content="seed") for other in users])
+    Friendship.objects.bulk_create(
+        [Friendship(follower=other, following=user) for other in users]
+        + [Friendship(follower=user, following=other) for other in users],
+        ignore_conflicts=True,
+    )
+    Like.objects.bulk_create(
+        [Like(likeuser=other, liketweet=tweet) for other in users for tweet in own_tweets[:5]]
+        + [Like(likeuser=user, liketweet=tweet) for tweet in tweets],
+        ignore_conflicts=True,
+    )
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(owner=user, tweet=tweet, created_at=tweet.created_at) for tweet in own_tweets + tweets],
+        ignore_conflicts=True,
+    )
+    recount_follow_counts([user.pk] + [other.pk for other in users])
+    return users
+
+
+def record_timing(name, n, queries, timings):
+    global _report
+    path = os.environ.get("PERF_REPORT")
+    if not path:
+        return
+    if _report is None:
+        _report = {"views": {}}
+    _report["views"][f"{name}[n={n}]"] = {
+        "queries": queries,
+        "samples": len(timings),
+        "p50_ms": round(statistics.median(timings) * 1000, 3),
+        "p95_ms": round(statistics.quantiles(timings, n=20)[-1] * 1000, 3),
+    }
+    with open(path, "w") as f:
+        json.dump(_report, f, indent=2, sort_keys=True, ensure_ascii=False)
+
+
+class QueryBudgetMixin:
+    """ビューのクエリ数がデータ量 N によらず一定で予算以下であることを確かめ、描画時間を記録する
+
+    クエリ数はキャッシュが空の状態 (budget) と、同じ URL を続けて取得してキャッシュが温まった状態 (warm_budget) で数える。
+    描画時間は温まった状態で timing_samples 回測り、p50/p95 を PERF_REPORT に書き出す
+    """
+
+    seed_sizes = (5, 50)
+    timing_samples = 20
+
+    def request(self, method, url, cold=False):
+        if cold:
+            caches["default"].clear()
+        with without_debug_toolbar:
+            return getattr(self.client, method)(url)
+
+    def assertQueryCount(self, name, n, budget, method, url, cold):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.request(method, url, cold=cold)
+        self.assertLess(response.status_code, 400)
+        self.assertLessEqual(
+            len(queries),
+            budget,
+            f"{name} (N={n}, {'cold' if cold else 'warm'}) のクエリ数が予算を超えています:\n"
+            + "\n".join(query["sql"] for query in queries.captured_queries),
+        )
+        return len(queries)
+
+    def assertQueryBudget(self, name, budget, method, url_for, warm_budget=None):
+        seeded = 0
+        counts = {}
+        for n in self.seed_sizes:
+            seed_social_graph(self.user, n - seeded)
+            seeded = n
+            url = url_for()
+            query_count = counts[n] = self.assertQueryCount(name, n, budget, method, url, cold=True)
+            if warm_budget is not None:
+                self.assertQueryCount(name, n, warm_budget, method, url, cold=False)
+
+            timings = []
+            for _ in range(self.timing_samples):
+                url = url_for()
+                start = time.perf_counter()
+                self.request(method, url)
+                timings.append(time.perf_counter() - start)
+            record_timing(name, n, query_count, timings)
+        # 予算に収まっていても、N とともに増えていれば N+1 のため失敗にする
+        self.assertEqual(len(set(counts.values())), 1, f"{name} のクエリ数が N によって変わります: {counts}")
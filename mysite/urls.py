@@ -19,7 +19,10 @@ from django.conf import settings
 from django.contrib import admin
 from django.urls import include, path
 
+from .metrics import MetricsView
+
 urlpatterns = [
+    path("metrics", MetricsView.as_view(), name="metrics"),
     path("admin/", admin.site.urls),
     path("accounts/", include("accounts.urls")),
     path("tweets/", include("tweets.urls")),
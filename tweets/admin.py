@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import Like, Tweet
+from .models import Like, TimelineEntry, Tweet
 
 admin.site.register(Tweet)
 admin.site.register(Like)
+admin.site.register(TimelineEntry)
@@ -0,0 +1,79 @@
+import hashlib
+
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from . import stamps
+from .cache import tweet_cache
+from .counters import pending_like_delta
+from .viewer_state import ViewerState
+
+
+def tweet_payload(tweet):
+    return {
+        "id": tweet.id,
+        "user": tweet.user.username,
+        "content": tweet.content,
+        "created_at": tweet.created_at.isoformat(),
+        "like_count": max(tweet.like_count + pending_like_delta(tweet.id), 0),
+        "liked": tweet.liked_by_user,
+    }
+
+
+class TweetListApiMixin:
+    """ツイート一覧の JSON API (async)。検証子が変わっていなければツイートの行を読まずに 304 を返す
+
+    サブクラスは get_validator(token, since) で (一覧で最も新しい created_at または None, 変更時刻のスタンプのリスト,
+    検証子に加える値のリスト) を、get_page(token, since) でページを返す
+    """
+
+    page_size = 20
+
+    async def get_since(self):
+        since_id = self.request.GET.get("since_id")
+        if not since_id:
+            return None
+        tweet = await tweet_cache.aget(int(since_id))
+        if tweet is None:
+            raise ValueError("unknown since_id")
+        return (tweet.created_at, tweet.id)
+
+    def invalid_parameters(self):
+        return JsonResponse({"status": "error", "message": "無効なパラメータです"}, status=400)
+
+    async def get(self, request, *args, **kwargs):
+        token = request.GET.get("cursor")
+        try:
+            since = await self.get_since()
+            newest, version_stamps, parts = await self.get_validator(token, since)
+        except ValueError:
+            return self.invalid_parameters()
+        validator = ":".join(
+            str(part)
+            for part in [request.user.pk, newest, *version_stamps, *parts, token, request.GET.get("since_id")]
+        )
+        etag = quote_etag(hashlib.md5(validator.encode()).hexdigest())
+        last_modified = max(stamps.to_datetime(stamp) for stamp in version_stamps)
+        if newest is not None:
+            last_modified = max(last_modified, newest)
+        last_modified = int(last_modified.timestamp())
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            try:
+                page = await self.get_page(token, since)
+            except ValueError:
+                return self.invalid_parameters()
+            await ViewerState.for_request(request).aannotate(page.object_list)
+            response = JsonResponse(
+                {
+                    "status": "ok",
+                    "tweets": [tweet_payload(tweet) for tweet in page.object_list],
+                    "next_cursor": page.next_cursor,
+                }
+            )
+        response.headers["ETag"] = etag
+        response.headers["Last-Modified"] = http_date(last_modified)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
@@ -0,0 +1,7 @@
+from accounts.cache import user_cache
+from mysite.object_cache import ObjectCache
+
+from .models import Tweet
+
+# 作者が退会していれば、キャッシュに残っているツイートも見つからなかったことにする
+tweet_cache = ObjectCache(Tweet, parent=("user_id", user_cache))
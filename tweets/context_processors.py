@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+
+
+def like_stream_available(request):
+    # WSGI では応答を返し終えるまでワーカーのスレッドを使い続け、ストリームは終わらないため ASGI に限る
+    return settings.LIKE_STREAM_ENABLED and isinstance(request, ASGIRequest)
+
+
+def like_stream(request):
+    """tweets/script.html がいいね数のライブ更新 (LikeCountStreamView) に接続するか"""
+    return {"like_stream_enabled": like_stream_available(request)}
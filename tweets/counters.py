@@ -0,0 +1,87 @@
+import atexit
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from . import stamps
+from .cache import tweet_cache
+from .models import Tweet
+
+# LIKE_COUNT_FLUSH_INTERVAL 秒ごとにまとめて書き込むための、ツイートごとのいいね数の差分
+_pending = {}
+_lock = threading.Lock()
+_timer = None
+
+
+def _apply(tweet_id, delta):
+    # 行全体を save() せず like_count だけを F() で更新し、0 未満にはしない
+    Tweet.objects.filter(pk=tweet_id).update(like_count=Greatest(F("like_count") + delta, 0))
+    tweet_cache.invalidate(tweet_id)
+
+
+def _flush_in_background():
+    try:
+        flush_like_counts()
+    finally:
+        connections.close_all()
+
+
+def _buffer(tweet_id, delta):
+    global _timer
+    with _lock:
+        _pending[tweet_id] = _pending.get(tweet_id, 0) + delta
+        if _timer is None:
+            _timer = threading.Timer(settings.LIKE_COUNT_FLUSH_INTERVAL, _flush_in_background)
+            _timer.daemon = True
+            _timer.start()
+
+
+def _bump_stamps(tweet_id):
+    stamps.bump("tweet", tweet_id)
+    tweet = tweet_cache.get(tweet_id)
+    if tweet is not None:
+        stamps.bump("author", tweet.user_id)
+
+
+def record_like_delta(tweet_id, delta):
+    transaction.on_commit(lambda: _bump_stamps(tweet_id))
+    if settings.LIKE_COUNT_FLUSH_INTERVAL:
+        transaction.on_commit(lambda: _buffer(tweet_id, delta))
+    else:
+        _apply(tweet_id, delta)
+
+
+def pending_like_delta(tweet_id):
+    with _lock:
+        return _pending.get(tweet_id, 0)
+
+
+def like_count(tweet_id):
+    stored = Tweet.objects.filter(pk=tweet_id).values_list("like_count", flat=True).first() or 0
+    return max(stored + pending_like_delta(tweet_id), 0)
+
+
+def like_counts(tweet_ids):
+    stored = dict(Tweet.objects.filter(pk__in=tweet_ids).values_list("pk", "like_count"))
+    with _lock:
+        return {tweet_id: max(count + _pending.get(tweet_id, 0), 0) for tweet_id, count in stored.items()}
+
+
+def flush_like_counts():
+    global _pending, _timer
+    with _lock:
+        pending, _pending = _pending, {}
+        if _timer is not None:
+            _timer.cancel()
+            _timer = None
+    for tweet_id, delta in pending.items():
+        if delta:
+            with transaction.atomic():
+                _apply(tweet_id, delta)
+    return len(pending)
+
+
+atexit.register(flush_like_counts)
@@ -0,0 +1,60 @@
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from accounts.models import User
+
+from .models import Like
+from .pagination import KeysetPage, encode_cursor, paginate_keyset
+
+LIKERS_PAGE_SIZE = 20
+# 最初のページの (いいねの id, ユーザーの id, いいねした日時) をキャッシュしておく秒数。いいねの追加・取り消しで消す
+LIKERS_HEAD_TIMEOUT = 300
+
+
+def _head_key(tweet_id):
+    return f"likers_head:{tweet_id}"
+
+
+def invalidate_likers_head(tweet_id):
+    key = _head_key(tweet_id)
+    cache.delete(key)
+    # コミット前に別のリクエストが古い先頭を読み直して載せた場合に備え、コミット後にもう一度消す
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def _head(tweet_id):
+    key = _head_key(tweet_id)
+    rows = cache.get(key)
+    if rows is None:
+        # 共有のキャッシュに置くため、遅れているかもしれないレプリカではなくプライマリから読む (ObjectCache と同じ)
+        rows = list(
+            Like.objects.using(DEFAULT_DB_ALIAS)
+            .filter(liketweet_id=tweet_id)
+            .order_by("-created_at", "-id")
+            .values_list("pk", "likeuser_id", "created_at")[: LIKERS_PAGE_SIZE + 1]
+        )
+        cache.set(key, rows, LIKERS_HEAD_TIMEOUT)
+    return rows
+
+
+def likers_page(tweet_id, token):
+    """ツイートにいいねした Like (likeuser を読み込み済み) を新しい順に LIKERS_PAGE_SIZE 件ずつ
+
+    最初のページはキャッシュした先頭から作り、ユーザーはそのページの分だけ読む
+    """
+    visible_users = User.objects.filter(deleted_at__isnull=True)
+    if token:
+        likes = Like.objects.filter(liketweet_id=tweet_id, likeuser__in=visible_users.values("pk"))
+        return paginate_keyset(likes.select_related("likeuser"), token, LIKERS_PAGE_SIZE)
+
+    rows = _head(tweet_id)
+    has_next = len(rows) > LIKERS_PAGE_SIZE
+    rows = rows[:LIKERS_PAGE_SIZE]
+    users = visible_users.in_bulk([user_id for _, user_id, _ in rows])
+    likes = [
+        Like(pk=pk, likeuser=users[user_id], liketweet_id=tweet_id, created_at=created_at)
+        for pk, user_id, created_at in rows
+        if user_id in users
+    ]
+    next_cursor = encode_cursor(rows[-1][2], rows[-1][0]) if has_next else None
+    return KeysetPage(likes, has_next, next_cursor)
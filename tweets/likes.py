@@ -0,0 +1,41 @@
+from django.db import transaction
+
+from mysite.pubsub import get_broker
+
+from . import trending
+from .counters import like_count, record_like_delta
+from .models import Like
+
+
+def like_count_topic(tweet_id):
+    return f"like_count:{tweet_id}"
+
+
+def publish_like_count(tweet_id, count):
+    get_broker().publish(like_count_topic(tweet_id), count)
+
+
+def like(user, tweet):
+    with transaction.atomic():
+        _, created = Like.objects.get_or_create(likeuser=user, liketweet=tweet)
+        if created:
+            record_like_delta(tweet.pk, 1)
+            trending.record_like(tweet.pk, 1)
+    total_likes = like_count(tweet.pk)
+    if created:
+        publish_like_count(tweet.pk, total_likes)
+    return created, total_likes
+
+
+def unlike(user, tweet):
+    with transaction.atomic():
+        # トレンドのスコアからいいねした時刻の分を引くため、消す前に読む
+        liked = Like.objects.filter(likeuser=user, liketweet=tweet).first()
+        deleted = liked.delete()[0] if liked else 0
+        if deleted:
+            record_like_delta(tweet.pk, -1)
+            trending.record_like(tweet.pk, -1, liked_at=liked.created_at)
+    total_likes = like_count(tweet.pk)
+    if deleted:
+        publish_like_count(tweet.pk, total_likes)
+    return bool(deleted), total_likes
@@ -0,0 +1,83 @@
+import time
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.urls import reverse
+
+from accounts.models import User
+from mysite.benchmark import HEADER, HOST, auth_headers, format_summary, summarize, wsgi_request
+from mysite.testing import without_debug_toolbar
+from tweets.likes import unlike
+from tweets.models import Tweet
+
+# (名前, SESSION_ENGINE, AUTHENTICATION_BACKENDS)
+CONFIGURATIONS = [
+    ("db", "django.contrib.sessions.backends.db", ["django.contrib.auth.backends.ModelBackend"]),
+    ("cached_db", "django.contrib.sessions.backends.cached_db", ["accounts.backends.CachedModelBackend"]),
+    ("signed", "django.contrib.sessions.backends.signed_cookies", ["accounts.backends.CachedModelBackend"]),
+]
+
+
+class QueryCounter:
+    """セッションとユーザーを読むクエリと、すべてのクエリを数える"""
+
+    def __init__(self):
+        self.auth = 0
+        self.total = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.total += 1
+        if '"django_session"' in sql or sql.startswith('SELECT "accounts_user"'):
+            self.auth += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = "セッションとログイン中のユーザーの読み込み方ごとに、いいね・いいね取り消しを1件ずつ順に送り、1リクエストあたりの時間とクエリ数を比較します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--username", help="リクエストを送るユーザー (省略時は最初のユーザー)")
+        parser.add_argument("--requests", type=int, default=1000, help="構成ごとのリクエスト数")
+        parser.add_argument(
+            "--configuration", choices=[name for name, _, _ in CONFIGURATIONS], action="append", help="複数指定可"
+        )
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options["username"]).first() if options["username"] else None
+        user = user or User.objects.order_by("pk").first()
+        tweet = Tweet.objects.exclude(user=user).order_by("-pk").first() if user else None
+        if tweet is None:
+            raise CommandError("ユーザーとツイートが見つかりません。先に seed を実行してください")
+        paths = [reverse("tweets:like", kwargs={"pk": tweet.pk}), reverse("tweets:unlike", kwargs={"pk": tweet.pk})]
+        selected = options["configuration"] or [name for name, _, _ in CONFIGURATIONS]
+
+        self.stdout.write(f"user={user.username} tweet={tweet.pk} requests={options['requests']}")
+        self.stdout.write(f"{'config':<10} {HEADER} {'auth q/req':>10} {'q/req':>6}")
+        # 本番に近い条件にするため、DEBUG (クエリの記録) と debug_toolbar を外してハンドラを作る
+        with override_settings(DEBUG=False, ALLOWED_HOSTS=[HOST]), without_debug_toolbar:
+            for name, engine, backends in CONFIGURATIONS:
+                if name not in selected:
+                    continue
+                with override_settings(SESSION_ENGINE=engine, AUTHENTICATION_BACKENDS=backends):
+                    unlike(user, tweet)
+                    headers = auth_headers(user)
+                    app = WSGIHandler()
+                    # 一度目はキャッシュが空のため計測に含めない
+                    wsgi_request(app, "GET", reverse("tweets:home"), headers)
+                    counter = QueryCounter()
+                    results = []
+                    started = time.perf_counter()
+                    with connection.execute_wrapper(counter):
+                        for i in range(options["requests"]):
+                            start = time.perf_counter()
+                            status = wsgi_request(app, "POST", paths[i % 2], headers)
+                            results.append((status, time.perf_counter() - start))
+                    elapsed = time.perf_counter() - started
+                    unlike(user, tweet)
+                requests = max(len(results), 1)
+                self.stdout.write(
+                    f"{name:<10} {format_summary(summarize(results, elapsed))} "
+                    f"{counter.auth / requests:>10.2f} {counter.total / requests:>6.2f}"
+                )
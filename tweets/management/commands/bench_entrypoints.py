@@ -0,0 +1,150 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import override_settings
+from django.urls import reverse
+
+from accounts.follows import unfollow
+from accounts.models import Friendship, User
+from mysite.benchmark import HEADER, HOST, asgi_request, auth_headers, format_summary, summarize, wsgi_request
+from mysite.testing import without_debug_toolbar
+from tweets.likes import unlike
+from tweets.models import Tweet
+
+
+class Command(BaseCommand):
+    help = (
+        "同じリクエストを ASGI (async のビュー) と WSGI (スレッド) のエントリポイントに同時に送り、"
+        "リクエスト数/秒とレイテンシを比較します。seed で作ったデータベースに対して実行してください"
+    )
+
+    scenarios = ("like", "follow", "home_api", "profile_api")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--username", help="リクエストを送るユーザー (省略時はフォロー数の最も多いユーザー)")
+        parser.add_argument("--requests", type=int, default=1000, help="シナリオ・エントリポイントごとのリクエスト数")
+        parser.add_argument("--concurrency", type=int, default=50, help="同時に処理中にするリクエスト数")
+        parser.add_argument("--scenario", choices=self.scenarios, action="append", help="複数指定可 (省略時はすべて)")
+        parser.add_argument("--entrypoint", choices=("asgi", "wsgi"), action="append", help="複数指定可")
+
+    def get_user(self, username):
+        if username:
+            user = User.objects.filter(username=username).first()
+        else:
+            user = User.objects.order_by("-following_count", "pk").first()
+        if user is None:
+            raise CommandError("ユーザーが見つかりません。先に seed を実行してください")
+        return user
+
+    def get_targets(self, user, scenario, concurrency):
+        """(ワーカーごとの (method, path) の繰り返しパターン, いいね・フォローを実行前の状態に戻す関数) を返す
+
+        書き込みは他のワーカーとぶつからない対象を一つずつ割り当て、交互に付けたり外したりする
+        """
+        if scenario == "like":
+            tweets = list(Tweet.objects.exclude(user=user).order_by("-created_at", "-id")[:concurrency])
+
+            def reset():
+                for tweet in tweets:
+                    unlike(user, tweet)
+
+            targets = [
+                [
+                    ("POST", reverse("tweets:like", kwargs={"pk": tweet.pk})),
+                    ("POST", reverse("tweets:unlike", kwargs={"pk": tweet.pk})),
+                ]
+                for tweet in tweets
+            ]
+            return targets, reset
+        if scenario == "follow":
+            following_ids = Friendship.objects.filter(follower=user).values_list("following_id", flat=True)
+            others = list(User.objects.exclude(pk=user.pk).exclude(pk__in=following_ids).order_by("pk")[:concurrency])
+
+            def reset():
+                for other in others:
+                    unfollow(user, other)
+
+            targets = [
+                [
+                    ("POST", reverse("accounts:follow", kwargs={"username": other.username})),
+                    ("POST", reverse("accounts:unfollow", kwargs={"username": other.username})),
+                ]
+                for other in others
+            ]
+            return targets, reset
+        if scenario == "home_api":
+            path = reverse("tweets:api_home")
+        else:
+            path = reverse("accounts:api_tweets", kwargs={"username": user.username})
+        return [[("GET", path)]] * concurrency, lambda: None
+
+    def run_asgi(self, targets, headers, per_worker):
+        app = ASGIHandler()
+
+        async def worker(pattern):
+            results = []
+            for i in range(per_worker):
+                method, path = pattern[i % len(pattern)]
+                start = time.perf_counter()
+                status = await asgi_request(app, method, path, headers)
+                results.append((status, time.perf_counter() - start))
+            return results
+
+        async def main():
+            return await asyncio.gather(*[worker(pattern) for pattern in targets])
+
+        return [result for results in asyncio.run(main()) for result in results]
+
+    def run_wsgi(self, targets, headers, per_worker):
+        app = WSGIHandler()
+
+        def worker(pattern):
+            results = []
+            try:
+                for i in range(per_worker):
+                    method, path = pattern[i % len(pattern)]
+                    start = time.perf_counter()
+                    status = wsgi_request(app, method, path, headers)
+                    results.append((status, time.perf_counter() - start))
+            finally:
+                connections.close_all()
+            return results
+
+        with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+            return [result for results in executor.map(worker, targets) for result in results]
+
+    def report(self, entrypoint, scenario, results, elapsed):
+        self.stdout.write(f"{entrypoint:<5} {scenario:<12} {format_summary(summarize(results, elapsed))}")
+
+    def handle(self, *args, **options):
+        user = self.get_user(options["username"])
+        scenarios = options["scenario"] or self.scenarios
+        entrypoints = options["entrypoint"] or ("asgi", "wsgi")
+        headers = auth_headers(user)
+
+        self.stdout.write(f"user={user.username} concurrency={options['concurrency']} requests={options['requests']}")
+        self.stdout.write(f"{'entry':<5} {'scenario':<12} {HEADER}")
+        # 本番に近い条件にするため、DEBUG (クエリの記録) と debug_toolbar を外してハンドラを作る
+        with override_settings(DEBUG=False, ALLOWED_HOSTS=[HOST]), without_debug_toolbar:
+            for scenario in scenarios:
+                targets, reset = self.get_targets(user, scenario, options["concurrency"])
+                if not targets:
+                    self.stdout.write(self.style.WARNING(f"{scenario}: 対象がないためスキップします"))
+                    continue
+                per_worker = max(options["requests"] // len(targets), 1)
+                for entrypoint in entrypoints:
+                    reset()
+                    run = self.run_asgi if entrypoint == "asgi" else self.run_wsgi
+                    try:
+                        started = time.perf_counter()
+                        results = run(targets, headers, per_worker)
+                        elapsed = time.perf_counter() - started
+                    finally:
+                        connections.close_all()
+                        reset()
+                    self.report(entrypoint, scenario, results, elapsed)
@@ -0,0 +1,88 @@
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import modify_settings, override_settings
+from django.urls import reverse
+
+from accounts.models import User
+from mysite.benchmark import HEADER, HOST, auth_headers, format_summary, summarize, wsgi_request
+from mysite.metrics import record_query
+from mysite.testing import without_debug_toolbar
+
+
+@contextmanager
+def without_metrics():
+    """MetricsMiddleware・クエリの記録・テンプレートの計測を外す"""
+    templates = [{**settings.TEMPLATES[0], "BACKEND": "django.template.backends.django.DjangoTemplates"}]
+    with modify_settings(MIDDLEWARE={"remove": "mysite.metrics.MetricsMiddleware"}), override_settings(
+        TEMPLATES=templates
+    ):
+        wrappers = connection.execute_wrappers[:]
+        connection.execute_wrappers[:] = [wrapper for wrapper in wrappers if wrapper is not record_query]
+        try:
+            yield
+        finally:
+            connection.execute_wrappers[:] = wrappers
+
+
+@contextmanager
+def with_metrics():
+    yield
+
+
+CONFIGURATIONS = [("off", without_metrics), ("on", with_metrics)]
+
+
+class Command(BaseCommand):
+    help = (
+        "/metrics の計測 (MetricsMiddleware・クエリ・テンプレート) のあり・なしで同じページを交互に取得し、"
+        "p50 の増加が METRICS_OVERHEAD_BUDGET を超えたらエラーにします"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--username", help="リクエストを送るユーザー (省略時は最初のユーザー)")
+        parser.add_argument("--url-name", default="tweets:home", help="取得するページの URL 名")
+        parser.add_argument("--requests", type=int, default=200, help="1ラウンドあたりのリクエスト数")
+        parser.add_argument("--rounds", type=int, default=5, help="あり・なしを交互に計測する回数")
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options["username"]).first() if options["username"] else None
+        user = user or User.objects.order_by("pk").first()
+        if user is None:
+            raise CommandError("ユーザーが見つかりません。先に seed を実行してください")
+        path = reverse(options["url_name"])
+
+        self.stdout.write(f"user={user.username} path={path} requests={options['requests']}x{options['rounds']}")
+        self.stdout.write(f"{'metrics':<8} {HEADER}")
+        results = {name: [] for name, _ in CONFIGURATIONS}
+        elapsed = dict.fromkeys(results, 0.0)
+        # 本番に近い条件にするため、DEBUG (クエリの記録) と debug_toolbar を外してハンドラを作る
+        with override_settings(DEBUG=False, ALLOWED_HOSTS=[HOST]), without_debug_toolbar:
+            headers = auth_headers(user)
+            # 時間による揺れがどちらかに偏らないよう、ラウンドごとに交互に計測する
+            for _ in range(options["rounds"]):
+                for name, configuration in CONFIGURATIONS:
+                    with configuration():
+                        app = WSGIHandler()
+                        # 一度目はキャッシュが空のため計測に含めない
+                        wsgi_request(app, "GET", path, headers)
+                        started = time.perf_counter()
+                        for _ in range(options["requests"]):
+                            start = time.perf_counter()
+                            status = wsgi_request(app, "GET", path, headers)
+                            results[name].append((status, time.perf_counter() - start))
+                        elapsed[name] += time.perf_counter() - started
+
+        for name, _ in CONFIGURATIONS:
+            self.stdout.write(f"{name:<8} {format_summary(summarize(results[name], elapsed[name]))}")
+        off, on = (statistics.median(timing for _, timing in results[name]) for name in ("off", "on"))
+        overhead = (on - off) / off
+        budget = settings.METRICS_OVERHEAD_BUDGET
+        self.stdout.write(f"overhead p50: {(on - off) * 1000:+.3f} ms ({overhead:+.1%}, budget {budget:.0%})")
+        if overhead > budget:
+            raise CommandError("計測のオーバーヘッドが METRICS_OVERHEAD_BUDGET を超えています")
@@ -0,0 +1,127 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import override_settings
+from django.urls import reverse
+
+from accounts.models import User
+from mysite.benchmark import HEADER, HOST, auth_headers, format_summary, summarize, wsgi_request
+from mysite.testing import without_debug_toolbar
+from tweets.likes import unlike
+from tweets.models import Tweet
+
+BENCH_CONTENT = "bench_sqlite"
+
+
+class Command(BaseCommand):
+    help = (
+        "いいね (LikeView)・ツイート (TweetCreateView) の書き込みとホームタイムラインの読み込みを複数のスレッドから"
+        "同時に行い、SQLITE_PROFILES のプロファイルごとのスループットを比較します"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--username", help="リクエストを送るユーザー (省略時はフォロー数の最も多いユーザー)")
+        parser.add_argument("--writers", type=int, default=8, help="書き込むスレッド数 (いいねとツイートに半分ずつ)")
+        parser.add_argument("--readers", type=int, default=8, help="ホームタイムラインを読むスレッド数")
+        parser.add_argument("--duration", type=float, default=10, help="プロファイルごとの計測時間 (秒)")
+        parser.add_argument(
+            "--profile", choices=list(settings.SQLITE_PROFILES), action="append", help="複数指定可 (省略時はすべて)"
+        )
+
+    def get_user(self, username):
+        if username:
+            user = User.objects.filter(username=username).first()
+        else:
+            user = User.objects.order_by("-following_count", "pk").first()
+        if user is None:
+            raise CommandError("ユーザーが見つかりません。先に seed を実行してください")
+        return user
+
+    def get_workers(self, user, writers, readers):
+        """スレッドごとの (シナリオ名, 繰り返すリクエスト (method, path, body) のリスト)"""
+        tweets = list(Tweet.objects.exclude(user=user).order_by("-created_at", "-id")[: (writers + 1) // 2])
+        workers = [
+            (
+                "like",
+                [
+                    ("POST", reverse("tweets:like", kwargs={"pk": tweet.pk}), b""),
+                    ("POST", reverse("tweets:unlike", kwargs={"pk": tweet.pk}), b""),
+                ],
+            )
+            for tweet in tweets
+        ]
+        create = ("POST", reverse("tweets:create"), urlencode({"content": BENCH_CONTENT}).encode())
+        workers += [("tweet", [create])] * (writers - len(workers))
+        workers += [("home", [("GET", reverse("tweets:home"), b"")])] * readers
+
+        def reset():
+            for tweet in tweets:
+                unlike(user, tweet)
+            Tweet.objects.filter(user=user, content=BENCH_CONTENT).delete()
+
+        return workers, reset
+
+    def run(self, workers, headers, duration):
+        app = WSGIHandler()
+        headers = headers + [("Content-Type", "application/x-www-form-urlencoded")]
+        deadline = threading.Event()
+
+        def worker(requests):
+            results = []
+            try:
+                i = 0
+                while not deadline.is_set():
+                    method, path, body = requests[i % len(requests)]
+                    start = time.perf_counter()
+                    status = wsgi_request(app, method, path, headers, body)
+                    results.append((status, time.perf_counter() - start))
+                    i += 1
+            finally:
+                connections.close_all()
+            return results
+
+        with ThreadPoolExecutor(max_workers=len(workers)) as executor:
+            futures = [executor.submit(worker, requests) for _, requests in workers]
+            started = time.perf_counter()
+            time.sleep(duration)
+            deadline.set()
+            results = [future.result() for future in futures]
+            elapsed = time.perf_counter() - started
+
+        by_scenario = {}
+        for (scenario, _), worker_results in zip(workers, results):
+            by_scenario.setdefault(scenario, []).extend(worker_results)
+        return {scenario: summarize(results, elapsed) for scenario, results in by_scenario.items()}
+
+    def handle(self, *args, **options):
+        if connections[DEFAULT_DB_ALIAS].vendor != "sqlite":
+            raise CommandError("bench_sqlite は SQLite でのみ使えます")
+        user = self.get_user(options["username"])
+        headers = auth_headers(user)
+        workers, reset = self.get_workers(user, options["writers"], options["readers"])
+
+        self.stdout.write(
+            f"user={user.username} writers={options['writers']} readers={options['readers']} "
+            f"duration={options['duration']}s"
+        )
+        self.stdout.write(f"{'profile':<11} {'scenario':<8} {HEADER}")
+        # 本番に近い条件にするため、DEBUG (クエリの記録) と debug_toolbar を外してハンドラを作る
+        with override_settings(DEBUG=False, ALLOWED_HOSTS=[HOST]), without_debug_toolbar:
+            for profile in options["profile"] or list(settings.SQLITE_PROFILES):
+                with override_settings(SQLITE_PROFILE=profile):
+                    # journal_mode はファイルに残るため、他の接続を閉じてから新しいプロファイルで接続し直して切り替える
+                    connections.close_all()
+                    reset()
+                    try:
+                        summaries = self.run(workers, headers, options["duration"])
+                    finally:
+                        connections.close_all()
+                        reset()
+                for scenario, summary in summaries.items():
+                    self.stdout.write(f"{profile:<11} {scenario:<8} {format_summary(summary)}")
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tweets.trending import compact
+
+
+class Command(BaseCommand):
+    help = "トレンドの表から上位 --capacity 件より順位の低いツイートを取り除きます"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--capacity", type=int, default=settings.TRENDING_CAPACITY)
+
+    def handle(self, *args, **options):
+        deleted = compact(options["capacity"])
+        self.stdout.write(self.style.SUCCESS(f"{deleted} 件をトレンドの表から取り除きました"))
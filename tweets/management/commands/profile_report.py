@@ -0,0 +1,57 @@
+import pstats
+import statistics
+from collections import defaultdict
+from io import StringIO
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from mysite.profiling import SUFFIX, load_dump
+
+
+class _Stats:
+    """pstats.Stats に、読み込んだ統計をそのまま渡すためのもの"""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class Command(BaseCommand):
+    help = "ProfilingMiddleware が書き出したプロファイルをまとめ、時間のかかっている関数の上位を表示します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dir", help="プロファイルのディレクトリ (省略時は PROFILE_DIR)")
+        parser.add_argument("--view", action="append", help="URL 名で絞り込む (複数指定可)")
+        parser.add_argument("--top", type=int, default=20, help="表示する関数の数")
+        parser.add_argument(
+            "--sort", choices=["tottime", "cumulative", "ncalls"], default="tottime", help="並べる基準"
+        )
+
+    def handle(self, *args, **options):
+        directory = Path(options["dir"] or settings.PROFILE_DIR)
+        output = StringIO()
+        stats = None
+        durations = defaultdict(list)
+        for path in sorted(directory.glob(f"*{SUFFIX}")):
+            meta, dump = load_dump(path)
+            if options["view"] and meta["view"] not in options["view"]:
+                continue
+            durations[meta["view"]].append(meta["seconds"])
+            if stats is None:
+                stats = pstats.Stats(_Stats(dump), stream=output)
+            else:
+                stats.add(_Stats(dump))
+        if stats is None:
+            raise CommandError(f"{directory} にプロファイルがありません")
+
+        self.stdout.write(f"{'view':<32} {'dumps':>6} {'p50 ms':>8} {'max ms':>8}")
+        for view, seconds in sorted(durations.items()):
+            self.stdout.write(
+                f"{view:<32} {len(seconds):>6} {statistics.median(seconds) * 1000:>8.1f} {max(seconds) * 1000:>8.1f}"
+            )
+        stats.strip_dirs().sort_stats(options["sort"]).print_stats(options["top"])
+        self.stdout.write(output.getvalue(), ending="")
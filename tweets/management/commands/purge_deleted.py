@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from accounts.purge import purge_deleted_users
+from tweets.purge import PURGE_CHUNK_SIZE, purge_deleted_tweets
+
+
+class Command(BaseCommand):
+    help = "退会したユーザーと削除したツイートに関係する行を、チャンクごとの短いトランザクションで消します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=PURGE_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        users = purge_deleted_users(options["chunk_size"])
+        tweets = purge_deleted_tweets(chunk_size=options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"{users} 人のユーザーと {tweets} 件のツイートを消しました"))
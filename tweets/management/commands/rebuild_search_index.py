@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from tweets.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "ツイートの全文検索のインデックスをチャンクごとに作り直します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        indexed = rebuild_index(options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"{indexed} 件のツイートをインデックスに登録しました"))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import Friendship, User
+from tweets.timeline import backfill
+
+
+class Command(BaseCommand):
+    help = "既存のツイートとフォロー関係からホームタイムラインを再構築します"
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by("pk")
+        for user in users.iterator(chunk_size=1000):
+            backfill(user, user)
+            for friendship in Friendship.objects.filter(follower=user).select_related("following"):
+                backfill(user, friendship.following)
+        self.stdout.write(self.style.SUCCESS(f"{users.count()} 人のタイムラインを再構築しました"))
@@ -0,0 +1,183 @@
+import multiprocessing
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections
+from django.db.models import Count, IntegerField, Max, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from accounts.counters import recount_follow_counts
+from accounts.models import Friendship, User
+from tweets.models import Like, Tweet
+
+
+def power_law_index(rng, n, alpha):
+    # 1..n 上の有界なべき分布 (p(x) ∝ x^-alpha) から逆関数法で引き、0 始まりの順位を返す
+    u = rng.random()
+    if alpha == 1:
+        x = n**u
+    else:
+        x = ((n ** (1 - alpha) - 1) * u + 1) ** (1 / (1 - alpha))
+    return min(int(x), n) - 1
+
+
+def _retry(write):
+    # SQLite は書き込みが直列化されるため、他のワーカーとぶつかったら待ってやり直す
+    for attempt in range(10):
+        try:
+            return write()
+        except OperationalError as e:
+            if "locked" not in str(e) or attempt == 9:
+                raise
+            time.sleep(0.1 * (attempt + 1))
+
+
+def _seed_users(task):
+    prefix, start, end = task["prefix"], task["start"], task["end"]
+    users = [
+        User(username=f"{prefix}_{i}", email=f"{prefix}_{i}@example.com", password="!") for i in range(start, end)
+    ]
+    _retry(lambda: User.objects.bulk_create(users, ignore_conflicts=True))
+    return end - start
+
+
+def _seed_follows(task):
+    rng = random.Random(task["seed"])
+    user_ids, alpha = task["user_ids"], task["alpha"]
+    n = len(user_ids)
+    friendships = []
+    for follower_id in user_ids[task["start"] : task["end"]]:
+        for _ in range(int(rng.expovariate(1 / task["follows"]))):
+            following_id = user_ids[power_law_index(rng, n, alpha)]
+            if following_id != follower_id:
+                friendships.append(Friendship(follower_id=follower_id, following_id=following_id))
+    _retry(lambda: Friendship.objects.bulk_create(friendships, ignore_conflicts=True))
+    return len(friendships)
+
+
+def _seed_tweets(task):
+    rng = random.Random(task["seed"])
+    user_ids, alpha = task["user_ids"], task["alpha"]
+    tweets = [
+        Tweet(user_id=user_ids[power_law_index(rng, len(user_ids), alpha)], content=f"seed tweet {i}")
+        for i in range(task["start"], task["end"])
+    ]
+    _retry(lambda: Tweet.objects.bulk_create(tweets))
+    return len(tweets)
+
+
+def _seed_likes(task):
+    rng = random.Random(task["seed"])
+    user_ids, alpha = task["user_ids"], task["alpha"]
+    first_tweet_id, last_tweet_id = task["tweet_id_range"]
+    tweet_number = last_tweet_id - first_tweet_id + 1
+    # 新しいツイートほどいいねが集まりやすいとする
+    likes = [
+        Like(
+            likeuser_id=rng.choice(user_ids),
+            liketweet_id=last_tweet_id - power_law_index(rng, tweet_number, alpha),
+        )
+        for _ in range(task["start"], task["end"])
+    ]
+    _retry(lambda: Like.objects.bulk_create(likes, ignore_conflicts=True))
+    return len(likes)
+
+
+def _recount_likes(task):
+    counts = Like.objects.filter(liketweet=OuterRef("pk")).order_by().values("liketweet").annotate(n=Count("pk"))
+    _retry(
+        lambda: Tweet.objects.filter(pk__range=(task["start"], task["end"] - 1)).update(
+            like_count=Coalesce(Subquery(counts.values("n"), output_field=IntegerField()), 0)
+        )
+    )
+    return task["end"] - task["start"]
+
+
+def _recount_follows(task):
+    _retry(lambda: recount_follow_counts(task["user_ids"][task["start"] : task["end"]]))
+    return task["end"] - task["start"]
+
+
+PHASES = {
+    "users": _seed_users,
+    "follows": _seed_follows,
+    "tweets": _seed_tweets,
+    "likes": _seed_likes,
+    "like_counts": _recount_likes,
+    "follow_counts": _recount_follows,
+}
+
+
+# fork したワーカーが引き継ぐ、フェーズ内で共通のパラメータ (ユーザー ID の一覧など)
+_shared = {}
+
+
+def _run(args):
+    phase, task = args
+    try:
+        return PHASES[phase](dict(_shared, **task))
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "負荷試験用に、べき分布に従うフォロー関係・ツイート・いいねを大量に生成します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--tweets", type=int, default=10000)
+        parser.add_argument("--likes", type=int, default=10000)
+        parser.add_argument("--follows", type=float, default=20, help="1人あたりの平均フォロー数")
+        parser.add_argument("--alpha", type=float, default=1.5, help="人気度のべき分布の指数")
+        parser.add_argument("--chunk-size", type=int, default=5000)
+        parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+        parser.add_argument("--prefix", default="seed", help="生成するユーザー名の接頭辞")
+        parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+
+    def run_phase(self, phase, total, offset=0, **shared):
+        chunk_size = self.options["chunk_size"]
+        tasks = [
+            (phase, {"start": start, "end": min(start + chunk_size, total), "seed": self.options["seed"] + start})
+            for start in range(offset, total, chunk_size)
+        ]
+        _shared.clear()
+        _shared.update(shared)
+        started = time.monotonic()
+        if self.options["workers"] > 1:
+            # 子プロセスが親の接続を引き継がないよう、fork の前に閉じておく
+            connections.close_all()
+            with multiprocessing.get_context("fork").Pool(self.options["workers"]) as pool:
+                written = sum(pool.imap_unordered(_run, tasks))
+        else:
+            written = sum(PHASES[phase](dict(shared, **task)) for _, task in tasks)
+        self.stdout.write(f"{phase}: {written} 行 ({time.monotonic() - started:.1f} 秒)")
+
+    def handle(self, *args, **options):
+        self.options = options
+        prefix, alpha = options["prefix"], options["alpha"]
+
+        self.run_phase("users", options["users"], prefix=prefix)
+        user_ids = list(
+            User.objects.filter(username__startswith=f"{prefix}_").order_by("pk").values_list("pk", flat=True)
+        )
+        if not user_ids:
+            return
+
+        self.run_phase("follows", len(user_ids), user_ids=user_ids, alpha=alpha, follows=options["follows"])
+        self.run_phase("follow_counts", len(user_ids), user_ids=user_ids)
+
+        # 既存のツイートと混ざらないよう、今回作った範囲の ID だけを対象にする
+        first_tweet_id = (Tweet.objects.aggregate(last=Max("pk"))["last"] or 0) + 1
+        self.run_phase("tweets", options["tweets"], user_ids=user_ids, alpha=alpha)
+        tweet_ids = Tweet.objects.filter(pk__gte=first_tweet_id).aggregate(first=Min("pk"), last=Max("pk"))
+        if tweet_ids["first"] is None:
+            return
+
+        tweet_id_range = (tweet_ids["first"], tweet_ids["last"])
+        self.run_phase("likes", options["likes"], user_ids=user_ids, alpha=alpha, tweet_id_range=tweet_id_range)
+        self.run_phase("like_counts", tweet_ids["last"] + 1, offset=tweet_ids["first"])
+
+        self.stdout.write(
+            self.style.SUCCESS("生成が完了しました。ホームタイムラインは rebuild_timelines で作成してください")
+        )
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = "ローカルでレプリカの代わりに使う SQLite のファイルに、プライマリの内容を書き写します"
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("レプリカがありません。環境変数 DB_REPLICAS にレプリカの数を指定してください")
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != "sqlite":
+            raise CommandError(
+                "sync_replicas は SQLite でのみ使えます。本番ではデータベースのレプリケーションを使ってください"
+            )
+        primary.ensure_connection()
+        for alias in settings.DATABASE_REPLICAS:
+            replica = connections[alias]
+            replica.ensure_connection()
+            # オンラインバックアップ API を使うため、プライマリへの書き込みを止めずにコピーできる
+            primary.connection.backup(replica.connection)
+            self.stdout.write(f"{alias}: {replica.settings_dict['NAME']}")
+        self.stdout.write(self.style.SUCCESS(f"{len(settings.DATABASE_REPLICAS)} 個のレプリカを更新しました"))
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-17 15:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0006_tweet_like_count"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="tweet",
+            index=models.Index(fields=["created_at", "id"], name="tweet_created_id_idx"),
+        ),
+    ]
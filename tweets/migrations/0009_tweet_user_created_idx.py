@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-17 15:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0008_timelineentry"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="tweet",
+            index=models.Index(fields=["user", "created_at"], name="tweet_user_created_idx"),
+        ),
+    ]
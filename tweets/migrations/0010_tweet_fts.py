@@ -0,0 +1,25 @@
+from django.db import migrations
+
+
+def create_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    schema_editor.execute("CREATE VIRTUAL TABLE tweets_tweet_fts USING fts5(content, tokenize='trigram')")
+    schema_editor.execute("INSERT INTO tweets_tweet_fts (rowid, content) SELECT id, content FROM tweets_tweet")
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS tweets_tweet_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0009_tweet_user_created_idx"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0010_tweet_fts"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TrendingTweet",
+            fields=[
+                (
+                    "tweet",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="+",
+                        serialize=False,
+                        to="tweets.tweet",
+                    ),
+                ),
+                ("rank", models.FloatField()),
+            ],
+            options={
+                "indexes": [models.Index(fields=["-rank"], name="trending_rank_idx")],
+            },
+        ),
+    ]
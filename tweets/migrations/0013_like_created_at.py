@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:48
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0012_soft_delete"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="like",
+            name="created_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name="like",
+            index=models.Index(fields=["liketweet", "created_at"], name="like_tweet_created_idx"),
+        ),
+    ]
@@ -1,5 +1,16 @@
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
+
+
+class VisibleTweetManager(models.Manager):
+    """削除済み (deleted_at が入っている) のツイートと、退会済みのユーザーのツイートを除く
+
+    削除の後始末 (tweets.purge) では Tweet.all_objects を使う
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True, user__deleted_at__isnull=True)
 
 
 class Tweet(models.Model):
@@ -7,14 +18,55 @@ class Tweet(models.Model):
     content = models.TextField(max_length=140)
     created_at = models.DateTimeField(auto_now_add=True)
     like_count = models.PositiveIntegerField(default=0)
+    # 削除するとすぐに隠し、いいねやタイムラインは purge_deleted が後から少しずつ消す
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = VisibleTweetManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at", "id"], name="tweet_created_id_idx"),
+            models.Index(fields=["user", "created_at"], name="tweet_user_created_idx"),
+            models.Index(fields=["id"], name="tweet_deleted_idx", condition=models.Q(deleted_at__isnull=False)),
+        ]
 
     def __str__(self):
-        return f"{self.user.username} - {self.content} ({self.created_at})"
+        # キャッシュした行は user を読み込んでいないことがあり、ここで DB を読むと async の文脈 (debug_toolbar の
+        # キャッシュパネルなど) でエラーになるため、読み込み済みのときだけユーザー名を使う
+        author = self.user.username if Tweet.user.is_cached(self) else f"user {self.user_id}"
+        return f"{author} - {self.content} ({self.created_at})"
 
 
 class Like(models.Model):
     likeuser = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     liketweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="like_tweet")
+    # 追加前のいいねはマイグレーションを実行した時刻になる
+    created_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         constraints = [models.UniqueConstraint(fields=["likeuser", "liketweet"], name="unique_like")]
+        indexes = [models.Index(fields=["liketweet", "created_at"], name="like_tweet_created_idx")]
+
+
+class TimelineEntry(models.Model):
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="timeline_entries")
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="timeline_entries")
+    # ページングのキーをこのテーブルだけで完結させるため、ツイートの作成日時を複製して持つ
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["owner", "tweet"], name="unique_timeline_entry")]
+        indexes = [models.Index(fields=["owner", "created_at", "tweet"], name="timeline_owner_created_idx")]
+
+
+class TrendingTweet(models.Model):
+    """トレンドの上位 TRENDING_CAPACITY 件程度を持つ表 (tweets.trending)。rank は時間減衰したスコアの log2 に、
+    基準時刻からの経過 (半減期の数) を足したもので、時刻によらず行どうしをそのまま比べられる
+    """
+
+    tweet = models.OneToOneField(Tweet, on_delete=models.CASCADE, primary_key=True, related_name="+")
+    rank = models.FloatField()
+
+    class Meta:
+        indexes = [models.Index(fields=["-rank"], name="trending_rank_idx")]
@@ -0,0 +1,94 @@
+import base64
+from datetime import datetime
+
+from django.http import Http404
+
+
+class KeysetPage:
+    def __init__(self, object_list, has_next, next_cursor):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def encode_cursor(created_at, pk):
+    raw = f"{created_at.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    # 不正なトークンはすべて ValueError として扱う
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        created_at, pk = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(pk)
+    except (TypeError, UnicodeDecodeError, ValueError) as e:
+        raise ValueError("invalid cursor") from e
+
+
+def filter_before(queryset, cursor, created_field="created_at", id_field="id"):
+    # (created_at, id) < cursor を created_at の範囲検索として書くことで、インデックスの範囲読みになる
+    created_at, pk = cursor
+    return queryset.filter(**{f"{created_field}__lte": created_at}).exclude(
+        **{created_field: created_at, f"{id_field}__gte": pk}
+    )
+
+
+def filter_after(queryset, cursor, created_field="created_at", id_field="id"):
+    created_at, pk = cursor
+    return queryset.filter(**{f"{created_field}__gte": created_at}).exclude(
+        **{created_field: created_at, f"{id_field}__lte": pk}
+    )
+
+
+def _keyset_queryset(queryset, token, created_field, id_field, since):
+    if token:
+        queryset = filter_before(queryset, decode_cursor(token), created_field, id_field)
+    if since:
+        queryset = filter_after(queryset, since, created_field, id_field)
+    return queryset.order_by(f"-{created_field}", f"-{id_field}")
+
+
+def _keyset_page(rows, page_size, created_field, id_field):
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+    next_cursor = None
+    if has_next:
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, created_field), getattr(last, id_field))
+    return KeysetPage(rows, has_next, next_cursor)
+
+
+def paginate_keyset(queryset, token, page_size, created_field="created_at", id_field="id", since=None):
+    queryset = _keyset_queryset(queryset, token, created_field, id_field, since)
+    return _keyset_page(list(queryset[: page_size + 1]), page_size, created_field, id_field)
+
+
+async def apaginate_keyset(queryset, token, page_size, created_field="created_at", id_field="id", since=None):
+    queryset = _keyset_queryset(queryset, token, created_field, id_field, since)
+    return _keyset_page([row async for row in queryset[: page_size + 1]], page_size, created_field, id_field)
+
+
+class KeysetPaginationMixin:
+    """ListView の OFFSET ページングを (created_at, id) のカーソルページングに置き換える"""
+
+    cursor_kwarg = "cursor"
+    cursor_created_field = "created_at"
+    cursor_id_field = "id"
+
+    def get_keyset_page(self, queryset, token, page_size):
+        return paginate_keyset(queryset, token, page_size, self.cursor_created_field, self.cursor_id_field)
+
+    def paginate_queryset(self, queryset, page_size):
+        token = self.request.GET.get(self.cursor_kwarg)
+        try:
+            page = self.get_keyset_page(queryset, token, page_size)
+        except ValueError:
+            raise Http404("無効なカーソルです")
+        return (None, page, page.object_list, page.has_next)
@@ -0,0 +1,65 @@
+from django.db import transaction
+from django.utils import timezone
+
+from mysite.chunked_delete import delete_in_chunks, delete_rows, raw_delete
+
+from . import search, stamps
+from .cache import tweet_cache
+from .models import Like, TimelineEntry, TrendingTweet, Tweet
+
+PURGE_CHUNK_SIZE = 500
+
+
+def soft_delete_tweet(tweet):
+    """ツイートをすぐに隠す。いいねやタイムラインの行は purge_deleted_tweets が後から消す"""
+    with transaction.atomic():
+        tweet.deleted_at = timezone.now()
+        # キャッシュの削除・全文検索からの削除はシグナル (tweets.signals) で行う
+        tweet.save(update_fields=["deleted_at"])
+        raw_delete(TrendingTweet, [tweet.pk])
+
+
+def hide_tweets(user_id, chunk_size=PURGE_CHUNK_SIZE):
+    """退会したユーザーのツイートをチャンクごとに隠す"""
+
+    def hide(rows):
+        tweet_ids = [tweet_id for tweet_id, in rows]
+        Tweet.all_objects.filter(pk__in=tweet_ids).update(deleted_at=timezone.now())
+        raw_delete(TrendingTweet, tweet_ids)
+        search.unindex_tweets(tweet_ids)
+        for tweet_id in tweet_ids:
+            tweet_cache.invalidate(tweet_id)
+        stamps.bump_many(*[("tweet", tweet_id) for tweet_id in tweet_ids])
+
+    # 退会済みのユーザーのツイートは Tweet.objects に出ないため、all_objects から隠していないものを選ぶ
+    queryset = Tweet.all_objects.filter(user_id=user_id, deleted_at__isnull=True)
+    hidden = delete_in_chunks(queryset, ("pk",), chunk_size, hide)
+    if hidden:
+        stamps.bump("author", user_id)
+    return hidden
+
+
+def purge_tweets(tweet_ids, chunk_size=PURGE_CHUNK_SIZE):
+    """隠したツイートのいいね・タイムラインの行をチャンクごとに消してから、ツイートを消す"""
+    delete_in_chunks(Like.objects.filter(liketweet_id__in=tweet_ids), ("pk",), chunk_size, delete_rows(Like))
+    delete_in_chunks(
+        TimelineEntry.objects.filter(tweet_id__in=tweet_ids), ("pk",), chunk_size, delete_rows(TimelineEntry)
+    )
+    with transaction.atomic():
+        raw_delete(TrendingTweet, tweet_ids)
+        deleted = raw_delete(Tweet, tweet_ids)
+    for tweet_id in tweet_ids:
+        tweet_cache.invalidate(tweet_id)
+    return deleted
+
+
+def purge_deleted_tweets(queryset=None, chunk_size=PURGE_CHUNK_SIZE):
+    """隠したツイート (既定ではすべて) を chunk_size 件ずつ消し、消した件数を返す"""
+    if queryset is None:
+        queryset = Tweet.all_objects.filter(deleted_at__isnull=False)
+    purged = 0
+    while True:
+        tweet_ids = list(queryset.order_by("pk").values_list("pk", flat=True)[:chunk_size])
+        if not tweet_ids:
+            return purged
+        purged += purge_tweets(tweet_ids, chunk_size)
@@ -0,0 +1,125 @@
+import base64
+
+from django.db import connections, router, transaction
+
+from .models import Tweet
+from .pagination import KeysetPage
+
+# Tweet.content の全文検索用の FTS5 仮想テーブル (rowid = ツイートの id)。作成はマイグレーション 0010 で行う
+# 日本語は空白で単語に分かれないため、3文字ずつに区切る trigram トークナイザーを使う
+FTS_TABLE = "tweets_tweet_fts"
+MIN_TERM_LENGTH = 3
+
+
+def is_available(connection):
+    return connection.vendor == "sqlite"
+
+
+def _write_connection():
+    return connections[router.db_for_write(Tweet)]
+
+
+def index_tweet(tweet):
+    connection = _write_connection()
+    if not is_available(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [tweet.pk])
+        cursor.execute(f"INSERT INTO {FTS_TABLE} (rowid, content) VALUES (%s, %s)", [tweet.pk, tweet.content])
+
+
+def unindex_tweet(tweet_id):
+    unindex_tweets([tweet_id])
+
+
+def unindex_tweets(tweet_ids):
+    connection = _write_connection()
+    if not is_available(connection) or not tweet_ids:
+        return
+    placeholders = ", ".join(["%s"] * len(tweet_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", list(tweet_ids))
+
+
+def build_query(text):
+    """入力を空白で区切り、それぞれを語句として AND で検索する FTS5 のクエリにする
+
+    trigram では3文字未満の語句はどの行にも一致しないため捨てる。検索できる語句がなければ ValueError
+    """
+    terms = [term for term in text.split() if len(term) >= MIN_TERM_LENGTH]
+    if not terms:
+        raise ValueError(f"{MIN_TERM_LENGTH} 文字以上の語句を指定してください")
+    # 語句を "..." で囲み、FTS5 の演算子 (AND, NEAR, * など) として解釈させない
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def encode_rank_cursor(rank, pk):
+    return base64.urlsafe_b64encode(f"{rank!r}|{pk}".encode()).decode().rstrip("=")
+
+
+def decode_rank_cursor(token):
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        rank, pk = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        return float(rank), int(pk)
+    except (TypeError, UnicodeDecodeError, ValueError) as e:
+        raise ValueError("invalid cursor") from e
+
+
+def search_page(text, queryset, token, page_size):
+    """bm25 の順位 (小さいほど関連が高い) と id の順に並べた検索結果の1ページ"""
+    match = build_query(text)
+    connection = connections[router.db_for_read(Tweet)]
+    if not is_available(connection):
+        raise ValueError("全文検索はこのデータベースでは使えません")
+
+    sql = f"SELECT rowid, bm25({FTS_TABLE}) AS score FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+    params = [match]
+    if token:
+        rank, pk = decode_rank_cursor(token)
+        sql += " AND (score > %s OR (score = %s AND rowid > %s))"
+        params += [rank, rank, pk]
+    sql += " ORDER BY score, rowid LIMIT %s"
+    params.append(page_size + 1)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        keys = cursor.fetchall()
+
+    has_next = len(keys) > page_size
+    keys = keys[:page_size]
+    tweets = queryset.in_bulk([pk for pk, _ in keys])
+    object_list = [tweets[pk] for pk, _ in keys if pk in tweets]
+    next_cursor = encode_rank_cursor(keys[-1][1], keys[-1][0]) if has_next else None
+    return KeysetPage(object_list, has_next, next_cursor)
+
+
+def rebuild_index(chunk_size=1000):
+    """インデックスを作り直す。ツイートを id 順にチャンクごとに読み、それぞれを一つのトランザクションで書き込む
+
+    全体を先に消すと作り直している間は検索に出なくなるため、チャンクの範囲の行だけを消して入れ直す。
+    途中で作られたツイートはシグナルでも登録されるため、範囲を消してから入れることで重複させない
+    """
+    connection = _write_connection()
+    if not is_available(connection):
+        return 0
+    indexed = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic(using=connection.alias):
+            rows = list(
+                Tweet.objects.using(connection.alias)
+                .filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", "content")[:chunk_size]
+            )
+            with connection.cursor() as cursor:
+                if not rows:
+                    # 最後のチャンクより後にある行は、消えたツイートのもの
+                    cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid > %s", [last_pk])
+                    break
+                # 範囲にある消えたツイートの行も一緒に消える
+                cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid > %s AND rowid <= %s", [last_pk, rows[-1][0]])
+                cursor.executemany(f"INSERT INTO {FTS_TABLE} (rowid, content) VALUES (%s, %s)", rows)
+        last_pk = rows[-1][0]
+        indexed += len(rows)
+    return indexed
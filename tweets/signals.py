@@ -0,0 +1,32 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import search, stamps
+from .cache import tweet_cache
+from .likers import invalidate_likers_head
+from .models import Like, Tweet
+
+
+@receiver([post_save, post_delete], sender=Tweet)
+def invalidate_tweet(sender, instance, **kwargs):
+    tweet_cache.invalidate(instance.pk)
+    stamps.bump_many(("tweet", instance.pk), ("author", instance.user_id))
+
+
+@receiver([post_save, post_delete], sender=Like)
+def invalidate_liked_tweet(sender, instance, **kwargs):
+    tweet_cache.invalidate(instance.liketweet_id)
+    invalidate_likers_head(instance.liketweet_id)
+
+
+@receiver(post_save, sender=Tweet)
+def index_tweet(sender, instance, **kwargs):
+    if instance.deleted_at:
+        search.unindex_tweet(instance.pk)
+    else:
+        search.index_tweet(instance)
+
+
+@receiver(post_delete, sender=Tweet)
+def unindex_tweet(sender, instance, **kwargs):
+    search.unindex_tweet(instance.pk)
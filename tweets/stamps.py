@@ -0,0 +1,52 @@
+import time
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+
+# 一覧の内容が変わった時刻 (ナノ秒) をキャッシュに置き、条件付きリクエストの検証子に使う
+#   ("tweet", tweet_id) そのツイートのいいね数が変わった・ツイートが変更された・消えた
+#   ("author", user_id) その作者のツイートが追加・変更・削除された、またはいいね数が変わった
+#   ("home", user_id)   フォローの変更でそのユーザーのホームタイムラインが変わった
+#   ("deleted_users",)  ユーザーが退会した (そのツイートが一覧から消えた)。退会はまれなため全体で一つにする
+
+
+def _key(parts):
+    return "stamp:" + ":".join(str(part) for part in parts)
+
+
+def bump(*parts):
+    cache.set(_key(parts), time.time_ns(), None)
+
+
+def bump_many(*stamps):
+    now = time.time_ns()
+    cache.set_many({_key(parts): now for parts in stamps}, None)
+
+
+def _now_for_missing(keys, values):
+    # 追い出された場合は今を変更時刻とみなす (検証子が変わるだけで、古い内容は返らない)
+    return {key: time.time_ns() for key in keys if key not in values}
+
+
+def read(*stamps):
+    keys = [_key(parts) for parts in stamps]
+    values = cache.get_many(keys)
+    missing = _now_for_missing(keys, values)
+    if missing:
+        cache.set_many(missing, None)
+        values.update(missing)
+    return [values[key] for key in keys]
+
+
+async def aread(*stamps):
+    keys = [_key(parts) for parts in stamps]
+    values = await cache.aget_many(keys)
+    missing = _now_for_missing(keys, values)
+    if missing:
+        await cache.aset_many(missing, None)
+        values.update(missing)
+    return [values[key] for key in keys]
+
+
+def to_datetime(stamp):
+    return datetime.fromtimestamp(stamp / 1e9, tz=timezone.utc)
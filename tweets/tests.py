@@ -1,9 +1,36 @@
-from django.test import TestCase
+import json
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.http import StreamingHttpResponse
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
-from accounts.models import User
+from accounts.models import Friendship, User
+from mysite.db_router import STICKY_COOKIE_NAME, PrimaryReplicaRouter, reading_from_replica, replica_reads
+from mysite.metrics import registry
+from mysite.profiling import load_dump
+from mysite.pubsub import InMemoryBroker
+from mysite.testing import QueryBudgetMixin, QueryPlanAssertionsMixin, without_debug_toolbar
 
-from .models import Tweet
+from . import search, trending
+from .cache import tweet_cache
+from .counters import flush_like_counts, like_count, pending_like_delta
+from .likers import LIKERS_PAGE_SIZE
+from .models import Like, TimelineEntry, TrendingTweet, Tweet
+from .pagination import filter_before
+from .timeline import fan_out
+from .viewer_state import ViewerState
 
 
 class BaseTestCase(TestCase):
@@ -22,6 +49,206 @@ class TestHomeView(BaseTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertQuerysetEqual(response.context["object_list"], Tweet.objects.all())
 
+    def test_success_get_with_cursor(self):
+        tweets = [Tweet.objects.create(user=self.user, content=f"tweet{i}") for i in range(25)]
+        # created_at が同じツイートでも id で順序が決まることを確認する
+        Tweet.objects.update(created_at=tweets[0].created_at)
+        for tweet in Tweet.objects.all():
+            fan_out(tweet)
+        url = reverse("tweets:home")
+
+        response = self.client.get(url)
+        first_page = response.context["object_list"]
+        self.assertEqual(first_page, tweets[:4:-1])
+        self.assertTrue(response.context["page_obj"].has_next)
+
+        response = self.client.get(url, {"cursor": response.context["page_obj"].next_cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["object_list"], tweets[4::-1])
+        self.assertFalse(response.context["page_obj"].has_next)
+
+    def test_success_get_with_followed_users_tweets(self):
+        followed = User.objects.create_user(username="followed", password="testpassword")
+        stranger = User.objects.create_user(username="stranger", password="testpassword")
+        Friendship.objects.create(follower=self.user, following=followed)
+        followed_tweet = Tweet.objects.create(user=followed, content="followed")
+        fan_out(followed_tweet)
+        fan_out(Tweet.objects.create(user=stranger, content="stranger"))
+
+        response = self.client.get(reverse("tweets:home"))
+        self.assertEqual(response.context["object_list"], [followed_tweet])
+
+    def test_success_get_with_fanout_on_read(self):
+        followed = User.objects.create_user(username="followed", password="testpassword")
+        Friendship.objects.create(follower=self.user, following=followed)
+        User.objects.filter(pk=followed.pk).update(follower_count=1)
+        with self.settings(TIMELINE_FANOUT_THRESHOLD=0):
+            followed_tweet = Tweet.objects.create(user=followed, content="followed")
+            fan_out(followed_tweet)
+            self.assertFalse(TimelineEntry.objects.filter(owner=self.user).exists())
+            response = self.client.get(reverse("tweets:home"))
+        self.assertEqual(response.context["object_list"], [followed_tweet])
+
+    def test_failure_get_with_invalid_cursor(self):
+        response = self.client.get(reverse("tweets:home"), {"cursor": "invalid"})
+        self.assertEqual(response.status_code, 404)
+
+
+class TestTweetSearchView(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tweet = Tweet.objects.create(user=self.user, content="今日はいい天気ですね")
+        self.other = Tweet.objects.create(user=self.user, content="明日の天気は雨です")
+        self.url = reverse("tweets:search")
+
+    def search(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_success_get(self):
+        response = self.search(q="いい天気")
+        self.assertEqual(list(response.context["tweets"]), [self.tweet])
+
+    def test_success_get_with_multiple_terms(self):
+        response = self.search(q="天気は 雨です")
+        self.assertEqual(list(response.context["tweets"]), [self.other])
+
+    def test_success_get_with_cursor(self):
+        for i in range(25):
+            Tweet.objects.create(user=self.user, content=f"天気の話 {i}")
+        first = self.search(q="天気の")
+        page = first.context["page_obj"]
+        second = self.search(q="天気の", cursor=page.next_cursor)
+        ids = [tweet.id for tweet in first.context["tweets"]] + [tweet.id for tweet in second.context["tweets"]]
+        self.assertEqual(len(first.context["tweets"]), 20)
+        self.assertEqual(len(set(ids)), 25)
+
+    def test_success_index_follows_update_and_delete(self):
+        self.tweet.content = "今日は雪が降りました"
+        self.tweet.save()
+        self.assertFalse(self.search(q="いい天気").context["tweets"])
+        self.assertEqual(list(self.search(q="雪が降り").context["tweets"]), [self.tweet])
+        self.tweet.delete()
+        self.assertFalse(self.search(q="雪が降り").context["tweets"])
+
+    def test_failure_get_with_short_query(self):
+        response = self.search(q="天気")
+        self.assertFalse(response.context["tweets"])
+        self.assertIsNotNone(response.context["search_error"])
+
+    def test_failure_get_with_invalid_cursor(self):
+        response = self.client.get(self.url, {"q": "いい天気", "cursor": "invalid"})
+        self.assertEqual(response.status_code, 404)
+
+
+class TestRebuildSearchIndexCommand(BaseTestCase):
+    def test_success_rebuild(self):
+        Tweet.objects.bulk_create([Tweet(user=self.user, content=f"一括で作ったツイート{i}") for i in range(5)])
+        self.assertFalse(self.client.get(reverse("tweets:search"), {"q": "一括で作"}).context["tweets"])
+        out = StringIO()
+        call_command("rebuild_search_index", chunk_size=2, stdout=out)
+        self.assertIn("5 件", out.getvalue())
+        response = self.client.get(reverse("tweets:search"), {"q": "一括で作"})
+        self.assertEqual(len(response.context["tweets"]), 5)
+
+    def test_success_rebuild_with_tweet_indexed_meanwhile(self):
+        tweets = Tweet.objects.bulk_create(
+            [Tweet(user=self.user, content=f"一括で作ったツイート{i}") for i in range(4)]
+        )
+        # 消えたツイートの行は作り直すと消える
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {search.FTS_TABLE} (rowid, content) VALUES (%s, %s)",
+                [tweets[-1].pk + 100, "一括で作った消えたツイート"],
+            )
+        atomic = transaction.atomic
+        chunks = []
+
+        def atomic_creating_tweet(*args, **kwargs):
+            # 2つ目のチャンクを読む前に、シグナルでインデックスに入るツイートを作る
+            chunks.append(None)
+            if len(chunks) == 2:
+                Tweet.objects.create(user=self.user, content="一括で作ったのではないツイート")
+            return atomic(*args, **kwargs)
+
+        with mock.patch.object(search.transaction, "atomic", atomic_creating_tweet):
+            self.assertEqual(search.rebuild_index(chunk_size=2), 5)
+        response = self.client.get(reverse("tweets:search"), {"q": "一括で作"})
+        self.assertEqual(len(response.context["tweets"]), 5)
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {search.FTS_TABLE}")
+            self.assertEqual(cursor.fetchone()[0], 5)
+
+
+class TestTrending(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+        self.old, self.new = (Tweet.objects.create(user=self.user, content=name) for name in ("old", "new"))
+
+    def ranked(self):
+        return [entry.tweet for entry in trending.trending(10)]
+
+    def test_recent_engagement_ranks_higher(self):
+        # 半減期の2倍前の 3 いいねは、今の 1 いいねより低い
+        for _ in range(3):
+            trending.add_score(self.old.pk, 1, now=self.now - timezone.timedelta(seconds=2 * 6 * 60 * 60))
+        trending.add_score(self.new.pk, 1, now=self.now)
+        self.assertEqual(self.ranked(), [self.new, self.old])
+        entry = TrendingTweet.objects.get(tweet=self.old)
+        self.assertAlmostEqual(trending.current_score(entry.rank, self.now), 0.75)
+
+    def test_like_and_unlike_update_score(self):
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.old.pk}))
+        self.assertEqual(self.ranked(), [self.old])
+        self.client.post(reverse("tweets:unlike", kwargs={"pk": self.old.pk}))
+        # いいねの行の時刻とスコアを足した時刻のずれの分だけが残る
+        entry = TrendingTweet.objects.get(tweet=self.old)
+        self.assertLess(trending.current_score(entry.rank), 1e-6)
+
+    def test_unlike_subtracts_decayed_like(self):
+        # 半減期前のいいねを取り消しても、引くのは減衰した分だけで、他の反応の分は残る
+        liked_at = self.now - timezone.timedelta(seconds=6 * 60 * 60)
+        trending.add_score(self.old.pk, 1, now=liked_at)
+        trending.add_score(self.old.pk, 1, now=self.now)
+        trending.add_score(self.old.pk, -1, now=self.now, added_at=liked_at)
+        entry = TrendingTweet.objects.get(tweet=self.old)
+        self.assertAlmostEqual(trending.current_score(entry.rank, self.now), 1)
+
+    def test_unlike_keeps_entry_when_score_would_drop_below_zero(self):
+        trending.add_score(self.old.pk, 1, now=self.now - timezone.timedelta(seconds=6 * 60 * 60))
+        # いいねした時刻がわからない取り消しで今の重みを引いても、行は消さない
+        trending.add_score(self.old.pk, -1, now=self.now)
+        self.assertEqual(self.ranked(), [self.old])
+        entry = TrendingTweet.objects.get(tweet=self.old)
+        self.assertAlmostEqual(trending.current_score(entry.rank, self.now), trending.MIN_SCORE)
+
+    def test_create_records_tweet(self):
+        self.client.post(reverse("tweets:create"), {"content": "created"})
+        self.assertEqual([tweet.content for tweet in self.ranked()], ["created"])
+
+    @override_settings(TRENDING_CAPACITY=1)
+    def test_admission_and_compaction(self):
+        trending.add_score(self.old.pk, 2, now=self.now)
+        # 表が埋まっていれば、最下位より低いツイートは入れない
+        trending.add_score(self.new.pk, 1, now=self.now)
+        self.assertEqual(self.ranked(), [self.old])
+        trending.add_score(self.new.pk, 3, now=self.now)
+        self.assertEqual(self.ranked(), [self.new, self.old])
+
+        out = StringIO()
+        call_command("compact_trending", stdout=out)
+        self.assertIn("1 件", out.getvalue())
+        self.assertEqual(self.ranked(), [self.new])
+
+    def test_view(self):
+        trending.add_score(self.old.pk, 1, now=self.now)
+        trending.add_score(self.new.pk, 2, now=self.now)
+        response = self.client.get(reverse("tweets:trending"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["tweets"], [self.new, self.old])
+
 
 class TestTweetCreateView(BaseTestCase):
     def setUp(self):
@@ -32,6 +259,15 @@ class TestTweetCreateView(BaseTestCase):
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, 200)
 
+    def test_success_post_fans_out_to_followers(self):
+        follower = User.objects.create_user(username="follower", password="testpassword")
+        Friendship.objects.create(follower=follower, following=self.user)
+        self.client.post(self.url, {"content": "hello"})
+        tweet = Tweet.objects.get(content="hello")
+        self.assertCountEqual(
+            TimelineEntry.objects.filter(tweet=tweet).values_list("owner", flat=True), [self.user.pk, follower.pk]
+        )
+
     # 他のテストメソッドも同様に続く
 
 
@@ -45,10 +281,78 @@ class TestTweetDetailView(BaseTestCase):
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.context["tweet"], self.tweet)
+        self.assertFalse(response.context["tweet"].liked_by_user)
+
+    def test_success_get_with_liked_tweet(self):
+        Like.objects.create(likeuser=self.user, liketweet=self.tweet)
+        response = self.client.get(self.url)
+        self.assertTrue(response.context["tweet"].liked_by_user)
 
     # 他のテストメソッドも同様に続く
 
 
+class TestLikersView(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.tweet = Tweet.objects.create(user=self.user, content="testtweet")
+        self.url = reverse("tweets:likers", kwargs=dict(pk=self.tweet.pk))
+        now = timezone.now()
+        self.likers = User.objects.bulk_create(
+            [User(username=f"liker{i}", password="!") for i in range(LIKERS_PAGE_SIZE + 5)]
+        )
+        # liker0 が最も新しい
+        Like.objects.bulk_create(
+            [
+                Like(likeuser=liker, liketweet=self.tweet, created_at=now - timezone.timedelta(minutes=i))
+                for i, liker in enumerate(self.likers)
+            ]
+        )
+
+    def usernames(self, response):
+        return [like.likeuser.username for like in response.context["likes"]]
+
+    def test_newest_first_with_cursor(self):
+        response = self.client.get(self.url)
+        self.assertEqual(self.usernames(response), [liker.username for liker in self.likers[:LIKERS_PAGE_SIZE]])
+        page = response.context["page_obj"]
+        self.assertTrue(page.has_next)
+
+        response = self.client.get(self.url, {"cursor": page.next_cursor})
+        self.assertEqual(self.usernames(response), [liker.username for liker in self.likers[LIKERS_PAGE_SIZE:]])
+        self.assertFalse(response.context["page_obj"].has_next)
+
+    def test_first_page_from_cache(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.context["likes"]), LIKERS_PAGE_SIZE)
+        self.assertFalse([query for query in queries.captured_queries if "tweets_like" in query["sql"]])
+
+    def test_like_and_unlike_update_first_page(self):
+        self.client.get(self.url)
+        self.client.post(reverse("tweets:like", kwargs=dict(pk=self.tweet.pk)))
+        self.assertEqual(self.usernames(self.client.get(self.url))[0], "tester")
+        self.client.post(reverse("tweets:unlike", kwargs=dict(pk=self.tweet.pk)))
+        self.assertEqual(self.usernames(self.client.get(self.url))[0], "liker0")
+
+    def test_hides_deleted_users(self):
+        self.client.get(self.url)
+        User.objects.filter(pk=self.likers[0].pk).update(deleted_at=timezone.now())
+        self.assertNotIn("liker0", self.usernames(self.client.get(self.url)))
+
+    def test_detail_shows_first_page(self):
+        response = self.client.get(reverse("tweets:detail", kwargs=dict(pk=self.tweet.pk)))
+        self.assertContains(response, "liker0")
+        self.assertContains(response, f'{self.url}?cursor={response.context["likers"].next_cursor}')
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get(self.url, {"cursor": "invalid"}).status_code, 404)
+
+    def test_not_found_tweet(self):
+        self.assertEqual(self.client.get(reverse("tweets:likers", kwargs=dict(pk=0))).status_code, 404)
+
+
 class TestTweetDeleteView(BaseTestCase):
     def setUp(self):
         super().setUp()
@@ -73,6 +377,33 @@ class TestTweetDeleteView(BaseTestCase):
         )
         self.assertEqual(Tweet.objects.filter(content="tweet").count(), 0)
 
+    def test_soft_delete_hides_immediately(self):
+        Like.objects.create(likeuser=self.incorrect_user, liketweet=self.tweet)
+        fan_out(self.tweet)
+        trending.add_score(self.tweet.pk, 1)
+        self.client.get(reverse("tweets:detail", kwargs={"pk": self.tweet.pk}))
+        self.client.post(self.url)
+
+        # 行は残したまま、どこからも見えなくなる
+        self.assertTrue(Tweet.all_objects.filter(pk=self.tweet.pk).exists())
+        self.assertEqual(self.client.get(reverse("tweets:detail", kwargs={"pk": self.tweet.pk})).status_code, 404)
+        self.assertEqual(self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk})).status_code, 404)
+        self.assertEqual(self.client.get(reverse("tweets:home")).context["tweets"], [])
+        self.assertNotIn(self.tweet, self.client.get(reverse("tweets:search"), {"q": "tweet"}).context["tweets"])
+        self.assertEqual(self.client.get(reverse("tweets:trending")).context["tweets"], [])
+
+        out = StringIO()
+        call_command("purge_deleted", "--chunk-size=1", stdout=out)
+        self.assertIn("1 件のツイート", out.getvalue())
+        self.assertFalse(Tweet.all_objects.filter(pk=self.tweet.pk).exists())
+        self.assertFalse(Like.objects.filter(liketweet_id=self.tweet.pk).exists())
+        self.assertFalse(TimelineEntry.objects.filter(tweet_id=self.tweet.pk).exists())
+
+    def test_failure_post_other_users_tweet(self):
+        response = self.client.post(self.second_url)
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(Tweet.objects.filter(pk=self.ordinary_tweet.pk).exists())
+
 
 class TestLikeView(BaseTestCase):
     def setUp(self):
@@ -86,6 +417,55 @@ class TestLikeView(BaseTestCase):
         self.assertEqual(response.json()["is_liked"], True)
         self.assertEqual(response.json()["total_likes"], 1)
 
+    def test_success_post_twice(self):
+        self.client.post(self.url)
+        response = self.client.post(self.url)
+        self.assertEqual(response.json()["total_likes"], 1)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 1)
+
+    def test_success_post_with_buffered_count(self):
+        self.addCleanup(flush_like_counts)
+        with self.settings(LIKE_COUNT_FLUSH_INTERVAL=60), self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 0)
+        self.assertEqual(like_count(self.tweet.pk), 1)
+
+        flush_like_counts()
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 1)
+
+    async def test_success_post_on_asgi(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.post(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["total_likes"], 1)
+        self.assertTrue(await Like.objects.filter(likeuser=self.user, liketweet=self.tweet).aexists())
+
+    # SQL パネルは ASGI では計測を始めたスレッドの接続で止めないため、後のテストに残らないよう外す
+    @override_settings(
+        DEBUG=True,
+        DEBUG_TOOLBAR_CONFIG={
+            **settings.DEBUG_TOOLBAR_CONFIG,
+            "DISABLE_PANELS": {
+                "debug_toolbar.panels.profiling.ProfilingPanel",
+                "debug_toolbar.panels.redirects.RedirectsPanel",
+                "debug_toolbar.panels.sql.SQLPanel",
+            },
+        },
+    )
+    async def test_success_post_on_asgi_with_debug_toolbar(self):
+        # debug_toolbar のキャッシュパネルがキャッシュしたツイートを文字列にしても DB を読まない
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.post(self.url)
+        self.assertEqual(response.status_code, 200)
+
+    async def test_failure_post_on_asgi_without_login(self):
+        response = await self.async_client.post(self.url)
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(await Like.objects.filter(liketweet=self.tweet).aexists())
+
 
 class TestUnLikeView(BaseTestCase):
     def setUp(self):
@@ -99,3 +479,501 @@ class TestUnLikeView(BaseTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json()["is_liked"], False)
         self.assertEqual(response.json()["total_likes"], 0)
+
+    def test_success_post_with_zero_count(self):
+        # like_count がずれていても 0 未満にはならない
+        Like.objects.create(likeuser=self.user, liketweet=self.tweet)
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["total_likes"], 0)
+
+
+class TestLikeBatchView(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.liked = Tweet.objects.create(user=self.user, content="liked", like_count=1)
+        Like.objects.create(likeuser=self.user, liketweet=self.liked)
+        self.tweet = Tweet.objects.create(user=self.user, content="tweet")
+        self.url = reverse("tweets:like_batch")
+
+    def post(self, actions):
+        return self.client.post(self.url, json.dumps({"actions": actions}), content_type="application/json")
+
+    def test_success_post(self):
+        response = self.post(
+            [
+                {"tweet_id": self.tweet.pk, "liked": False},
+                {"tweet_id": self.tweet.pk, "liked": True},
+                {"tweet_id": self.liked.pk, "liked": False},
+                {"tweet_id": 10000, "liked": True},
+            ]
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["likes"],
+            {
+                str(self.tweet.pk): {"is_liked": True, "total_likes": 1},
+                str(self.liked.pk): {"is_liked": False, "total_likes": 0},
+            },
+        )
+        self.assertTrue(Like.objects.filter(likeuser=self.user, liketweet=self.tweet).exists())
+        self.assertFalse(Like.objects.filter(likeuser=self.user, liketweet=self.liked).exists())
+
+    def test_success_post_with_unchanged_state(self):
+        response = self.post([{"tweet_id": self.liked.pk, "liked": True}])
+        self.assertEqual(response.json()["likes"][str(self.liked.pk)]["total_likes"], 1)
+
+    def test_success_post_liked_meanwhile(self):
+        bulk_create = Like.objects.bulk_create
+
+        def bulk_create_after_other_request(*args, **kwargs):
+            # 読んだ後、書き込む前に同じいいねが入る (そちらのリクエストで数える)
+            Like.objects.create(likeuser=self.user, liketweet=self.tweet)
+            return bulk_create(*args, **kwargs)
+
+        with mock.patch.object(Like.objects, "bulk_create", bulk_create_after_other_request):
+            response = self.post([{"tweet_id": self.tweet.pk, "liked": True}])
+        self.assertEqual(response.json()["likes"][str(self.tweet.pk)]["total_likes"], 0)
+        self.assertEqual(pending_like_delta(self.tweet.pk), 0)
+        self.assertFalse(TrendingTweet.objects.filter(tweet=self.tweet).exists())
+
+    def test_failure_post_with_invalid_body(self):
+        response = self.post([{"tweet_id": "abc"}])
+        self.assertEqual(response.status_code, 400)
+
+    def test_failure_post_with_too_many_actions(self):
+        response = self.post([{"tweet_id": i, "liked": True} for i in range(101)])
+        self.assertEqual(response.status_code, 400)
+
+
+class TestLikeCountStreamView(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tweet = Tweet.objects.create(user=self.user, content="testtweet")
+        self.url = reverse("tweets:like_stream")
+
+    @override_settings(LIKE_STREAM_ENABLED=True)
+    async def test_success_get(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get(self.url, {"tweet_ids": self.tweet.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Content-Type"], "text/event-stream")
+        stream = response.streaming_content
+        self.assertTrue((await anext(stream)).startswith(b"retry:"))
+
+        await self.async_client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk}))
+        event = (await anext(stream)).decode()
+        await stream.aclose()
+        self.assertIn("event: like_count", event)
+        self.assertEqual(json.loads(event.split("data: ")[1]), {"tweet_id": self.tweet.pk, "like_count": 1})
+
+    async def test_success_coalesce_burst(self):
+        broker = InMemoryBroker()
+        subscription = broker.subscribe(["like_count:1", "like_count:2"])
+        for count in range(1, 4):
+            broker.publish("like_count:1", count)
+        broker.publish("like_count:3", 1)
+        self.assertEqual(await subscription.get(timeout=1), {"like_count:1": 3})
+        subscription.close()
+        self.assertEqual(broker.publish("like_count:1", 4), 0)
+
+    @override_settings(LIKE_STREAM_ENABLED=True)
+    async def test_failure_get_with_invalid_tweet_ids(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get(self.url, {"tweet_ids": "abc"})
+        self.assertEqual(response.status_code, 400)
+        response = await self.async_client.get(self.url, {"tweet_ids": ",".join(str(i) for i in range(1, 102))})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(LIKE_STREAM_ENABLED=True)
+    def test_no_stream_under_wsgi(self):
+        # WSGI ではストリームを開いたままにせず、すぐに 204 を返してスクリプトも接続しない
+        response = self.client.get(self.url, {"tweet_ids": self.tweet.pk})
+        self.assertEqual(response.status_code, 204)
+        self.assertNotIsInstance(response, StreamingHttpResponse)
+        response = self.client.get(reverse("tweets:home"))
+        self.assertNotContains(response, "EventSource(")
+
+    async def test_disabled_by_default(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get(self.url, {"tweet_ids": self.tweet.pk})
+        self.assertEqual(response.status_code, 204)
+
+
+class TestHomeTimelineApiView(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tweet = Tweet.objects.create(user=self.user, content="testtweet")
+        fan_out(self.tweet)
+        self.url = reverse("tweets:api_home")
+
+    def test_success_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([tweet["id"] for tweet in response.json()["tweets"]], [self.tweet.pk])
+        self.assertIn("ETag", response.headers)
+        self.assertIn("Last-Modified", response.headers)
+
+    def test_success_get_not_modified(self):
+        etag = self.client.get(self.url).headers["ETag"]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([query for query in queries.captured_queries if "tweets_tweet" in query["sql"]])
+
+    def test_success_get_modified_by_like(self):
+        etag = self.client.get(self.url).headers["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk}))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["tweets"][0]["like_count"], 1)
+        self.assertTrue(response.json()["tweets"][0]["liked"])
+
+    def test_success_get_not_modified_by_activity_elsewhere(self):
+        # ホームに載っていないツイートへのいいねや削除では検証子は変わらない
+        stranger = User.objects.create_user(username="stranger", password="testpassword")
+        other = Tweet.objects.create(user=stranger, content="elsewhere")
+        fan_out(other)
+        etag = self.client.get(self.url).headers["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("tweets:like", kwargs={"pk": other.pk}))
+        other.deleted_at = timezone.now()
+        other.save()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_success_get_modified_by_delete(self):
+        etag = self.client.get(self.url).headers["ETag"]
+        self.tweet.deleted_at = timezone.now()
+        self.tweet.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["tweets"], [])
+
+    def test_success_get_with_since_id(self):
+        newer = Tweet.objects.create(user=self.user, content="newer")
+        fan_out(newer)
+        response = self.client.get(self.url, {"since_id": self.tweet.pk})
+        self.assertEqual([tweet["id"] for tweet in response.json()["tweets"]], [newer.pk])
+
+    def test_failure_get_with_invalid_since_id(self):
+        response = self.client.get(self.url, {"since_id": "abc"})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_success_get_on_asgi(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([tweet["id"] for tweet in response.json()["tweets"]], [self.tweet.pk])
+        response = await self.async_client.get(self.url, headers={"If-None-Match": response.headers["ETag"]})
+        self.assertEqual(response.status_code, 304)
+
+
+@override_settings(DATABASE_REPLICAS=["replica1", "replica2"])
+class TestReplicaRouting(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tweet = Tweet.objects.create(user=self.user, content="testtweet")
+        fan_out(self.tweet)
+        self.reads = []
+
+    def get(self, url, **extra):
+        # 実際のクエリはテスト用のデータベースに送り、ルーターがレプリカを選んだかどうかだけを記録する
+        def db_for_read(router, model, **hints):
+            self.reads.append(reading_from_replica())
+            return "default"
+
+        with mock.patch.object(PrimaryReplicaRouter, "db_for_read", db_for_read):
+            return self.client.get(url, **extra)
+
+    def test_router(self):
+        router = PrimaryReplicaRouter()
+        self.assertEqual(router.db_for_read(Tweet), "default")
+        with replica_reads():
+            self.assertIn(router.db_for_read(Tweet), ["replica1", "replica2"])
+            self.assertEqual(router.db_for_write(Tweet), "default")
+        self.assertFalse(router.allow_migrate("replica1", "tweets"))
+
+    def test_success_get_from_replica(self):
+        response = self.get(reverse("tweets:home"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(any(self.reads))
+
+    def test_success_get_from_primary_after_write(self):
+        response = self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk}))
+        self.assertIn(STICKY_COOKIE_NAME, response.cookies)
+        response = self.get(reverse("tweets:detail", kwargs={"pk": self.tweet.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(self.reads)
+        self.assertFalse(any(self.reads))
+
+    def test_success_get_from_replica_after_stickiness_window(self):
+        self.client.cookies[STICKY_COOKIE_NAME] = "0"
+        self.get(reverse("tweets:home"))
+        self.assertTrue(any(self.reads))
+
+    def test_likers_head_from_primary(self):
+        # キャッシュに置くいいねの先頭は、レプリカのビューの中でもルーターを通さずプライマリから読む
+        Like.objects.create(likeuser=self.user, liketweet=self.tweet)
+        routed = []
+
+        def db_for_read(router, model, **hints):
+            routed.append(model)
+            return "default"
+
+        with mock.patch.object(PrimaryReplicaRouter, "db_for_read", db_for_read):
+            response = self.client.get(reverse("tweets:likers", kwargs={"pk": self.tweet.pk}))
+        self.assertEqual([like.likeuser for like in response.context["likes"]], [self.user])
+        self.assertTrue(routed)
+        self.assertNotIn(Like, routed)
+
+
+class TestQueryPlans(QueryPlanAssertionsMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="tester", password="testpassword")
+        self.cursor = (timezone.now(), 1)
+
+    def test_tweet_keyset_page(self):
+        queryset = filter_before(Tweet.objects.all(), self.cursor).order_by("-created_at", "-id")[:21]
+        self.assertIn("tweet_created_id_idx", self.assertIndexedPlan(queryset))
+
+    def test_timeline_keyset_page(self):
+        entries = filter_before(TimelineEntry.objects.filter(owner=self.user), self.cursor, id_field="tweet_id")
+        queryset = entries.order_by("-created_at", "-tweet_id").values_list("created_at", "tweet_id")[:21]
+        self.assertIn("timeline_owner_created_idx", self.assertIndexedPlan(queryset))
+
+    def test_user_tweets(self):
+        queryset = filter_before(Tweet.objects.filter(user=self.user), self.cursor).order_by("-created_at", "-id")[:21]
+        self.assertIn("tweet_user_created_idx", self.assertIndexedPlan(queryset))
+
+    def test_likes_of_tweet(self):
+        self.assertIndexedPlan(Like.objects.filter(liketweet_id=1))
+
+    def test_likers_keyset_page(self):
+        likes = filter_before(Like.objects.filter(liketweet_id=1), self.cursor).order_by("-created_at", "-id")
+        self.assertIn("like_tweet_created_idx", self.assertIndexedPlan(likes.select_related("likeuser")[:21]))
+
+    def test_deleted_tweets(self):
+        queryset = Tweet.all_objects.filter(deleted_at__isnull=False).order_by("pk").values_list("pk", flat=True)
+        self.assertIn("tweet_deleted_idx", self.assertIndexedPlan(queryset[:500]))
+
+    def test_trending(self):
+        queryset = TrendingTweet.objects.select_related("tweet__user").order_by("-rank")[:20]
+        self.assertIn("trending_rank_idx", self.assertIndexedPlan(queryset))
+
+
+class TestViewerState(BaseTestCase):
+    def test_liked_tweet_ids(self):
+        liked = Tweet.objects.create(user=self.user, content="a")
+        not_liked = Tweet.objects.create(user=self.user, content="b")
+        Like.objects.create(likeuser=self.user, liketweet=liked)
+        state = ViewerState(self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(state.liked_tweet_ids([liked.id, not_liked.id]), {liked.id})
+            # 一度取得したツイートはクエリを発行しない
+            self.assertEqual(state.liked_tweet_ids([liked.id]), {liked.id})
+
+
+class TestTweetCache(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tweet = Tweet.objects.create(user=self.user, content="testtweet")
+        self.url = reverse("tweets:detail", kwargs=dict(pk=self.tweet.pk))
+
+    def test_success_get_from_cache(self):
+        self.client.get(self.url)
+        hits = tweet_cache.hits
+        response = self.client.get(self.url)
+        self.assertEqual(response.context["tweet"], self.tweet)
+        self.assertEqual(tweet_cache.hits, hits + 1)
+
+    def test_str_without_query(self):
+        tweet = Tweet.objects.get(pk=self.tweet.pk)
+        with self.assertNumQueries(0):
+            self.assertIn("testtweet", str(tweet))
+        tweet = Tweet.objects.select_related("user").get(pk=self.tweet.pk)
+        self.assertTrue(str(tweet).startswith("tester - testtweet"))
+
+    def test_invalidate_on_like(self):
+        tweet_cache.get(self.tweet.pk)
+        self.client.post(reverse("tweets:like", kwargs=dict(pk=self.tweet.pk)))
+        self.assertEqual(tweet_cache.get(self.tweet.pk).like_count, 1)
+
+
+class TestViewBudgets(QueryBudgetMixin, BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tweet = Tweet.objects.create(user=self.user, content="testtweet")
+
+    def test_home(self):
+        self.assertQueryBudget("HomeView", 7, "get", lambda: reverse("tweets:home"), warm_budget=5)
+
+    def liked_tweet_url(self, name):
+        # シードで N 人がいいねしたツイート
+        return reverse(name, kwargs={"pk": Like.objects.filter(liketweet__user=self.user).latest("pk").liketweet_id})
+
+    def test_detail(self):
+        # いいねしたユーザーの最初のページ (キャッシュする先頭とユーザー) の2件を含む。
+        # 温まればツイートといいねの先頭はキャッシュから読み、閲覧者のいいねと、いいねしたユーザーだけを読む
+        self.assertQueryBudget(
+            "TweetDetailView", 6, "get", lambda: self.liked_tweet_url("tweets:detail"), warm_budget=2
+        )
+
+    def test_likers(self):
+        self.assertQueryBudget("LikersView", 6, "get", lambda: self.liked_tweet_url("tweets:likers"), warm_budget=2)
+
+    def test_trending(self):
+        # 計測のたびにトレンドの表に新しいツイートを加える
+        def url_for():
+            trending.add_score(Tweet.objects.create(user=self.user, content="trending").pk, 1)
+            return reverse("tweets:trending")
+
+        self.assertQueryBudget("TrendingView", 4, "get", url_for)
+
+    def test_like(self):
+        # 計測のたびに新しいツイートへいいねする
+        def url_for():
+            tweet = Tweet.objects.create(user=self.user, content="liked")
+            return reverse("tweets:like", kwargs={"pk": tweet.pk})
+
+        # トレンドの行の読み込み・最下位の rank・追加の3件を含む
+        self.assertQueryBudget("LikeView", 14, "post", url_for)
+
+
+@without_debug_toolbar
+class TestMetrics(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+        self.tweet = Tweet.objects.create(user=self.user, content="testtweet")
+
+    def test_records_queries_and_template_time(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("tweets:detail", kwargs=dict(pk=self.tweet.pk)))
+        metrics = registry.get("tweets:detail", "GET")
+        self.assertEqual(metrics.requests, 1)
+        self.assertEqual(metrics.queries, len(queries))
+        self.assertGreater(metrics.db_seconds, 0)
+        self.assertGreater(metrics.template_seconds, 0)
+        self.assertEqual(metrics.statuses, {200: 1})
+
+    def test_records_queries_of_async_view(self):
+        self.client.post(reverse("tweets:like", kwargs=dict(pk=self.tweet.pk)))
+        self.assertGreater(registry.get("tweets:like", "POST").queries, 0)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_exposition(self):
+        self.client.get(reverse("tweets:detail", kwargs=dict(pk=self.tweet.pk)))
+        self.client.get("/no-such-page/")
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        body = response.content.decode()
+        labels = 'view="tweets:detail",method="GET"'
+        self.assertIn(f'django_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 1', body)
+        self.assertIn(f"django_http_request_duration_seconds_count{{{labels}}} 1", body)
+        self.assertIn(f'django_http_responses_total{{{labels},status="200"}} 1', body)
+        self.assertIn('django_http_responses_total{view="unresolved",method="GET",status="404"} 1', body)
+        # /metrics 自体は記録しない
+        self.assertNotIn('view="metrics"', body)
+        buckets = [
+            int(line.rsplit(" ", 1)[1])
+            for line in body.splitlines()
+            if line.startswith(f"django_http_request_duration_seconds_bucket{{{labels}")
+        ]
+        self.assertEqual(buckets, sorted(buckets))
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_object_cache_counters(self):
+        url = reverse("tweets:detail", kwargs=dict(pk=self.tweet.pk))
+        self.client.get(url)
+        self.client.get(url)
+        body = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret").content.decode()
+        self.assertIn(f'object_cache_hits_total{{model="tweets.tweet"}} {tweet_cache.hits}', body)
+        self.assertIn(f'object_cache_misses_total{{model="tweets.tweet"}} {tweet_cache.misses}', body)
+        self.assertIn('object_cache_hits_total{model="accounts.user"}', body)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_token(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        self.assertEqual(self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_denied_without_token_setting(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        self.assertEqual(self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer ").status_code, 403)
+
+
+@without_debug_toolbar
+class TestProfiling(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings = override_settings(PROFILE_DIR=self.directory, PROFILE_SAMPLE_RATE=0, PROFILE_URL_SAMPLE_RATES={})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def dumps(self):
+        return [load_dump(path)[0] for path in sorted(Path(self.directory).glob("*.prof.gz"))]
+
+    def test_not_sampled(self):
+        self.client.get(reverse("tweets:home"))
+        self.assertEqual(self.dumps(), [])
+
+    @override_settings(PROFILE_SAMPLE_RATE=1)
+    def test_dump_with_request_metadata(self):
+        self.client.get(reverse("tweets:home"))
+        (meta,) = self.dumps()
+        self.assertEqual(
+            {key: meta[key] for key in ("view", "method", "path", "status", "reason")},
+            {
+                "view": "tweets:home",
+                "method": "GET",
+                "path": reverse("tweets:home"),
+                "status": 200,
+                "reason": "sample",
+            },
+        )
+
+    @override_settings(PROFILE_URL_SAMPLE_RATES={"tweets:home": 1, "tweets:search": 0}, PROFILE_SAMPLE_RATE=1)
+    def test_url_sample_rates(self):
+        self.client.get(reverse("tweets:home"))
+        self.client.get(reverse("tweets:search"))
+        self.client.get(reverse("tweets:trending"))
+        self.assertEqual([meta["view"] for meta in self.dumps()], ["tweets:home", "tweets:trending"])
+        self.assertEqual(self.dumps()[0]["reason"], "url")
+
+    @override_settings(PROFILE_TOKEN="secret")
+    def test_header(self):
+        self.client.get(reverse("tweets:home"), HTTP_X_PROFILE="wrong")
+        self.client.get(reverse("tweets:home"), HTTP_X_PROFILE="secret")
+        self.assertEqual([meta["reason"] for meta in self.dumps()], ["header"])
+
+    @override_settings(PROFILE_SAMPLE_RATE=1, PROFILE_MAX_FILES=2)
+    def test_rotation(self):
+        for name in ("tweets:home", "tweets:search", "tweets:trending"):
+            self.client.get(reverse(name))
+        self.assertEqual([meta["view"] for meta in self.dumps()], ["tweets:search", "tweets:trending"])
+
+    @override_settings(PROFILE_SAMPLE_RATE=1)
+    def test_report(self):
+        self.client.get(reverse("tweets:home"))
+        self.client.get(reverse("tweets:home"))
+        self.client.get(reverse("tweets:trending"))
+        out = StringIO()
+        call_command("profile_report", view=["tweets:home"], top=5, stdout=out)
+        self.assertRegex(out.getvalue(), r"tweets:home\s+2\s")
+        self.assertNotIn("tweets:trending", out.getvalue())
+        self.assertIn("Ordered by: internal time", out.getvalue())
+
+
+class TestSeedCommand(TestCase):
+    def test_success_seed(self):
+        call_command("seed", users=30, tweets=100, likes=300, follows=5, workers=1, chunk_size=40, stdout=StringIO())
+        self.assertEqual(User.objects.filter(username__startswith="seed_").count(), 30)
+        self.assertEqual(Tweet.objects.count(), 100)
+        self.assertFalse(Tweet.objects.annotate(n=Count("like_tweet")).exclude(like_count=F("n")).exists())
+        self.assertFalse(User.objects.annotate(n=Count("followings")).exclude(follower_count=F("n")).exists())
@@ -0,0 +1,134 @@
+from django.conf import settings
+
+from accounts.models import Friendship
+
+from . import stamps
+from .models import TimelineEntry, Tweet
+from .pagination import KeysetPage, decode_cursor, encode_cursor, filter_after, filter_before
+
+FANOUT_BATCH_SIZE = 1000
+
+
+def _follower_ids_for_fanout(user):
+    # 閾値+1 件だけ読めば、フォロワー数を数えずに fan-out-on-read の対象かどうか判定できる
+    threshold = settings.TIMELINE_FANOUT_THRESHOLD
+    followers = Friendship.objects.filter(following=user).values_list("follower_id", flat=True)
+    follower_ids = list(followers[: threshold + 1])
+    if len(follower_ids) > threshold:
+        return None
+    return follower_ids
+
+
+def fan_out(tweet):
+    owner_ids = _follower_ids_for_fanout(tweet.user) or []
+    owner_ids.append(tweet.user_id)
+    for start in range(0, len(owner_ids), FANOUT_BATCH_SIZE):
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(owner_id=owner_id, tweet=tweet, created_at=tweet.created_at)
+                for owner_id in owner_ids[start : start + FANOUT_BATCH_SIZE]
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def backfill(owner, author):
+    stamps.bump("home", owner.pk)
+    if _follower_ids_for_fanout(author) is None:
+        return
+    recent = Tweet.objects.filter(user=author).order_by("-created_at", "-id")[: settings.TIMELINE_BACKFILL_SIZE]
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(owner=owner, tweet=tweet, created_at=tweet.created_at) for tweet in recent],
+        ignore_conflicts=True,
+    )
+
+
+def backfill_authors(owner, author_ids):
+    """まとめてフォローした author_ids の最近のツイートを、合わせて TIMELINE_BACKFILL_SIZE 件だけ取り込む"""
+    stamps.bump("home", owner.pk)
+    recent = Tweet.objects.filter(
+        user_id__in=author_ids, user__follower_count__lte=settings.TIMELINE_FANOUT_THRESHOLD
+    ).order_by("-created_at", "-id")[: settings.TIMELINE_BACKFILL_SIZE]
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(owner=owner, tweet=tweet, created_at=tweet.created_at) for tweet in recent],
+        ignore_conflicts=True,
+    )
+
+
+def purge(owner, author):
+    stamps.bump("home", owner.pk)
+    TimelineEntry.objects.filter(owner=owner, tweet__user=author).delete()
+
+
+def _fanout_on_read_authors(user):
+    return Friendship.objects.filter(
+        follower=user, following__follower_count__gt=settings.TIMELINE_FANOUT_THRESHOLD
+    ).values_list("following_id", flat=True)
+
+
+def fanout_on_read_author_ids(user):
+    return list(_fanout_on_read_authors(user))
+
+
+async def afanout_on_read_author_ids(user):
+    return [author_id async for author_id in _fanout_on_read_authors(user)]
+
+
+def _timeline_key_querysets(user, author_ids, cursor, since, page_size):
+    entries = TimelineEntry.objects.filter(owner=user)
+    if cursor:
+        entries = filter_before(entries, cursor, id_field="tweet_id")
+    if since:
+        entries = filter_after(entries, since, id_field="tweet_id")
+    yield entries.order_by("-created_at", "-tweet_id").values_list("created_at", "tweet_id")[: page_size + 1]
+
+    # user_id IN (...) にすると全件をソートすることになるため、作者ごとにインデックスの範囲読みをしてマージする
+    for author_id in author_ids:
+        pulled = Tweet.objects.filter(user_id=author_id)
+        if cursor:
+            pulled = filter_before(pulled, cursor)
+        if since:
+            pulled = filter_after(pulled, since)
+        yield pulled.order_by("-created_at", "-id").values_list("created_at", "id")[: page_size + 1]
+
+
+def _merge_keys(keys, merged, page_size):
+    if merged:
+        keys = sorted(set(keys), reverse=True)
+    has_next = len(keys) > page_size
+    keys = keys[:page_size]
+    next_cursor = encode_cursor(*keys[-1]) if has_next else None
+    return keys, has_next, next_cursor
+
+
+def home_timeline_page(user, queryset, token, page_size, since=None):
+    cursor = decode_cursor(token) if token else None
+    author_ids = fanout_on_read_author_ids(user)
+    keys = []
+    for key_queryset in _timeline_key_querysets(user, author_ids, cursor, since, page_size):
+        keys.extend(key_queryset)
+    keys, has_next, next_cursor = _merge_keys(keys, bool(author_ids), page_size)
+
+    tweets = queryset.in_bulk([pk for _, pk in keys])
+    object_list = [tweets[pk] for _, pk in keys if pk in tweets]
+    return KeysetPage(object_list, has_next, next_cursor)
+
+
+async def ahome_timeline_keys(user, token, page_size, since=None):
+    """ページに載るツイートの (created_at, id) を、ツイートの行を読まずに (keys, has_next, next_cursor) で返す"""
+    cursor = decode_cursor(token) if token else None
+    author_ids = await afanout_on_read_author_ids(user)
+    keys = []
+    for key_queryset in _timeline_key_querysets(user, author_ids, cursor, since, page_size):
+        keys.extend([key async for key in key_queryset])
+    return _merge_keys(keys, bool(author_ids), page_size)
+
+
+async def ahydrate_timeline_page(queryset, keys, has_next, next_cursor):
+    tweets = await queryset.ain_bulk([pk for _, pk in keys])
+    object_list = [tweets[pk] for _, pk in keys if pk in tweets]
+    return KeysetPage(object_list, has_next, next_cursor)
+
+
+async def ahome_timeline_page(user, queryset, token, page_size, since=None):
+    return await ahydrate_timeline_page(queryset, *await ahome_timeline_keys(user, token, page_size, since=since))
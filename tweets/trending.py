@@ -0,0 +1,85 @@
+import math
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone as django_timezone
+
+from .models import TrendingTweet
+
+# rank の基準時刻。スコアを基準時刻からの経過で増やしていくことで (forward decay)、行ごとに減衰させ直さずに比べられる
+TRENDING_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+TWEET_WEIGHT = 1.0
+LIKE_WEIGHT = 1.0
+# 取り消しの計算の誤差などでスコアが 0 以下になっても行は消さず (他の反応の分まで消えてしまうため)、この値で止める
+MIN_SCORE = 1e-9
+
+
+def _offset(now):
+    return (now - TRENDING_EPOCH).total_seconds() / settings.TRENDING_HALF_LIFE
+
+
+def current_score(rank, now=None):
+    """rank を now の時点の (減衰した) スコアに戻す"""
+    return 2.0 ** (rank - _offset(now or django_timezone.now()))
+
+
+def _nth_rank(n):
+    # rank の降順のインデックスを先頭から n 件たどるだけで求まる
+    return TrendingTweet.objects.order_by("-rank").values_list("rank", flat=True)[n - 1 : n].first()
+
+
+def add_score(tweet_id, weight, now=None, added_at=None):
+    """ツイートのスコアに weight を足す (負ならいいねの取り消し)。Like の表は読まない
+
+    added_at を渡すと、その時刻に足した weight が now までに減衰した分だけを足す (取り消しではいいねした時刻を渡す)
+    """
+    offset = _offset(now or django_timezone.now())
+    # 呼び出し元 (いいね・ツイートの書き込み) のトランザクションに含め、セーブポイントは作らない
+    with transaction.atomic(savepoint=False):
+        entry = TrendingTweet.objects.select_for_update().filter(tweet_id=tweet_id).first()
+        if entry is None:
+            if weight <= 0:
+                return
+            rank = math.log2(weight) + offset
+            # 表が埋まっていれば、今の最下位より上になる場合だけ入れる
+            threshold = _nth_rank(settings.TRENDING_CAPACITY)
+            if threshold is None or rank > threshold:
+                # 同時に最初のスコアが付いた場合はどちらか一方だけが入る
+                TrendingTweet.objects.bulk_create([TrendingTweet(tweet_id=tweet_id, rank=rank)], ignore_conflicts=True)
+            return
+        if added_at is not None:
+            weight *= 2.0 ** (_offset(added_at) - offset)
+        score = max(2.0 ** (entry.rank - offset) + weight, MIN_SCORE)
+        entry.rank = math.log2(score) + offset
+        entry.save(update_fields=["rank"])
+
+
+def record_tweet(tweet):
+    add_score(tweet.pk, TWEET_WEIGHT, now=tweet.created_at)
+
+
+def record_like(tweet_id, delta, liked_at=None):
+    """liked_at は取り消したいいねの Like.created_at"""
+    add_score(tweet_id, LIKE_WEIGHT * delta, added_at=liked_at)
+
+
+def trending(limit):
+    """スコアの高い順に limit 件の TrendingTweet (tweet と user を読み込み済み)。表の先頭だけを読む
+
+    退会済みのユーザーのツイートは、purge_deleted が表から消すまでここで除く
+    """
+    return list(
+        TrendingTweet.objects.select_related("tweet__user")
+        .filter(tweet__user__deleted_at__isnull=True)
+        .order_by("-rank")[:limit]
+    )
+
+
+def compact(capacity=None):
+    """上位 capacity 件より順位の低い行を消し、消した件数を返す"""
+    threshold = _nth_rank(capacity or settings.TRENDING_CAPACITY)
+    if threshold is None:
+        return 0
+    deleted, _ = TrendingTweet.objects.filter(rank__lt=threshold).delete()
+    return deleted
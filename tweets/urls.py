@@ -7,8 +7,14 @@ app_name = "tweets"
 urlpatterns = [
     path("home/", views.HomeView.as_view(), name="home"),
     path("create/", views.TweetCreateView.as_view(), name="create"),
+    path("trending/", views.TrendingView.as_view(), name="trending"),
+    path("search/", views.TweetSearchView.as_view(), name="search"),
     path("<int:pk>/", views.TweetDetailView.as_view(), name="detail"),
     path("<int:pk>/delete/", views.TweetDeleteView.as_view(), name="delete"),
+    path("<int:pk>/likes/", views.LikersView.as_view(), name="likers"),
     path("<int:pk>/like/", views.LikeView.as_view(), name="like"),
     path("<int:pk>/unlike/", views.UnlikeView.as_view(), name="unlike"),
+    path("likes/batch/", views.LikeBatchView.as_view(), name="like_batch"),
+    path("likes/stream/", views.LikeCountStreamView.as_view(), name="like_stream"),
+    path("api/home/", views.HomeTimelineApiView.as_view(), name="api_home"),
 ]
@@ -0,0 +1,48 @@
+from .models import Like
+
+
+class ViewerState:
+    """閲覧ユーザーがいいねしているかどうかを、表示するツイートの分だけまとめて取得する"""
+
+    def __init__(self, user):
+        self.user = user
+        self._liked = {}
+
+    @classmethod
+    def for_request(cls, request):
+        if not hasattr(request, "_viewer_state"):
+            request._viewer_state = cls(request.user)
+        return request._viewer_state
+
+    def _missing(self, tweet_ids):
+        return {tweet_id for tweet_id in tweet_ids if tweet_id not in self._liked}
+
+    def _likes(self, missing):
+        return Like.objects.filter(likeuser=self.user, liketweet_id__in=missing).values_list("liketweet_id", flat=True)
+
+    def _remember(self, missing, liked):
+        for tweet_id in missing:
+            self._liked[tweet_id] = tweet_id in liked
+
+    def liked_tweet_ids(self, tweet_ids):
+        missing = self._missing(tweet_ids)
+        if missing:
+            self._remember(missing, set(self._likes(missing)))
+        return {tweet_id for tweet_id in tweet_ids if self._liked[tweet_id]}
+
+    async def aliked_tweet_ids(self, tweet_ids):
+        missing = self._missing(tweet_ids)
+        if missing:
+            self._remember(missing, {tweet_id async for tweet_id in self._likes(missing)})
+        return {tweet_id for tweet_id in tweet_ids if self._liked[tweet_id]}
+
+    def _annotate(self, tweets, liked):
+        for tweet in tweets:
+            tweet.liked_by_user = tweet.id in liked
+        return tweets
+
+    def annotate(self, tweets):
+        return self._annotate(tweets, self.liked_tweet_ids([tweet.id for tweet in tweets]))
+
+    async def aannotate(self, tweets):
+        return self._annotate(tweets, await self.aliked_tweet_ids([tweet.id for tweet in tweets]))
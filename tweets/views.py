@@ -1,29 +1,101 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import JsonResponse
-from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.urls import reverse_lazy
+from django.utils import timezone
 from django.views.generic import CreateView, DeleteView, DetailView, ListView, View
 
+from accounts.cache import user_cache
+from accounts.relationships import annotate_relationships
+from accounts.suggestions import SUGGESTION_PANEL_SIZE, suggestions_for
+from mysite.async_auth import AsyncLoginRequiredMixin
+from mysite.db_router import ReplicaReadMixin
+from mysite.object_cache import aget_cached_or_404, get_cached_or_404
+from mysite.pubsub import get_broker
 from tweets.forms import CreateTweetForm
 
 # from django.db.models import Count  # modelsをインポート
+from . import stamps, trending
+from .api import TweetListApiMixin
+from .cache import tweet_cache
+from .context_processors import like_stream_available
+from .counters import like_counts, record_like_delta
+from .likers import LIKERS_PAGE_SIZE, invalidate_likers_head, likers_page
+from .likes import like, like_count_topic, publish_like_count, unlike
 from .models import Like, Tweet
+from .pagination import KeysetPage, KeysetPaginationMixin
+from .purge import soft_delete_tweet
+from .search import build_query, search_page
+from .timeline import ahome_timeline_keys, ahydrate_timeline_page, fan_out, home_timeline_page
+from .viewer_state import ViewerState
 
 
-class HomeView(LoginRequiredMixin, ListView):
+class HomeView(LoginRequiredMixin, ReplicaReadMixin, KeysetPaginationMixin, ListView):
     model = Tweet
     template_name = "tweets/home.html"
     context_object_name = "tweets"
+    paginate_by = 20
 
     def get_queryset(self):
         return Tweet.objects.all().select_related("user")
 
+    def get_keyset_page(self, queryset, token, page_size):
+        return home_timeline_page(self.request.user, queryset, token, page_size)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user_likes = Like.objects.filter(likeuser=self.request.user).values_list("liketweet_id", flat=True)
-        for tweet in context["tweets"]:
-            tweet.liked_by_user = tweet.id in user_likes
+        ViewerState.for_request(self.request).annotate(context["tweets"])
+        context["suggestions"] = suggestions_for(self.request.user, SUGGESTION_PANEL_SIZE)
+        return context
+
+
+class TweetSearchView(LoginRequiredMixin, ReplicaReadMixin, KeysetPaginationMixin, ListView):
+    model = Tweet
+    template_name = "tweets/search.html"
+    context_object_name = "tweets"
+    paginate_by = 20
+
+    def get_queryset(self):
+        return Tweet.objects.select_related("user")
+
+    def get_keyset_page(self, queryset, token, page_size):
+        return search_page(self.request.GET.get("q", ""), queryset, token, page_size)
+
+    def paginate_queryset(self, queryset, page_size):
+        # 検索語が短すぎる場合は 404 にせず、空の結果とメッセージを表示する
+        try:
+            build_query(self.request.GET.get("q", ""))
+        except ValueError as e:
+            self.search_error = str(e)
+            return (None, KeysetPage([], False, None), [], False)
+        return super().paginate_queryset(queryset, page_size)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        ViewerState.for_request(self.request).annotate(context["tweets"])
+        context["query"] = self.request.GET.get("q", "")
+        context["search_error"] = getattr(self, "search_error", None)
+        return context
+
+
+class TrendingView(LoginRequiredMixin, ReplicaReadMixin, ListView):
+    """トレンドの表の先頭 limit 件だけを読む (Tweet・Like の表は走査しない)"""
+
+    template_name = "tweets/trending.html"
+    context_object_name = "tweets"
+    limit = 20
+
+    def get_queryset(self):
+        return [entry.tweet for entry in trending.trending(self.limit)]
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        ViewerState.for_request(self.request).annotate(context["tweets"])
         return context
 
 
@@ -35,26 +107,52 @@ class TweetCreateView(LoginRequiredMixin, CreateView):
 
     def form_valid(self, form):
         form.instance.user = self.request.user
-        return super().form_valid(form)
+        # ツイートとタイムラインへの書き込みを一つの書き込みトランザクション (BEGIN IMMEDIATE) にまとめる
+        with transaction.atomic():
+            response = super().form_valid(form)
+            fan_out(self.object)
+            trending.record_tweet(self.object)
+        return response
 
 
-class TweetDetailView(LoginRequiredMixin, DetailView):
+class TweetDetailView(LoginRequiredMixin, ReplicaReadMixin, DetailView):
     template_name = "tweets/detail.html"
     model = Tweet
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
-        return queryset.select_related("user")
+    def get_object(self, queryset=None):
+        tweet = get_cached_or_404(tweet_cache, pk=self.kwargs["pk"])
+        tweet.user = user_cache.get(tweet.user_id)
+        return tweet
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         tweet = self.object
-
-        user_likes = set(Like.objects.filter(likeuser=self.request.user).values_list("liketweet_id", flat=True))
-        tweet.liked_by_user = tweet.id in user_likes
+        ViewerState.for_request(self.request).annotate([tweet])
 
         context["user"] = self.request.user
         context["tweet"] = tweet
+        context["likers"] = likers_page(tweet.pk, None)
+        return context
+
+
+class LikersView(LoginRequiredMixin, ReplicaReadMixin, KeysetPaginationMixin, ListView):
+    """ツイートにいいねしたユーザーを新しい順に表示する"""
+
+    template_name = "tweets/likers.html"
+    context_object_name = "likes"
+    paginate_by = LIKERS_PAGE_SIZE
+
+    def get_queryset(self):
+        self.tweet = get_cached_or_404(tweet_cache, pk=self.kwargs["pk"])
+        return Like.objects.filter(liketweet=self.tweet)
+
+    def get_keyset_page(self, queryset, token, page_size):
+        return likers_page(self.tweet.pk, token)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        annotate_relationships(self.request.user, [like.likeuser for like in context["likes"]])
+        context["tweet"] = self.tweet
         return context
 
 
@@ -63,29 +161,148 @@ class TweetDeleteView(LoginRequiredMixin, DeleteView):
     model = Tweet
     success_url = reverse_lazy(settings.LOGIN_REDIRECT_URL)
 
+    def get_queryset(self):
+        return Tweet.objects.filter(user=self.request.user)
+
+    def form_valid(self, form):
+        # いいねやタイムラインの行を一度に消すと書き込みを長く止めるため、ここでは隠すだけにする (purge_deleted で消す)
+        soft_delete_tweet(self.object)
+        return HttpResponseRedirect(self.get_success_url())
+
+
+class LikeView(AsyncLoginRequiredMixin, View):
+    async def post(self, *args, **kwargs):
+        likedtweet = await aget_cached_or_404(tweet_cache, pk=kwargs["pk"])
+        # トランザクションは async のコードでは使えないため、書き込みはまとめて一度だけスレッドで行う
+        liked, total_likes = await sync_to_async(like)(self.request.user, likedtweet)
+        return JsonResponse({"status": "ok", "is_liked": liked, "total_likes": total_likes})
+
+
+class UnlikeView(AsyncLoginRequiredMixin, View):
+    async def post(self, *args, **kwargs):
+        unlikedtweet = await aget_cached_or_404(tweet_cache, pk=kwargs["pk"])
+        deleted, total_likes = await sync_to_async(unlike)(self.request.user, unlikedtweet)
+        liked = not deleted
+        return JsonResponse({"status": "ok", "is_liked": liked, "total_likes": total_likes})
+
+
+class LikeBatchView(LoginRequiredMixin, View):
+    max_actions = 100
 
-class LikeView(LoginRequiredMixin, View):
-    def post(self, *args, **kwargs):
-        likedtweet = get_object_or_404(Tweet, pk=kwargs["pk"])
-        if not Like.objects.filter(likeuser=self.request.user, liketweet=likedtweet).exists():
-            Like.objects.create(likeuser=self.request.user, liketweet=likedtweet)
-            likedtweet.like_count += 1
-            likedtweet.save()
-            liked = True
-        else:
-            liked = False
-        return JsonResponse({"status": "ok", "is_liked": liked, "total_likes": likedtweet.like_count})
-
-
-class UnlikeView(LoginRequiredMixin, View):
     def post(self, *args, **kwargs):
-        unlikedtweet = get_object_or_404(Tweet, pk=kwargs["pk"])
-        like_instance = Like.objects.filter(likeuser=self.request.user, liketweet=unlikedtweet).first()
-        if like_instance:
-            like_instance.delete()
-            unlikedtweet.like_count -= 1
-            unlikedtweet.save()
-            liked = False
-        else:
-            liked = True
-        return JsonResponse({"status": "ok", "is_liked": liked, "total_likes": unlikedtweet.like_count})
+        try:
+            actions = json.loads(self.request.body)["actions"]
+            # 同じツイートへの操作は最後のものだけを反映する
+            desired = {int(action["tweet_id"]): bool(action["liked"]) for action in actions}
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({"status": "error", "message": "リクエストの形式が正しくありません"}, status=400)
+        if len(desired) > self.max_actions:
+            return JsonResponse(
+                {"status": "error", "message": f"一度に操作できるのは {self.max_actions} 件までです"}, status=400
+            )
+
+        user = self.request.user
+        with transaction.atomic():
+            tweet_ids = set(Tweet.objects.filter(pk__in=desired).values_list("pk", flat=True))
+            # いいねした時刻は、取り消すときにトレンドのスコアから引く分に使う
+            liked = dict(
+                Like.objects.filter(likeuser=user, liketweet_id__in=tweet_ids).values_list(
+                    "liketweet_id", "created_at"
+                )
+            )
+            to_like = {tweet_id for tweet_id in tweet_ids if desired[tweet_id]} - liked.keys()
+            to_unlike = {tweet_id for tweet_id in tweet_ids if not desired[tweet_id]} & liked.keys()
+            now = timezone.now()
+            Like.objects.bulk_create(
+                [Like(likeuser=user, liketweet_id=tweet_id, created_at=now) for tweet_id in to_like],
+                ignore_conflicts=True,
+            )
+            if to_like:
+                # ignore_conflicts は飛ばした行を返さないため、このリクエストの時刻で入った行だけを作ったものとする
+                # (読んだ後に他のリクエストが入れたいいねは、そちらで数える)
+                to_like = set(
+                    Like.objects.filter(likeuser=user, liketweet_id__in=to_like, created_at=now).values_list(
+                        "liketweet_id", flat=True
+                    )
+                )
+            if to_unlike:
+                Like.objects.filter(likeuser=user, liketweet_id__in=to_unlike).delete()
+            for tweet_id in to_like:
+                record_like_delta(tweet_id, 1)
+                trending.record_like(tweet_id, 1)
+                # bulk_create はシグナルを送らない
+                invalidate_likers_head(tweet_id)
+            for tweet_id in to_unlike:
+                record_like_delta(tweet_id, -1)
+                trending.record_like(tweet_id, -1, liked_at=liked[tweet_id])
+
+        counts = like_counts(tweet_ids)
+        for tweet_id in to_like | to_unlike:
+            publish_like_count(tweet_id, counts[tweet_id])
+        return JsonResponse(
+            {
+                "status": "ok",
+                "likes": {
+                    tweet_id: {"is_liked": desired[tweet_id], "total_likes": counts[tweet_id]}
+                    for tweet_id in tweet_ids
+                },
+            }
+        )
+
+
+class LikeCountStreamView(AsyncLoginRequiredMixin, View):
+    """表示中のツイートのいいね数の変化を Server-Sent Events で送る
+
+    LIKE_STREAM_ENABLED でない場合と WSGI の場合は 204 を返す (EventSource は 204 で再接続をやめる)
+    """
+
+    max_tweets = 100
+    keepalive = 15
+
+    async def stream(self, tweet_ids):
+        subscription = get_broker().subscribe(like_count_topic(tweet_id) for tweet_id in tweet_ids)
+        topics = {like_count_topic(tweet_id): tweet_id for tweet_id in tweet_ids}
+        try:
+            yield f"retry: {self.keepalive * 1000}\n\n"
+            while True:
+                updates = await subscription.get(timeout=self.keepalive)
+                if not updates:
+                    yield ": keepalive\n\n"
+                    continue
+                for topic, count in updates.items():
+                    data = json.dumps({"tweet_id": topics[topic], "like_count": count})
+                    yield f"event: like_count\ndata: {data}\n\n"
+                # 間隔の間に届いた更新はツイートごとに最新のものだけが残り、次にまとめて送られる
+                await asyncio.sleep(settings.LIKE_STREAM_INTERVAL)
+        finally:
+            subscription.close()
+
+    async def get(self, request, *args, **kwargs):
+        if not like_stream_available(request):
+            return HttpResponse(status=204)
+        try:
+            tweet_ids = {int(tweet_id) for tweet_id in request.GET.get("tweet_ids", "").split(",") if tweet_id}
+        except ValueError:
+            return HttpResponseBadRequest("無効なツイートIDです")
+        if not tweet_ids or len(tweet_ids) > self.max_tweets:
+            return HttpResponseBadRequest(f"ツイートIDは 1 件以上 {self.max_tweets} 件以下で指定してください")
+        response = StreamingHttpResponse(self.stream(tweet_ids), content_type="text/event-stream")
+        response.headers["Cache-Control"] = "no-cache"
+        # リバースプロキシにバッファリングさせない
+        response.headers["X-Accel-Buffering"] = "no"
+        return response
+
+
+class HomeTimelineApiView(AsyncLoginRequiredMixin, TweetListApiMixin, View):
+    async def get_validator(self, token, since):
+        # ページに載るツイートの id (インデックスだけで読む) と、それらのツイートのスタンプで判定する。
+        # 載っていないツイートのいいねや削除では変わらない
+        user = self.request.user
+        self.keys = await ahome_timeline_keys(user, token, self.page_size, since=since)
+        keys = self.keys[0]
+        version_stamps = await stamps.aread(("home", user.pk), ("deleted_users",), *[("tweet", pk) for _, pk in keys])
+        newest = keys[0][0] if keys else None
+        return newest, version_stamps, [pk for _, pk in keys]
+
+    async def get_page(self, token, since):
+        return await ahydrate_timeline_page(Tweet.objects.select_related("user"), *self.keys)